@@ -1,5 +1,6 @@
 from django.apps import AppConfig
-import os
+
+from rest.apps import is_serving as _is_serving
 
 
 class AiLocalConfig(AppConfig):
@@ -10,23 +11,29 @@ class AiLocalConfig(AppConfig):
     def ready(self):
         """
         This method is called when Django starts up.
-        We'll use it to pre-load the local model.
+        With LOCAL_MODEL_WARMUP, we start loading the local model in the
+        background so startup isn't blocked; otherwise it loads on first use.
+        Every serving process loads its own copy, so warmup is off by default.
         """
-        # Only load the model if we're not in migration mode
-        # This prevents model loading during migrations
-        if os.environ.get('RUN_MAIN', None) != 'true':
+        from django.conf import settings
+        if not getattr(settings, 'LOCAL_MODEL_WARMUP', False) or not _is_serving():
+            return
+        # With a shared inference server the model is loaded there, not here
+        if getattr(settings, 'LOCAL_INFERENCE_URL', ''):
+            return
+        # Nothing would use the model
+        if 'local' not in getattr(settings, 'PLAN_GENERATOR_BACKENDS', ['local']):
             return
             
         try:
-            print("🤖 Loading local AI model on Django startup...")
             from .services import get_local_model
             
-            # This will trigger the model loading
             model = get_local_model()
-            if model.model:
-                print("✅ Local AI model loaded successfully on startup!")
+            if model.lifecycle:
+                print("🤖 Loading local AI model in the background...")
+                model.lifecycle.start_warmup()
             else:
-                print("⚠️  Local AI model failed to load - will use fallback plan generation")
+                print("⚠️  llama-cpp-python is not installed - will use fallback plan generation")
                 
         except Exception as e:
             print(f"⚠️  Error loading local AI model on startup: {e}")
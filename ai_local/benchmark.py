@@ -0,0 +1,237 @@
+# ai_local/benchmark.py
+"""
+Measurements of local model completions, shared by the benchmark commands.
+
+StubLlama stands in for llama_cpp.Llama where neither llama-cpp-python nor
+a model file is available, so the benchmarks run on any Linux box; its
+timings only show the harness works. TimedLlama wraps a model to record
+time to first token and token counts per completion.
+"""
+import math
+import re
+import resource
+import statistics
+import time
+from datetime import date
+
+from rest.models import AICallRecord
+from rest.plan_repair import repair_plan
+from rest.wire_schema import parse_plan, to_wire
+
+# Fixed profiles the benchmark prompts are built from, so reports can be diffed
+BENCHMARK_PROFILES = [
+    {'goal': 'weight_loss', 'activity_level': 'moderately_active', 'gender': 'female', 'age': 30, 'current_weight': 70, 'height': 165},
+    {'goal': 'muscle_gain', 'activity_level': 'very_active', 'gender': 'male', 'age': 24, 'current_weight': 78, 'height': 182},
+    {'goal': 'maintenance', 'activity_level': 'sedentary', 'gender': 'male', 'age': 52, 'current_weight': 90, 'height': 175},
+    {'goal': 'weight_loss', 'activity_level': 'lightly_active', 'gender': 'female', 'age': 41, 'current_weight': 84, 'height': 160},
+    {'goal': 'endurance', 'activity_level': 'athlete', 'gender': 'female', 'age': 27, 'current_weight': 58, 'height': 170},
+]
+
+# A fixed start date, since it appears in the prompts
+BENCHMARK_START_DATE = date(2025, 1, 6)
+
+# Words and punctuation, with the whitespace before them
+TOKEN_PATTERN = re.compile(r'\s*\w+|\s*[^\w\s]|\s+')
+
+
+def benchmark_prompts(start_date=BENCHMARK_START_DATE, count=None):
+    """Plan prompts for BENCHMARK_PROFILES, cycled to `count` prompts."""
+    from rest.ai_service import build_plan_prompt
+    from rest.models import Profile
+    count = count or len(BENCHMARK_PROFILES)
+    return [
+        build_plan_prompt(Profile(**BENCHMARK_PROFILES[index % len(BENCHMARK_PROFILES)]), start_date)
+        for index in range(count)
+    ]
+
+
+class StubLlama:
+    """
+    A llama_cpp.Llama stand-in: word and punctuation tokens, prompt evaluation and
+    decoding times that scale with n_threads and n_batch, a context buffer
+    sized by n_ctx, and the example plan as output.
+    """
+    PROMPT_TOKEN_SECONDS = 0.0004  # per token on one thread
+    BATCH_SECONDS = 0.002
+    DECODE_TOKEN_SECONDS = 0.002
+
+    def __init__(self, model_path=None, n_ctx=4096, n_threads=4, n_batch=512, verbose=False, **options):
+        self.n_threads = max(1, n_threads)
+        self.n_batch = max(1, n_batch)
+        self.context = bytearray(n_ctx * 1024)  # stands in for the KV cache
+        self.input_ids = []
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return TOKEN_PATTERN.findall(text.decode('utf-8'))
+
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens):
+        tokens = list(tokens)
+        time.sleep(
+            len(tokens) * self.PROMPT_TOKEN_SECONDS / self.n_threads
+            + math.ceil(len(tokens) / self.n_batch) * self.BATCH_SECONDS
+        )
+        self.input_ids = self.input_ids + tokens
+
+    def save_state(self):
+        return list(self.input_ids)
+
+    def load_state(self, state):
+        self.input_ids = list(state)
+
+    def _decode(self, max_tokens):
+        from .services import PROMPT_EXAMPLE_PLAN
+        for token in TOKEN_PATTERN.findall(to_wire(PROMPT_EXAMPLE_PLAN))[:max_tokens]:
+            time.sleep(self.DECODE_TOKEN_SECONDS / math.sqrt(self.n_threads))
+            yield token
+
+    def __call__(self, prompt, max_tokens=2048, stream=False, **params):
+        tokens = self.tokenize(prompt.encode('utf-8'))
+        matched = 0
+        while matched < min(len(tokens), self.n_tokens) and tokens[matched] == self.input_ids[matched]:
+            matched += 1
+        self.input_ids = self.input_ids[:matched]
+        self.eval(tokens[matched:])
+        chunks = ({'choices': [{'text': token}]} for token in self._decode(max_tokens))
+        if stream:
+            return chunks
+        texts = [chunk['choices'][0]['text'] for chunk in chunks]
+        return {
+            'choices': [{'text': ''.join(texts)}],
+            'usage': {'prompt_tokens': len(tokens), 'completion_tokens': len(texts)},
+        }
+
+
+class TimedLlama:
+    """
+    Wraps a Llama-like model. Completions are streamed, to record time to
+    first token (mostly prompt evaluation) and generation time separately.
+    """
+
+    def __init__(self, model, max_tokens=None):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.completions = []
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, prompt, **params):
+        params.pop('stream', None)
+        if self.max_tokens:
+            params['max_tokens'] = self.max_tokens
+        prompt_tokens = len(self.model.tokenize(prompt.encode('utf-8'), special=True))
+        started = time.perf_counter()
+        first_token_at = None
+        texts = []
+        for chunk in self.model(prompt, stream=True, **params):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            texts.append(chunk['choices'][0]['text'])
+        finished = time.perf_counter()
+        first_token_at = first_token_at or finished
+        self.completions.append({
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(texts),
+            'ttft_seconds': first_token_at - started,
+            'generation_seconds': finished - first_token_at,
+        })
+        return {
+            'choices': [{'text': ''.join(texts)}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(texts)},
+        }
+
+
+class CallRecorder:
+    """Stands in for the telemetry call LocalModel.generate_plan() reports to."""
+
+    def __init__(self):
+        self.outcome = None
+        self.error = None
+
+    def set_usage(self, prompt_tokens, output_tokens):
+        pass
+
+    def set_outcome(self, outcome, error=None):
+        self.outcome = outcome
+        self.error = str(error) if error else None
+
+    @property
+    def fell_back(self):
+        return self.outcome == AICallRecord.OUTCOME_FALLBACK
+
+
+def reset_peak_rss():
+    """Resets this process's peak RSS (Linux 4.0+). Returns whether it could."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS of this process since start or the last reset_peak_rss()."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def extract_json(text):
+    start, end = text.find('{'), text.rfind('}') + 1
+    return text[start:end] if start != -1 and end > start else ''
+
+
+def measure_completion(local_model, prompt, json_schema=None):
+    """
+    Runs one plan completion and returns its latency, token counts,
+    generation speed and whether the output validated as is (`valid`) or
+    only after repair (`repaired`).
+    """
+    started = time.perf_counter()
+    response = local_model.complete(
+        local_model.build_prompt(prompt), json_schema=json_schema, **local_model.sampling_params(json_schema)
+    )
+    seconds = time.perf_counter() - started
+    usage = response.get('usage') or {}
+    text = extract_json(response['choices'][0]['text'])
+    try:
+        parse_plan(text)
+        valid, repaired = True, False
+    except ValueError:
+        valid, repaired = False, repair_plan(text)[0] is not None
+    completion_tokens = usage.get('completion_tokens') or 0
+    return {
+        'seconds': seconds,
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': completion_tokens,
+        'tokens_per_second': completion_tokens / seconds if seconds else 0.0,
+        'valid': valid,
+        'repaired': repaired,
+    }
+
+
+def summarize(results):
+    """Averages of measure_completion() results."""
+    if not results:
+        return {}
+    return {
+        'runs': len(results),
+        'valid_rate': sum(r['valid'] for r in results) / len(results),
+        'repaired_rate': sum(r['repaired'] for r in results) / len(results),
+        'mean_seconds': statistics.mean(r['seconds'] for r in results),
+        'mean_completion_tokens': statistics.mean(r['completion_tokens'] for r in results),
+        'mean_tokens_per_second': statistics.mean(r['tokens_per_second'] for r in results),
+    }
@@ -0,0 +1,326 @@
+# ai_local/inference_server.py
+"""
+A shared local inference server for the GGUF model.
+
+Without it every gunicorn worker loads its own copy of the model in
+get_local_model(). Run one server per host instead:
+
+    python manage.py run_local_inference_server --bind unix:///run/fitpal/llm.sock
+
+and set LOCAL_INFERENCE_URL to the same address (a unix:// socket path or
+an http://127.0.0.1:port URL). LocalModel then uses LocalInferenceClient
+in place of the in-process Llama instance: the client is called the same
+way, sends the completion request to the server and gives up after
+LOCAL_INFERENCE_TIMEOUT_SECONDS. The model stays loaded while the web tier
+restarts.
+
+Endpoints:
+- GET /health: {"status": "ready" | "loading" | "unavailable", "model_path": ...,
+  "scheduler": queue depth, wait and run times, see ai_local/scheduler.py,
+  "prefix_cache": cached prompt prefix stats, see ai_local/prefix_cache.py}
+- POST /completion: {"prompt": ..., plus Llama sampling parameters and an
+  optional "json_schema" to constrain the output to}
+  -> the Llama completion response ({"choices": [{"text": ...}], "usage": {...}}),
+  or 503 while the model is loading or the queue is full, 504 on timeout
+- POST /tokenize: {"content": ..., "add_bos": false} -> {"tokens": [...]},
+  or 503 while the model is loading
+"""
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from .prefix_cache import PrefixCache
+from .scheduler import InferenceScheduler, InferenceQueueFull, InferenceTimeout
+
+# Sampling parameters the server passes on to Llama; json_schema becomes a grammar
+COMPLETION_PARAMETERS = {'max_tokens', 'temperature', 'top_p', 'top_k', 'repeat_penalty', 'stop', 'seed', 'json_schema'}
+
+_grammars = {}
+_grammars_lock = threading.Lock()
+
+
+def get_grammar(json_schema):
+    """
+    The llama.cpp grammar (GBNF) that constrains decoding to json_schema,
+    compiled once per schema.
+    """
+    from llama_cpp import LlamaGrammar
+    key = json.dumps(json_schema, sort_keys=True)
+    with _grammars_lock:
+        if key not in _grammars:
+            _grammars[key] = LlamaGrammar.from_json_schema(key, verbose=False)
+        return _grammars[key]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An HTTPConnection over a unix domain socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class LocalInferenceError(Exception):
+    """Raised when the inference server can't be reached or answers with an error."""
+
+
+class LocalInferenceClient:
+    """
+    A thin client for the inference server, callable like a Llama instance.
+    The connect timeout applies to reaching the server, the read timeout to
+    the whole completion.
+    """
+
+    def __init__(self, url, connect_timeout=2.0, timeout=120.0, health_ttl=5.0):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.health_ttl = health_ttl
+        self._health = None
+        self._health_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _connection(self, timeout):
+        parsed = urlparse(self.url)
+        if parsed.scheme == 'unix':
+            return UnixHTTPConnection(parsed.path, timeout=timeout)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+
+    def _request(self, method, path, body=None, timeout=None):
+        connection = self._connection(self.connect_timeout)
+        try:
+            connection.connect()
+            connection.sock.settimeout(timeout or self.timeout)
+            connection.request(
+                method, path,
+                body=json.dumps(body) if body is not None else None,
+                headers={'Content-Type': 'application/json'},
+            )
+            response = connection.getresponse()
+            data = json.loads(response.read() or b'{}')
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            raise LocalInferenceError(f"Local inference server at {self.url} failed: {e}") from e
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise LocalInferenceError(data.get('error') or f"Local inference server answered {response.status}")
+        return data
+
+    def __call__(self, prompt, **params):
+        params.pop('echo', None)
+        return self._request('POST', '/completion', {'prompt': prompt, **params})
+
+    def tokenize(self, text, add_bos=True):
+        """The model's tokens for `text` (bytes), like Llama.tokenize()."""
+        data = self._request('POST', '/tokenize', {'content': text.decode('utf-8'), 'add_bos': add_bos})
+        return data['tokens']
+
+    def health(self):
+        """The server's /health answer, cached for health_ttl seconds."""
+        with self._lock:
+            if time.monotonic() - self._health_checked_at < self.health_ttl:
+                return self._health
+        try:
+            health = self._request('GET', '/health', timeout=self.connect_timeout)
+        except LocalInferenceError as e:
+            health = {'status': 'unreachable', 'error': str(e)}
+        with self._lock:
+            self._health, self._health_checked_at = health, time.monotonic()
+        return health
+
+    def is_ready(self):
+        return self.health().get('status') == 'ready'
+
+
+class InferenceUnavailable(Exception):
+    """Raised by the server while the model is not loaded."""
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'FitPalInference/1.0'
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send(404, {'error': 'Not found.'})
+            return
+        self._send(200, self.server.inference.health())
+
+    def do_POST(self):
+        if self.path == '/tokenize':
+            self._tokenize()
+            return
+        if self.path != '/completion':
+            self._send(404, {'error': 'Not found.'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+            prompt = request['prompt']
+        except (ValueError, KeyError):
+            self._send(400, {'error': "A JSON body with a 'prompt' is required."})
+            return
+        params = {key: value for key, value in request.items() if key in COMPLETION_PARAMETERS}
+        try:
+            self._send(200, self.server.inference.complete(prompt, **params))
+        except (InferenceUnavailable, InferenceQueueFull) as e:
+            self._send(503, {'error': str(e)})
+        except InferenceTimeout as e:
+            self._send(504, {'error': str(e)})
+        except Exception as e:
+            print(f"Error running local inference: {e}")
+            self._send(500, {'error': str(e)})
+
+    def _tokenize(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+            content = request['content']
+        except (ValueError, KeyError):
+            self._send(400, {'error': "A JSON body with a 'content' is required."})
+            return
+        try:
+            tokens = self.server.inference.tokenize(content, add_bos=bool(request.get('add_bos', False)))
+        except InferenceUnavailable as e:
+            self._send(503, {'error': str(e)})
+            return
+        self._send(200, {'tokens': tokens})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return (self.client_address[0] if self.client_address else '') or 'unix'
+
+    def log_message(self, format, *args):
+        print(f"[inference] {self.address_string()} {format % args}")
+
+
+class Inference:
+    """
+    The single model instance of the server. Completions are queued on an
+    InferenceScheduler, since llama.cpp runs one at a time. With a
+    prompt_prefix, its evaluation is cached at load and reused.
+    """
+
+    def __init__(self, model_path, max_queue=8, queue_timeout=120.0, prompt_prefix=None, **llama_options):
+        self.model_path = model_path
+        self.llama_options = llama_options
+        self.prompt_prefix = prompt_prefix
+        self.prefix_cache = None
+        self.model = None
+        self.status = 'loading'
+        self.queue_timeout = queue_timeout
+        self.scheduler = InferenceScheduler(self._run, max_queue=max_queue)
+
+    def load(self):
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            print("llama-cpp-python is not installed; the inference server can't load the model")
+            self.status = 'unavailable'
+            return
+        if not os.path.exists(self.model_path):
+            print(f"Model file not found at {self.model_path}")
+            self.status = 'unavailable'
+            return
+        started = time.monotonic()
+        try:
+            self.model = Llama(model_path=self.model_path, verbose=False, **self.llama_options)
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            self.status = 'unavailable'
+            return
+        print(f"Model {self.model_path} loaded in {time.monotonic() - started:.1f}s")
+        if self.prompt_prefix:
+            prefix_cache = PrefixCache(self.model, self.prompt_prefix)
+            try:
+                prefix_cache.warm()
+                self.prefix_cache = prefix_cache
+            except Exception as e:
+                print(f"Error caching the prompt prefix: {e}")
+        self.status = 'ready'
+
+    def health(self):
+        return {
+            'status': self.status,
+            'model_path': self.model_path,
+            'scheduler': self.scheduler.get_stats(),
+            'prefix_cache': self.prefix_cache.get_stats() if self.prefix_cache else None,
+        }
+
+    def _run(self, prompt, **params):
+        if self.prefix_cache:
+            self.prefix_cache.prepare(prompt)
+        return self.model(prompt, echo=False, **params)
+
+    def tokenize(self, content, add_bos=False):
+        # Only reads the vocabulary, so it does not wait behind completions
+        if self.model is None:
+            raise InferenceUnavailable(f"The model is {self.status}.")
+        return self.model.tokenize(content.encode('utf-8'), add_bos=add_bos)
+
+    def complete(self, prompt, **params):
+        if self.model is None:
+            raise InferenceUnavailable(f"The model is {self.status}.")
+        json_schema = params.pop('json_schema', None)
+        if json_schema is not None:
+            params['grammar'] = get_grammar(json_schema)
+        return self.scheduler.submit(prompt, timeout=self.queue_timeout, **params)
+
+
+class UnixThreadingHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('',)
+
+
+def create_server(bind, inference):
+    """An HTTP server on a unix:// socket path or an http://host:port address."""
+    parsed = urlparse(bind)
+    if parsed.scheme == 'unix':
+        if os.path.exists(parsed.path):
+            os.unlink(parsed.path)
+        server = UnixThreadingHTTPServer(parsed.path, InferenceRequestHandler)
+        os.chmod(parsed.path, 0o660)
+    else:
+        server = ThreadingHTTPServer((parsed.hostname or '127.0.0.1', parsed.port or 8765), InferenceRequestHandler)
+        server.daemon_threads = True
+    server.inference = inference
+    return server
+
+
+def serve(bind, model_path, max_queue=8, queue_timeout=120.0, prompt_prefix=None, **llama_options):
+    """
+    Serves until interrupted. The model loads in the background, so /health
+    answers 'loading' right away.
+    """
+    inference = Inference(
+        model_path, max_queue=max_queue, queue_timeout=queue_timeout, prompt_prefix=prompt_prefix, **llama_options
+    )
+    server = create_server(bind, inference)
+    threading.Thread(target=inference.load, name='inference-load', daemon=True).start()
+    print(f"Local inference server listening on {bind}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        parsed = urlparse(bind)
+        if parsed.scheme == 'unix' and os.path.exists(parsed.path):
+            os.unlink(parsed.path)
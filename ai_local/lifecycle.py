@@ -0,0 +1,136 @@
+# ai_local/lifecycle.py
+"""
+Loading and unloading of the in-process local model.
+
+The model is loaded lazily by the first completion that needs it, or ahead
+of time by a background warmup on startup (LOCAL_MODEL_WARMUP). With
+LOCAL_MODEL_IDLE_UNLOAD_SECONDS set, it is unloaded again after that long
+without completions, to give the memory back on shared nodes; the next
+completion loads it again. A load that fails is retried by the first
+completion after LOCAL_MODEL_LOAD_RETRY_SECONDS; until then completions
+use the fallback plan straight away.
+
+Llama options (context size, threads, batch size, mmap/mlock) come from
+the LOCAL_MODEL_* settings, see llama_options().
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def llama_options():
+    """Llama constructor options from the LOCAL_MODEL_* settings."""
+    return {
+        'n_ctx': getattr(settings, 'LOCAL_MODEL_N_CTX', 4096),
+        'n_threads': getattr(settings, 'LOCAL_MODEL_N_THREADS', 4),
+        'n_batch': getattr(settings, 'LOCAL_MODEL_N_BATCH', 512),
+        'n_gpu_layers': getattr(settings, 'LOCAL_MODEL_N_GPU_LAYERS', -1),
+        'use_mmap': getattr(settings, 'LOCAL_MODEL_USE_MMAP', True),
+        'use_mlock': getattr(settings, 'LOCAL_MODEL_USE_MLOCK', False),
+    }
+
+
+class ModelLifecycle:
+    """
+    Tracks the state of a model loaded by `load()` (returns whether it
+    succeeded) and released by `unload()`. The model is never unloaded
+    while in use().
+    """
+    STATE_UNLOADED = 'unloaded'
+    STATE_LOADING = 'loading'
+    STATE_READY = 'ready'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, load, unload, idle_timeout=0, retry_after=300):
+        self._load = load
+        self._unload = unload
+        self.idle_timeout = idle_timeout
+        self.retry_after = retry_after
+        self.state = self.STATE_UNLOADED
+        self.load_seconds = None
+        self.loaded_at = None
+        self.failed_at = None
+        self.last_used_at = None
+        self.loads = 0
+        self.unloads = 0
+        self._in_use = 0
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self):
+        """Loads the model if it isn't loaded, waiting for a load in progress. Returns whether it is ready."""
+        if self.state == self.STATE_READY:
+            return True
+        with self._load_lock:
+            if self.state == self.STATE_READY:
+                return True
+            if self.state == self.STATE_FAILED and time.monotonic() - self.failed_at < self.retry_after:
+                return False
+            self.state = self.STATE_LOADING
+            started = time.monotonic()
+            try:
+                loaded = self._load()
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                loaded = False
+            if not loaded:
+                # Retried after retry_after, e.g. once the model file has been put in place
+                self.failed_at = time.monotonic()
+                self.state = self.STATE_FAILED
+                return False
+            self.load_seconds = time.monotonic() - started
+            self.loaded_at = self.last_used_at = time.time()
+            self.loads += 1
+            self.state = self.STATE_READY
+        if self.idle_timeout:
+            threading.Thread(target=self._unload_when_idle, name='local-model-idle', daemon=True).start()
+        return True
+
+    def start_warmup(self):
+        """Loads the model on a background thread."""
+        threading.Thread(target=self.ensure_loaded, name='local-model-warmup', daemon=True).start()
+
+    @contextmanager
+    def in_use(self):
+        """Keeps the model loaded for the duration of the block."""
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self.last_used_at = time.time()
+
+    def _unload_when_idle(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 30))
+            with self._load_lock, self._lock:
+                if self.state != self.STATE_READY:
+                    return
+                idle = time.time() - self.last_used_at
+                if self._in_use or idle < self.idle_timeout:
+                    continue
+                self._unload()
+                self.state = self.STATE_UNLOADED
+                self.unloads += 1
+            print(f"Local model unloaded after {idle:.0f}s idle")
+            return
+
+    def get_status(self):
+        return {
+            'state': self.state,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'loaded_at': self.loaded_at,
+            'retry_in_seconds': (
+                round(max(self.failed_at + self.retry_after - time.monotonic(), 0), 1)
+                if self.state == self.STATE_FAILED else None
+            ),
+            'idle_seconds': round(time.time() - self.last_used_at, 1) if self.last_used_at else None,
+            'in_use': self._in_use,
+            'idle_unload_seconds': self.idle_timeout,
+            'loads': self.loads,
+            'unloads': self.unloads,
+        }
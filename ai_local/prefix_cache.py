@@ -0,0 +1,70 @@
+# ai_local/prefix_cache.py
+"""
+Reuse of the evaluated prompt prefix.
+
+Local plan prompts start with the same static text: the wire schema
+legend and example (LocalModel.prompt_prefix()). PrefixCache evaluates
+that prefix once at warmup and snapshots the llama state; before a
+completion whose prompt starts with the prefix, the snapshot is restored
+if the context no longer holds it, and llama.cpp only evaluates the
+per-user tail. On CPU-only nodes that is most of the prompt-eval time.
+
+Compare with `python manage.py benchmark_prefix_cache`.
+"""
+import threading
+import time
+
+
+class PrefixCache:
+    def __init__(self, model, prefix):
+        self.model = model
+        self.prefix = prefix
+        self.tokens = None
+        self.state = None
+        self.warm_seconds = None
+        self.hits = 0
+        self.restores = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Evaluates the prefix and snapshots the state. Must not run during a completion."""
+        started = time.monotonic()
+        with self._lock:
+            self.tokens = self.model.tokenize(self.prefix.encode('utf-8'), special=True)
+            self.model.reset()
+            self.model.eval(self.tokens)
+            self.state = self.model.save_state()
+        self.warm_seconds = time.monotonic() - started
+        print(f"Prompt prefix of {len(self.tokens)} tokens cached in {self.warm_seconds:.1f}s")
+
+    def _holds_prefix(self):
+        # The last prefix token may merge with the start of the tail when the
+        # whole prompt is tokenized; llama.cpp re-evaluates it either way
+        count = len(self.tokens) - 1
+        return self.model.n_tokens >= count and list(self.model.input_ids[:count]) == list(self.tokens[:count])
+
+    def prepare(self, prompt):
+        """
+        Makes sure the context starts with the evaluated prefix before a
+        completion of `prompt`. llama.cpp then skips the matching tokens.
+        """
+        with self._lock:
+            if self.state is None or not prompt.startswith(self.prefix):
+                self.misses += 1
+                return
+            if self._holds_prefix():
+                # The previous completion left the prefix in place
+                self.hits += 1
+                return
+            self.model.load_state(self.state)
+            self.restores += 1
+
+    def get_stats(self):
+        return {
+            'prefix_tokens': len(self.tokens) if self.tokens is not None else None,
+            'warm_seconds': round(self.warm_seconds, 3) if self.warm_seconds is not None else None,
+            'hits': self.hits,
+            'restores': self.restores,
+            'misses': self.misses,
+        }
@@ -0,0 +1,152 @@
+# ai_local/scheduler.py
+"""
+A request queue in front of the local model.
+
+llama_cpp.Llama is not thread-safe, so every completion goes through an
+InferenceScheduler: requests wait in a bounded FIFO queue and a single
+worker thread runs them one at a time, in arrival order. When the queue is
+full, submit() fails right away with InferenceQueueFull instead of piling
+up threads, so the router can move on to another backend.
+
+The llama-cpp-python API decodes one sequence per call, so prompts can't
+share decode steps. Instead, a request identical to one still waiting in
+the queue (same prompt and parameters) is coalesced with it and gets the
+same completion; equivalent profiles produce identical plan prompts.
+
+Queue depth, wait and run times are kept for the status endpoints.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+
+class InferenceQueueFull(Exception):
+    """Raised by submit() when the queue is at its maximum depth."""
+
+
+class InferenceTimeout(Exception):
+    """Raised by submit() when the completion did not finish in time."""
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))], 3)
+
+
+class InferenceRequest:
+    def __init__(self, key, prompt, params):
+        self.key = key
+        self.prompt = prompt
+        self.params = params
+        self.enqueued_at = time.monotonic()
+        self.waiters = 1
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceScheduler:
+    """Runs `run(prompt, **params)` for queued requests on one worker thread."""
+
+    def __init__(self, run, max_queue=8, window=200, name='local-inference'):
+        self.run = run
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = deque()
+        self._queued = {}  # key -> waiting request, for coalescing
+        self._cond = threading.Condition()
+        self._worker = None
+        self._running = False
+        self.wait_times = deque(maxlen=window)
+        self.run_times = deque(maxlen=window)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.timed_out = 0
+
+    @staticmethod
+    def _key(prompt, params):
+        # Grammar objects are compared by identity; they are cached per schema
+        return json.dumps([prompt, params], sort_keys=True, default=lambda value: f'{type(value).__name__}:{id(value)}')
+
+    def submit(self, prompt, timeout=None, **params):
+        """
+        Queues a completion and waits for it. Raises InferenceQueueFull,
+        InferenceTimeout, or the error of the completion itself.
+        """
+        key = self._key(prompt, params)
+        with self._cond:
+            request = self._queued.get(key)
+            if request is not None:
+                request.waiters += 1
+                self.coalesced += 1
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self.rejected += 1
+                    raise InferenceQueueFull(f"The local inference queue is full ({self.max_queue} waiting).")
+                request = InferenceRequest(key, prompt, params)
+                self._queue.append(request)
+                self._queued[key] = request
+                self._ensure_worker()
+                self._cond.notify()
+
+        if not request.done.wait(timeout):
+            with self._cond:
+                request.waiters -= 1
+                if request.waiters == 0 and self._queued.get(key) is request:
+                    # Nobody is waiting for it any more; don't run it
+                    self._queue.remove(request)
+                    del self._queued[key]
+                self.timed_out += 1
+            raise InferenceTimeout(f"The local completion did not finish within {timeout}s.")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, name=self.name, daemon=True)
+            self._worker.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                request = self._queue.popleft()
+                del self._queued[request.key]
+                self._running = True
+            started = time.monotonic()
+            try:
+                request.result = self.run(request.prompt, **request.params)
+            except Exception as e:
+                request.error = e
+            finished = time.monotonic()
+            with self._cond:
+                self._running = False
+                self.wait_times.append(started - request.enqueued_at)
+                self.run_times.append(finished - started)
+                if request.error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            request.done.set()
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'running': self._running,
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'coalesced': self.coalesced,
+                'timed_out': self.timed_out,
+                'wait_seconds': {'p50': _percentile(self.wait_times, 50), 'p95': _percentile(self.wait_times, 95)},
+                'run_seconds': {'p50': _percentile(self.run_times, 50), 'p95': _percentile(self.run_times, 95)},
+            }
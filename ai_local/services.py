@@ -1,10 +1,18 @@
 import os
-import json
-from datetime import date, timedelta
+from datetime import date
 from django.conf import settings
-from django.db import transaction
-from rest.models import Profile, FitnessPlan, WorkoutDay, Exercise, NutritionDay, Meal
+from rest.models import Profile, AICallRecord
+from rest.ai_telemetry import track_ai_call
 from rest.schemas import GeneratedPlanSchema
+from rest.plan_materializer import materialize_plan, PlanOverlapError
+from rest.nutrition_targets import apply_profile_targets
+from rest.plan_backends import repair_local_plan
+from rest.fallback_plans import build_fallback_plan
+from rest.wire_schema import format_instructions, parse_plan, plan_generation_schema
+from .inference_server import LocalInferenceClient, get_grammar
+from .lifecycle import ModelLifecycle, llama_options
+from .prefix_cache import PrefixCache
+from .scheduler import InferenceScheduler
 
 try:
     from llama_cpp import Llama
@@ -14,74 +22,59 @@ except ImportError:
     print("Warning: llama-cpp-python not installed. Please install it to use local model inference.")
     print("Install with: pip install llama-cpp-python")
 
+def warm_prefix_cache(model, prefix):
+    """A warmed PrefixCache for `model`, or None if the prefix can't be evaluated."""
+    prefix_cache = PrefixCache(model, prefix)
+    try:
+        prefix_cache.warm()
+    except Exception as e:
+        print(f"Error caching the prompt prefix: {e}")
+        return None
+    return prefix_cache
 
-class LocalModel:
-    def __init__(self, model_path):
-        self.model_path = model_path
-        self.model = None
-        if LLAMA_CPP_AVAILABLE:
-            self.load_model()
 
-    def load_model(self):
-        """Load the GGUF model using llama-cpp-python"""
-        if not os.path.exists(self.model_path):
-            print(f"Model file not found at {self.model_path}")
-            print("Please place your DeepSeek_R1_Distill_Qwen_1_5B.gguf model file in the base directory")
-            return
-        
-        try:
-            print(f"Loading model from {self.model_path}")
-            self.model = Llama(
-                model_path=self.model_path,
-                n_ctx=4096,  # Context window size
-                n_threads=4,  # Number of threads to use
-                n_gpu_layers=-1,  # Use GPU if available, -1 for all layers
-                verbose=False
-            )
-            print("Model loaded successfully")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            self.model = None
+def plan_json_schema():
+    """
+    The JSON schema local completions are constrained to: the wire schema a
+    whole plan is generated in, or None if LOCAL_MODEL_GRAMMAR is off.
+    """
+    if not getattr(settings, 'LOCAL_MODEL_GRAMMAR', True):
+        return None
+    return plan_generation_schema().model_json_schema()
 
-    def generate_plan(self, prompt):
-        """Generate a fitness plan using the local model"""
-        if not self.model:
-            print("Model not loaded. Using fallback plan generation.")
-            return self._generate_fallback_plan()
-        
-        try:
-            # Create a structured prompt for JSON output
-            full_prompt = f"""{prompt}
 
-Please respond with a valid JSON object following this exact structure:
-{{
+# The example plan shown to the model, in the wire schema
+PROMPT_EXAMPLE_PLAN = GeneratedPlanSchema.model_validate({
     "workout_days": [
-        {{
+        {
             "day_of_week": 1,
             "title": "Upper Body Strength",
-            "is_rest_day": false,
+            "is_rest_day": False,
             "description": "Focus on upper body exercises",
             "exercises": [
-                {{
+                {
                     "name": "Push-ups",
                     "sets": 3,
+                    "met_value": 3.8,
+                    "duration_mins": 10,
                     "reps": "10-15",
                     "rest_period_seconds": 60,
                     "notes": "Keep your body straight"
-                }}
+                }
             ]
-        }}
+        }
     ],
     "nutrition_days": [
-        {{
+        {
             "day_of_week": 1,
             "target_calories": 2000,
             "target_protein_grams": 120,
             "target_carbs_grams": 200,
             "target_fats_grams": 70,
+            "target_water_litres": 2.5,
             "notes": "Stay hydrated",
             "meals": [
-                {{
+                {
                     "meal_type": "breakfast",
                     "description": "Oatmeal with banana",
                     "calories": 400,
@@ -89,492 +82,211 @@ Please respond with a valid JSON object following this exact structure:
                     "carbs_grams": 60.0,
                     "fats_grams": 8.0,
                     "portion_size": "1 bowl"
-                }}
+                }
             ]
-        }}
+        }
     ]
-}}
+})
+
+
+class LocalModel:
+    def __init__(self, model_path, server_url=None, options=None, llama_factory=None):
+        """
+        `options` override the Llama options from settings; `llama_factory`
+        replaces llama_cpp.Llama, for the benchmark's stub and timing
+        wrapper (ai_local/benchmark.py). A stub needs no model file.
+        """
+        self.model_path = model_path
+        self.server_url = server_url
+        self.options = options or {}
+        self.llama_factory = llama_factory
+        self.model = None
+        # Serializes completions of the in-process model; the inference server has its own
+        self.scheduler = None
+        self.prefix_cache = None
+        self.lifecycle = None
+        if server_url:
+            # The model is loaded once by the shared inference server (ai_local/inference_server.py)
+            self.model = LocalInferenceClient(
+                server_url,
+                connect_timeout=getattr(settings, 'LOCAL_INFERENCE_CONNECT_TIMEOUT_SECONDS', 2.0),
+                timeout=getattr(settings, 'LOCAL_INFERENCE_TIMEOUT_SECONDS', 120.0),
+            )
+        elif LLAMA_CPP_AVAILABLE or llama_factory:
+            # Loaded on first use or by the startup warmup, see ai_local/lifecycle.py
+            self.lifecycle = ModelLifecycle(
+                self.load_model, self.unload_model,
+                idle_timeout=getattr(settings, 'LOCAL_MODEL_IDLE_UNLOAD_SECONDS', 0),
+                retry_after=getattr(settings, 'LOCAL_MODEL_LOAD_RETRY_SECONDS', 300),
+            )
+            self.scheduler = InferenceScheduler(
+                self._run, max_queue=getattr(settings, 'LOCAL_INFERENCE_MAX_QUEUE', 8)
+            )
+
+    def is_ready(self):
+        """Whether the model is loaded (or the inference server has it loaded)."""
+        if self.server_url:
+            return self.model.is_ready()
+        return self.lifecycle is not None and self.lifecycle.state == ModelLifecycle.STATE_READY
+
+    def ensure_loaded(self):
+        """Whether generate_plan() can use the model rather than the fallback plan, loading it if needed."""
+        if self.server_url:
+            return self.model.is_ready()
+        return self.lifecycle is not None and self.lifecycle.ensure_loaded()
+
+    def load_model(self):
+        """Load the GGUF model using llama-cpp-python"""
+        if self.llama_factory is None and not os.path.exists(self.model_path):
+            print(f"Model file not found at {self.model_path}")
+            print("Please place your DeepSeek_R1_Distill_Qwen_1_5B.gguf model file in the base directory")
+            return False
+
+        try:
+            options = {**llama_options(), **self.options}
+            print(f"Loading model from {self.model_path} ({options})")
+            self.model = (self.llama_factory or Llama)(model_path=self.model_path, verbose=False, **options)
+            print("Model loaded successfully")
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            self.model = None
+            return False
+        if getattr(settings, 'LOCAL_MODEL_PREFIX_CACHE', True):
+            self.prefix_cache = warm_prefix_cache(self.model, self.prompt_prefix())
+        return True
+
+    def unload_model(self):
+        """Releases the model and its memory; the next completion loads it again."""
+        model, self.model, self.prefix_cache = self.model, None, None
+        if hasattr(model, 'close'):
+            model.close()
+
+    def _run(self, prompt, **params):
+        # Runs on the scheduler's worker thread, one completion at a time
+        if self.prefix_cache:
+            self.prefix_cache.prepare(prompt)
+        return self.model(prompt, **params)
+
+    @staticmethod
+    def prompt_prefix():
+        """
+        The static start of every plan prompt: the wire schema instructions,
+        see rest/wire_schema.py. It comes before the per-user part so its
+        evaluation can be reused, see ai_local/prefix_cache.py.
+        """
+        return f"""You write weekly fitness and nutrition plans as JSON.
+
+{format_instructions(PROMPT_EXAMPLE_PLAN)}
+
+"""
+
+    @classmethod
+    def build_prompt(cls, prompt):
+        """The plan prompt: the static prefix, then the user's details."""
+        return f"""{cls.prompt_prefix()}{prompt.strip()}
 
 JSON Response:"""
-            
-            # Generate response
-            response = self.model(
-                full_prompt,
-                max_tokens=2048,
-                temperature=0.7,
-                top_p=0.9,
-                echo=False,
-                stop=["\n\n", "Human:", "Assistant:"],
+
+    @staticmethod
+    def sampling_params(json_schema=None):
+        params = {'max_tokens': 2048, 'temperature': 0.7, 'top_p': 0.9}
+        if json_schema is None:
+            # Without a grammar, stop before the model starts a new turn
+            params['stop'] = ["\n\n", "Human:", "Assistant:"]
+        return params
+
+    def complete(self, prompt, json_schema=None, **params):
+        """
+        Runs one completion. With a json_schema, decoding is constrained by a
+        llama.cpp grammar built from it, so the output is valid JSON for the
+        schema (unless cut off by max_tokens).
+        In process, completions are queued on the scheduler; raises
+        InferenceQueueFull or InferenceTimeout when it is saturated.
+        """
+        if json_schema is not None:
+            if self.server_url:
+                params['json_schema'] = json_schema
+            elif LLAMA_CPP_AVAILABLE:
+                # Not for the benchmark stub, which runs without llama.cpp
+                params['grammar'] = get_grammar(json_schema)
+        if self.server_url:
+            return self.model(prompt, **params)
+        with self.lifecycle.in_use():
+            if not self.lifecycle.ensure_loaded():
+                raise RuntimeError(f"The local model at {self.model_path} could not be loaded.")
+            return self.scheduler.submit(
+                prompt, timeout=getattr(settings, 'LOCAL_INFERENCE_TIMEOUT_SECONDS', 120.0), echo=False, **params
             )
+
+    def generate_plan(self, prompt, call=None, profile=None):
+        """
+        Generate a fitness plan using the local model.
+        Token usage and fallbacks are recorded on the telemetry `call`, if given;
+        the fallback plan is built for `profile`.
+        """
+        if not self.ensure_loaded():
+            print("Model not loaded. Using fallback plan generation.")
+            if call:
+                call.set_outcome(AICallRecord.OUTCOME_FALLBACK)
+            return self._generate_fallback_plan(profile)
+        
+        try:
+            json_schema = plan_json_schema()
+            response = self.complete(self.build_prompt(prompt), json_schema=json_schema, **self.sampling_params(json_schema))
             
             response_text = response['choices'][0]['text'].strip()
+            if call and response.get('usage'):
+                call.set_usage(response['usage']['prompt_tokens'], response['usage']['completion_tokens'])
             
             # Try to extract JSON from response
             json_start = response_text.find('{')
             json_end = response_text.rfind('}') + 1
             
-            if json_start != -1 and json_end != -1:
+            if json_start != -1 and json_end > json_start:
                 json_text = response_text[json_start:json_end]
-                return json_text
+                try:
+                    return parse_plan(json_text).model_dump_json()
+                except ValueError:
+                    # Returned as is; the caller records the invalid output
+                    return json_text
             else:
                 print("Could not find JSON in model response, using fallback")
-                return self._generate_fallback_plan()
+                if call:
+                    call.set_outcome(AICallRecord.OUTCOME_FALLBACK)
+                return self._generate_fallback_plan(profile)
                 
         except Exception as e:
             print(f"Error generating plan with local model: {e}")
-            return self._generate_fallback_plan()
+            if call:
+                call.set_outcome(AICallRecord.OUTCOME_FALLBACK, e)
+            return self._generate_fallback_plan(profile)
 
-    def _generate_fallback_plan(self):
-        """Generate a basic fallback plan when the model fails"""
-        fallback_plan = {
-            "workout_days": [
-                {
-                    "day_of_week": 1,
-                    "title": "Full Body Workout",
-                    "is_rest_day": False,
-                    "description": "A comprehensive full-body workout using bodyweight exercises",
-                    "exercises": [
-                        {
-                            "name": "Push-ups",
-                            "sets": 3,
-                            "reps": "8-12",
-                            "rest_period_seconds": 60,
-                            "notes": "Keep your core tight and body straight"
-                        },
-                        {
-                            "name": "Squats",
-                            "sets": 3,
-                            "reps": "12-15",
-                            "rest_period_seconds": 60,
-                            "notes": "Keep your knees behind your toes"
-                        },
-                        {
-                            "name": "Plank",
-                            "sets": 3,
-                            "reps": "30-60 seconds",
-                            "rest_period_seconds": 60,
-                            "notes": "Hold the position steadily"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 2,
-                    "title": "Rest Day",
-                    "is_rest_day": True,
-                    "description": "Active recovery day - light walking or stretching",
-                    "exercises": []
-                },
-                {
-                    "day_of_week": 3,
-                    "title": "Cardio  Core",
-                    "is_rest_day": False,
-                    "description": "Cardiovascular exercise and core strengthening",
-                    "exercises": [
-                        {
-                            "name": "Jumping Jacks",
-                            "sets": 3,
-                            "reps": "20-30",
-                            "rest_period_seconds": 45,
-                            "notes": "Land softly on your feet"
-                        },
-                        {
-                            "name": "Mountain Climbers",
-                            "sets": 3,
-                            "reps": "15-20",
-                            "rest_period_seconds": 45,
-                            "notes": "Keep your core engaged"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 4,
-                    "title": "Rest Day",
-                    "is_rest_day": True,
-                    "description": "Complete rest or gentle stretching",
-                    "exercises": []
-                },
-                {
-                    "day_of_week": 5,
-                    "title": "Strength Training",
-                    "is_rest_day": False,
-                    "description": "Focus on building strength with bodyweight exercises",
-                    "exercises": [
-                        {
-                            "name": "Lunges",
-                            "sets": 3,
-                            "reps": "10-12 each leg",
-                            "rest_period_seconds": 60,
-                            "notes": "Step forward and lower your back knee"
-                        },
-                        {
-                            "name": "Wall Push-ups",
-                            "sets": 3,
-                            "reps": "12-15",
-                            "rest_period_seconds": 60,
-                            "notes": "Great for beginners"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 6,
-                    "title": "Active Recovery",
-                    "is_rest_day": False,
-                    "description": "Light activity and mobility work",
-                    "exercises": [
-                        {
-                            "name": "Walking",
-                            "sets": 1,
-                            "reps": "20-30 minutes",
-                            "rest_period_seconds": 0,
-                            "notes": "Maintain a steady, comfortable pace"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 7,
-                    "title": "Rest Day",
-                    "is_rest_day": True,
-                    "description": "Complete rest day",
-                    "exercises": []
-                }
-            ],
-            "nutrition_days": [
-                {
-                    "day_of_week": 1,
-                    "target_calories": 2000,
-                    "target_protein_grams": 120,
-                    "target_carbs_grams": 200,
-                    "target_fats_grams": 70,
-                    "notes": "Drink plenty of water throughout the day",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Porridge with groundnuts and banana",
-                            "calories": 450,
-                            "protein_grams": 18.0,
-                            "carbs_grams": 65.0,
-                            "fats_grams": 12.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Jollof rice with grilled chicken and vegetables",
-                            "calories": 600,
-                            "protein_grams": 35.0,
-                            "carbs_grams": 70.0,
-                            "fats_grams": 18.0,
-                            "portion_size": "1 plate"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Banku with tilapia and okra soup",
-                            "calories": 550,
-                            "protein_grams": 30.0,
-                            "carbs_grams": 45.0,
-                            "fats_grams": 20.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Roasted plantain with groundnuts",
-                            "calories": 200,
-                            "protein_grams": 8.0,
-                            "carbs_grams": 30.0,
-                            "fats_grams": 6.0,
-                            "portion_size": "1 medium plantain"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 2,
-                    "target_calories": 1900,
-                    "target_protein_grams": 110,
-                    "target_carbs_grams": 190,
-                    "target_fats_grams": 65,
-                    "notes": "Focus on hydration and light, nutritious meals",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Kokonte with palm nut soup",
-                            "calories": 400,
-                            "protein_grams": 15.0,
-                            "carbs_grams": 55.0,
-                            "fats_grams": 12.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Waakye with boiled egg and shito",
-                            "calories": 520,
-                            "protein_grams": 25.0,
-                            "carbs_grams": 60.0,
-                            "fats_grams": 18.0,
-                            "portion_size": "1 plate"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Kenkey with pepper and fried fish",
-                            "calories": 480,
-                            "protein_grams": 28.0,
-                            "carbs_grams": 40.0,
-                            "fats_grams": 20.0,
-                            "portion_size": "2 balls kenkey"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Fresh coconut water and meat",
-                            "calories": 150,
-                            "protein_grams": 3.0,
-                            "carbs_grams": 15.0,
-                            "fats_grams": 8.0,
-                            "portion_size": "1 coconut"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 3,
-                    "target_calories": 2100,
-                    "target_protein_grams": 125,
-                    "target_carbs_grams": 210,
-                    "target_fats_grams": 75,
-                    "notes": "Higher calorie day to support workout recovery",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Hausa koko with koose",
-                            "calories": 420,
-                            "protein_grams": 16.0,
-                            "carbs_grams": 58.0,
-                            "fats_grams": 14.0,
-                            "portion_size": "1 bowl with 2 koose"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Fufu with light soup and chicken",
-                            "calories": 650,
-                            "protein_grams": 40.0,
-                            "carbs_grams": 75.0,
-                            "fats_grams": 22.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Fried rice with vegetables and beef",
-                            "calories": 580,
-                            "protein_grams": 32.0,
-                            "carbs_grams": 55.0,
-                            "fats_grams": 25.0,
-                            "portion_size": "1 plate"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Bofrot with peanut butter",
-                            "calories": 250,
-                            "protein_grams": 10.0,
-                            "carbs_grams": 28.0,
-                            "fats_grams": 12.0,
-                            "portion_size": "2 pieces"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 4,
-                    "target_calories": 1850,
-                    "target_protein_grams": 105,
-                    "target_carbs_grams": 180,
-                    "target_fats_grams": 60,
-                    "notes": "Rest day - lighter meals",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Tom brown with milk and honey",
-                            "calories": 380,
-                            "protein_grams": 14.0,
-                            "carbs_grams": 52.0,
-                            "fats_grams": 12.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Yam with kontomire stew",
-                            "calories": 500,
-                            "protein_grams": 22.0,
-                            "carbs_grams": 65.0,
-                            "fats_grams": 16.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Gari with beans and palm oil",
-                            "calories": 450,
-                            "protein_grams": 18.0,
-                            "carbs_grams": 55.0,
-                            "fats_grams": 15.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Kelewele with groundnuts",
-                            "calories": 220,
-                            "protein_grams": 8.0,
-                            "carbs_grams": 25.0,
-                            "fats_grams": 10.0,
-                            "portion_size": "1 portion"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 5,
-                    "target_calories": 2050,
-                    "target_protein_grams": 120,
-                    "target_carbs_grams": 205,
-                    "target_fats_grams": 72,
-                    "notes": "Pre-workout nutrition focus",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Oats with banana and groundnuts",
-                            "calories": 440,
-                            "protein_grams": 16.0,
-                            "carbs_grams": 62.0,
-                            "fats_grams": 14.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Red red with plantain and fish",
-                            "calories": 620,
-                            "protein_grams": 35.0,
-                            "carbs_grams": 68.0,
-                            "fats_grams": 20.0,
-                            "portion_size": "1 plate"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Ampesi with nkontomire and eggs",
-                            "calories": 520,
-                            "protein_grams": 28.0,
-                            "carbs_grams": 50.0,
-                            "fats_grams": 22.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Chin chin with Tiger nuts",
-                            "calories": 180,
-                            "protein_grams": 6.0,
-                            "carbs_grams": 20.0,
-                            "fats_grams": 8.0,
-                            "portion_size": "1 handful"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 6,
-                    "target_calories": 1950,
-                    "target_protein_grams": 115,
-                    "target_carbs_grams": 195,
-                    "target_fats_grams": 65,
-                    "notes": "Active recovery day nutrition",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Millet porridge with coconut milk",
-                            "calories": 410,
-                            "protein_grams": 12.0,
-                            "carbs_grams": 58.0,
-                            "fats_grams": 15.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Tuo zaafi with ayoyo soup",
-                            "calories": 560,
-                            "protein_grams": 28.0,
-                            "carbs_grams": 70.0,
-                            "fats_grams": 18.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Konkonte with groundnut soup",
-                            "calories": 490,
-                            "protein_grams": 25.0,
-                            "carbs_grams": 45.0,
-                            "fats_grams": 20.0,
-                            "portion_size": "1 bowl"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Sobolo with meat pie",
-                            "calories": 200,
-                            "protein_grams": 8.0,
-                            "carbs_grams": 22.0,
-                            "fats_grams": 8.0,
-                            "portion_size": "1 glass + 1 pie"
-                        }
-                    ]
-                },
-                {
-                    "day_of_week": 7,
-                    "target_calories": 1800,
-                    "target_protein_grams": 100,
-                    "target_carbs_grams": 175,
-                    "target_fats_grams": 58,
-                    "notes": "Rest day - focus on recovery",
-                    "meals": [
-                        {
-                            "meal_type": "breakfast",
-                            "description": "Bread with egg and tea",
-                            "calories": 350,
-                            "protein_grams": 15.0,
-                            "carbs_grams": 45.0,
-                            "fats_grams": 12.0,
-                            "portion_size": "2 slices + 1 egg"
-                        },
-                        {
-                            "meal_type": "lunch",
-                            "description": "Banku with tilapia in tomato sauce",
-                            "calories": 540,
-                            "protein_grams": 30.0,
-                            "carbs_grams": 58.0,
-                            "fats_grams": 18.0,
-                            "portion_size": "1 portion"
-                        },
-                        {
-                            "meal_type": "dinner",
-                            "description": "Jollof rice with chicken and salad",
-                            "calories": 480,
-                            "protein_grams": 28.0,
-                            "carbs_grams": 52.0,
-                            "fats_grams": 16.0,
-                            "portion_size": "1 plate"
-                        },
-                        {
-                            "meal_type": "snack",
-                            "description": "Watermelon and peanuts",
-                            "calories": 160,
-                            "protein_grams": 7.0,
-                            "carbs_grams": 18.0,
-                            "fats_grams": 6.0,
-                            "portion_size": "1 slice + handful"
-                        }
-                    ]
-                }
-            ]
-        }
-        return json.dumps(fallback_plan)
+    @staticmethod
+    def _generate_fallback_plan(profile=None):
+        """The procedural fallback plan for the profile as JSON, see rest/fallback_plans.py"""
+        return build_fallback_plan(profile).model_dump_json()
+
+
+def generate_fallback_plan_data(profile=None):
+    """
+    The rule-based fallback plan for the profile as a GeneratedPlanSchema.
+    Needs no model, so it is also the last resort when Gemini is unavailable.
+    """
+    return build_fallback_plan(profile)
 
 
 # Global model instance
 _local_model = None
 
 def get_local_model():
-    """Get or create the local model instance"""
+    """
+    Get or create the local model instance: a client of the shared inference
+    server if LOCAL_INFERENCE_URL is set, else a model loaded in this process.
+    """
     global _local_model
     if _local_model is None:
         model_path = os.path.join(settings.BASE_DIR, 'model.gguf')
-        _local_model = LocalModel(model_path)
+        _local_model = LocalModel(model_path, server_url=getattr(settings, 'LOCAL_INFERENCE_URL', '') or None)
     return _local_model
 
 
@@ -607,70 +319,36 @@ def generate_and_save_local_plan_for_user(user_profile: Profile, start_date: dat
     """
 
     # Call the local model
-    try:
-        local_model = get_local_model()
-        response_text = local_model.generate_plan(prompt)
-        plan_data = json.loads(response_text)
-    except Exception as e:
-        print(f"Error calling local model: {e}")
-        return None
+    local_model = get_local_model()
+    with track_ai_call('local', os.path.basename(local_model.model_path), user=user_profile.user) as call:
+        response_text = local_model.generate_plan(prompt, call=call, profile=user_profile)
+        try:
+            plan_data = GeneratedPlanSchema.model_validate_json(response_text)
+        except ValueError as e:
+            print(f"Invalid plan returned by local model: {e}")
+            plan_data, report = repair_local_plan(response_text)
+            if plan_data is None:
+                call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                return None
+            call.set_outcome(AICallRecord.OUTCOME_REPAIRED, report)
+        if call.outcome is None:
+            call.set_outcome(AICallRecord.OUTCOME_VALID)
+    plan_data = apply_profile_targets(user_profile, plan_data)
 
     # Save to database
     print(f"Generated plan data: {plan_data}")
     try:
-        with transaction.atomic():
-            new_plan = FitnessPlan.objects.create(
-                profile=user_profile,
-                start_date=start_date,
-                end_date=end_date,
-                goal_at_creation=user_profile.goal,
-                ai_prompt_text=prompt,
-                ai_response_raw=plan_data
-            )
-
-            # Create Workout Days and Exercises
-            for wd_data in plan_data['workout_days']:
-                workout_day = WorkoutDay.objects.create(
-                    plan=new_plan,
-                    day_of_week=wd_data['day_of_week'],
-                    title=wd_data['title'],
-                    description=wd_data['description'],
-                    is_rest_day=wd_data['is_rest_day']
-                )
-                for ex_data in wd_data['exercises']:
-                    Exercise.objects.create(
-                        workout_day=workout_day,
-                        name=ex_data['name'],
-                        sets=ex_data['sets'],
-                        reps=ex_data['reps'],
-                        rest_period_seconds=ex_data['rest_period_seconds'],
-                        notes=ex_data['notes']
-                    )
-
-            # Create Nutrition Days and Meals
-            for nd_data in plan_data['nutrition_days']:
-                nutrition_day = NutritionDay.objects.create(
-                    plan=new_plan,
-                    day_of_week=nd_data['day_of_week'],
-                    notes=nd_data['notes'],
-                    target_calories=nd_data['target_calories'],
-                    target_protein_grams=nd_data['target_protein_grams'],
-                    target_carbs_grams=nd_data['target_carbs_grams'],
-                    target_fats_grams=nd_data['target_fats_grams']
-                )
-                for meal_data in nd_data['meals']:
-                    Meal.objects.create(
-                        nutrition_day=nutrition_day,
-                        meal_type=meal_data['meal_type'],
-                        description=meal_data['description'],
-                        calories=meal_data['calories'],
-                        protein_grams=meal_data['protein_grams'],
-                        carbs_grams=meal_data['carbs_grams'],
-                        fats_grams=meal_data['fats_grams'],
-                        portion_size=meal_data['portion_size']
-                    )
+        new_plan = materialize_plan(
+            user_profile,
+            start_date,
+            plan_data,
+            end_date=end_date,
+            prompt=prompt
+        )
         print(f"Plan successfully generated and saved for user: {user_profile.user.username}")
         return new_plan
+    except PlanOverlapError:
+        raise
     except Exception as e:
         print(f"Error saving plan to database: {e}")
         return None
@@ -1,3 +1,248 @@
-from django.test import TestCase
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from .benchmark import BENCHMARK_PROFILES, StubLlama
+from .inference_server import (
+    Inference, LocalInferenceClient, LocalInferenceError, UnixHTTPConnection, create_server, get_grammar,
+)
+from .lifecycle import ModelLifecycle
+from .prefix_cache import PrefixCache
+from .scheduler import InferenceQueueFull, InferenceScheduler, InferenceTimeout
+
+
+class LocalInferenceServerTests(SimpleTestCase):
+    def setUp(self):
+        self.inference = Inference('model.gguf')
+        self.inference.model, self.inference.status = StubLlama(n_ctx=1), 'ready'
+        socket_path = os.path.join(tempfile.mkdtemp(), 'llm.sock')
+        self.url = f"unix://{socket_path}"
+        server = create_server(self.url, self.inference)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(os.unlink, socket_path)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = LocalInferenceClient(self.url, timeout=10, health_ttl=0)
+
+    def post_completion(self):
+        connection = UnixHTTPConnection(self.url[len('unix://'):], timeout=10)
+        try:
+            connection.request('POST', '/completion', body=json.dumps({'prompt': "Create a plan."}))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_tokens_are_counted_on_the_server(self):
+        text = '{"w": [{"d": 1, "t": "Rest Day"}]}'.encode('utf-8')
+        tokens = self.client.tokenize(text, add_bos=False)
+        self.assertEqual(tokens, self.inference.model.tokenize(text))
+
+    def test_completion_is_run_on_the_server(self):
+        self.assertTrue(self.client.is_ready())
+        response = self.client("Create a plan.", max_tokens=5, echo=True)
+        self.assertEqual(response['usage'], {'prompt_tokens': 4, 'completion_tokens': 5})
+        self.assertEqual(self.client.health()['scheduler']['completed'], 1)
+
+    def test_unavailable_and_timed_out_completions_are_errors(self):
+        self.inference.model, self.inference.status = None, 'loading'
+        self.assertEqual(self.post_completion(), (503, {'error': "The model is loading."}))
+        with self.assertRaisesMessage(LocalInferenceError, "The model is loading."):
+            self.client("Create a plan.")
+        self.inference.model = StubLlama(n_ctx=1)
+        for error, status in ((InferenceQueueFull("The queue is full."), 503), (InferenceTimeout("Timed out."), 504)):
+            with mock.patch.object(self.inference.scheduler, 'submit', side_effect=error):
+                self.assertEqual(self.post_completion(), (status, {'error': str(error)}))
+                with self.assertRaisesMessage(LocalInferenceError, str(error)):
+                    self.client("Create a plan.")
+
+    def test_unreachable_server_is_reported_by_health(self):
+        client = LocalInferenceClient(f"{self.url}.missing", connect_timeout=0.5)
+        self.assertEqual(client.health()['status'], 'unreachable')
+        self.assertFalse(client.is_ready())
+
+
+class GrammarTests(SimpleTestCase):
+    def setUp(self):
+        self.from_json_schema = mock.Mock(side_effect=lambda schema, verbose: object())
+        llama_cpp = types.SimpleNamespace(LlamaGrammar=types.SimpleNamespace(from_json_schema=self.from_json_schema))
+        for patcher in (
+            mock.patch.dict(sys.modules, {'llama_cpp': llama_cpp}),
+            mock.patch.dict('ai_local.inference_server._grammars', clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_grammar_is_compiled_once_per_schema(self):
+        schema = {'type': 'object', 'properties': {'w': {'type': 'array'}}, 'required': ['w']}
+        grammar = get_grammar(schema)
+        self.assertIs(get_grammar(dict(reversed(schema.items()))), grammar)
+        self.assertIsNot(get_grammar({'type': 'array'}), grammar)
+        self.assertEqual(self.from_json_schema.call_count, 2)
+
+    def test_completions_are_constrained_by_the_cached_grammar(self):
+        inference = Inference('model.gguf')
+        inference.model, inference.status = StubLlama(n_ctx=1), 'ready'
+        schema = {'type': 'array'}
+        with mock.patch.object(inference.scheduler, 'submit') as submit:
+            inference.complete("Create a plan.", json_schema=schema, max_tokens=5)
+        submit.assert_called_once_with(
+            "Create a plan.", timeout=inference.queue_timeout, max_tokens=5, grammar=get_grammar(schema),
+        )
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.prompts = []
+        self.scheduler = InferenceScheduler(self.run_completion, max_queue=1)
+        self.addCleanup(self.release.set)
+
+    def run_completion(self, prompt, **params):
+        self.prompts.append(prompt)
+        self.started.set()
+        self.release.wait(5)
+        return f"completion of {prompt}"
+
+    def submit_in_background(self, prompt):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.scheduler.submit(prompt, timeout=5)))
+        thread.start()
+        return thread, results
+
+    def test_full_queue_is_rejected_and_identical_requests_coalesced(self):
+        running, _ = self.submit_in_background("first")
+        self.assertTrue(self.started.wait(5))
+        queued, queued_results = self.submit_in_background("second")
+        coalesced, coalesced_results = self.submit_in_background("second")
+        while self.scheduler.get_stats()['coalesced'] < 1:
+            threading.Event().wait(0.01)
+        with self.assertRaises(InferenceQueueFull):
+            self.scheduler.submit("third")
+
+        self.release.set()
+        for thread in (running, queued, coalesced):
+            thread.join(5)
+        self.assertEqual(self.prompts, ["first", "second"])
+        self.assertEqual(queued_results, coalesced_results)
+        stats = self.scheduler.get_stats()
+        self.assertEqual(
+            {key: stats[key] for key in ('queue_depth', 'running', 'completed', 'rejected', 'coalesced')},
+            {'queue_depth': 0, 'running': False, 'completed': 2, 'rejected': 1, 'coalesced': 1},
+        )
+        self.assertIsNotNone(stats['run_seconds']['p95'])
+
+    def test_timed_out_request_is_not_run(self):
+        running, _ = self.submit_in_background("first")
+        self.assertTrue(self.started.wait(5))
+        with self.assertRaises(InferenceTimeout):
+            self.scheduler.submit("second", timeout=0.05)
+        self.assertEqual(self.scheduler.get_stats()['queue_depth'], 0)
+
+        self.release.set()
+        running.join(5)
+        self.assertEqual(self.scheduler.submit("third", timeout=5), "completion of third")
+        self.assertEqual(self.prompts, ["first", "third"])
+        self.assertEqual(self.scheduler.get_stats()['timed_out'], 1)
+
+
+class PrefixCacheTests(SimpleTestCase):
+    def test_prefix_is_reused_restored_or_skipped(self):
+        model = StubLlama(n_ctx=1)
+        prefix = "You are a fitness coach. Answer in the compact plan format."
+        cache = PrefixCache(model, prefix)
+        cache.warm()
+        prefix_tokens = list(cache.tokens)
+
+        cache.prepare(f"{prefix} Plan for Ama.")
+        model(f"{prefix} Plan for Ama.", max_tokens=1)
+        cache.prepare(f"{prefix} Plan for Kofi.")
+        model("Summarize this workout.", max_tokens=1)
+        cache.prepare(f"{prefix} Plan for Esi.")
+        self.assertEqual(model.input_ids, prefix_tokens)
+        cache.prepare("Summarize this workout.")
+
+        self.assertEqual(cache.get_stats(), {
+            'prefix_tokens': len(prefix_tokens), 'warm_seconds': round(cache.warm_seconds, 3),
+            'hits': 2, 'restores': 1, 'misses': 1,
+        })
+
+
+class ModelLifecycleTests(SimpleTestCase):
+    def setUp(self):
+        self.load = mock.Mock(return_value=True)
+        self.unload = mock.Mock()
+
+    def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return True
+            threading.Event().wait(0.01)
+        return False
+
+    def test_model_is_loaded_on_first_use(self):
+        lifecycle = ModelLifecycle(self.load, self.unload)
+        self.assertEqual(lifecycle.state, ModelLifecycle.STATE_UNLOADED)
+        self.load.assert_not_called()
+        self.assertTrue(lifecycle.ensure_loaded())
+        self.assertTrue(lifecycle.ensure_loaded())
+        self.assertEqual(self.load.call_count, 1)
+        self.assertEqual(lifecycle.get_status()['loads'], 1)
+
+    def test_failed_load_is_retried_after_retry_after(self):
+        self.load.side_effect = [False, RuntimeError("mmap failed"), True]
+        lifecycle = ModelLifecycle(self.load, self.unload, retry_after=60)
+        self.assertFalse(lifecycle.ensure_loaded())
+        self.assertFalse(lifecycle.ensure_loaded())
+        self.assertEqual(self.load.call_count, 1)
+        self.assertEqual(lifecycle.get_status()['state'], ModelLifecycle.STATE_FAILED)
+        for loaded in (False, True):
+            lifecycle.failed_at -= 60
+            self.assertEqual(lifecycle.ensure_loaded(), loaded)
+        self.assertEqual(self.load.call_count, 3)
+        self.assertEqual(lifecycle.state, ModelLifecycle.STATE_READY)
+
+    def test_idle_model_is_unloaded_but_not_while_in_use(self):
+        lifecycle = ModelLifecycle(self.load, self.unload, idle_timeout=0.05)
+        with lifecycle.in_use():
+            self.assertTrue(lifecycle.ensure_loaded())
+            threading.Event().wait(0.2)
+            self.unload.assert_not_called()
+        self.assertTrue(self.wait_for(lambda: lifecycle.state == ModelLifecycle.STATE_UNLOADED))
+        self.assertEqual(self.unload.call_count, 1)
+        self.assertTrue(lifecycle.ensure_loaded())
+        self.assertEqual(self.load.call_count, 2)
+
+
+class BenchmarkLocalModelTests(SimpleTestCase):
+    def test_report_has_a_result_per_configuration(self):
+        stdout = StringIO()
+        call_command(
+            'benchmark_local_model', '--stub', '--threads', '1,2', '--batch', '256', '--ctx', '1',
+            '--max-tokens', '40', stdout=stdout, stderr=StringIO(),
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['backend'], 'stub')
+        self.assertIsNone(report['model'])
+        self.assertEqual(
+            report['corpus'], {'profiles': len(BENCHMARK_PROFILES), 'prompts': len(BENCHMARK_PROFILES), 'max_tokens': 40},
+        )
+        self.assertEqual(set(report['host']), {'machine', 'cpu_count', 'python', 'llama_cpp'})
+        self.assertEqual([(r['n_threads'], r['n_batch'], r['n_ctx']) for r in report['results']], [(1, 256, 1), (2, 256, 1)])
+        for result in report['results']:
+            self.assertEqual(result['runs'], len(BENCHMARK_PROFILES))
+            self.assertGreater(result['completions'], 0)
+            self.assertEqual(result['mean_completion_tokens'], 40)
+            self.assertGreater(result['prompt_tokens_per_second'], 0)
+            self.assertGreater(result['generation_tokens_per_second'], 0)
+            self.assertTrue(0 <= result['schema_pass_rate'] <= 1)
+            self.assertTrue(0 <= result['fallback_rate'] <= 1)
@@ -3,7 +3,7 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from .services import get_local_model
+from .services import LLAMA_CPP_AVAILABLE, get_local_model
 import os
 from django.conf import settings
 
@@ -15,15 +15,35 @@ def model_status(request):
     """
     try:
         model = get_local_model()
+        if model.server_url:
+            # The model lives in the shared inference server process
+            health = model.model.health()
+            return JsonResponse({
+                'model_loaded': health.get('status') == 'ready',
+                'server_url': model.server_url,
+                'server_status': health.get('status'),
+                'model_path': health.get('model_path'),
+                'status': 'ready' if health.get('status') == 'ready' else 'fallback_only',
+                'error': health.get('error'),
+                'scheduler': health.get('scheduler'),
+                'prefix_cache': health.get('prefix_cache'),
+            })
+
         model_file_exists = os.path.exists(model.model_path)
+        # unloaded (loads on first use), loading, ready or failed; see ai_local/lifecycle.py
+        lifecycle = model.lifecycle.get_status() if model.lifecycle else None
+        state = lifecycle['state'] if lifecycle else None
         
         status = {
-            'model_loaded': model.model is not None,
+            'model_loaded': model.is_ready(),
             'model_path': model.model_path,
             'model_file_exists': model_file_exists,
-            'llama_cpp_available': hasattr(model, 'model') and model.model is not None,
-            'status': 'ready' if model.model else 'fallback_only',
-            'expected_model_path': os.path.join(settings.BASE_DIR, 'DeepSeek_R1_Distill_Qwen_1_5B.gguf')
+            'llama_cpp_available': LLAMA_CPP_AVAILABLE,
+            'status': state if state in ('ready', 'loading', 'unloaded') and model_file_exists else 'fallback_only',
+            'lifecycle': lifecycle,
+            'expected_model_path': os.path.join(settings.BASE_DIR, 'DeepSeek_R1_Distill_Qwen_1_5B.gguf'),
+            'scheduler': model.scheduler.get_stats() if model.scheduler else None,
+            'prefix_cache': model.prefix_cache.get_stats() if model.prefix_cache else None,
         }
         return JsonResponse(status)
     except Exception as e:
@@ -53,7 +73,7 @@ def test_generation(request):
         
         return JsonResponse({
             'success': True,
-            'using_model': model.model is not None,
+            'using_model': model.is_ready(),
             'response_preview': response_text[:500] + '...' if len(response_text) > 500 else response_text
         })
     except Exception as e:
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+# Tells the apps this process serves requests (see rest/apps.py)
+os.environ.setdefault('DJANGO_SERVING', 'true')
 
 application = get_asgi_application()
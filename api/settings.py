@@ -181,6 +181,9 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',  # Path to your SQLite database file
         'OPTIONS': {
             'timeout': 20, # seconds
+            # take the write lock when a transaction starts, so concurrent plan
+            # saves wait for each other instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
         },
         # for postgresql
         # 'ENGINE': f'django.db.backends.{getenv("DB_TYPE", "postgresql")}',
@@ -233,3 +236,164 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Plan generation jobs
+# Plans are generated by background workers that poll a DB-backed queue.
+# Run `python manage.py run_plan_workers` for dedicated workers, or let each
+# web process start its own embedded pool at startup.
+
+PLAN_JOB_WORKERS = int(getenv('PLAN_JOB_WORKERS', '2'))  # concurrent generations per process
+PLAN_JOB_POLL_INTERVAL = float(getenv('PLAN_JOB_POLL_INTERVAL', '1.0'))  # seconds
+PLAN_JOB_EMBEDDED_WORKERS = getenv('PLAN_JOB_EMBEDDED_WORKERS', 'True') == 'True'
+# Running jobs hold a lease their worker renews every third of this; a job
+# whose lease expires (its worker died) is requeued. Keep it longer than the
+# worst-case generation time (API retries plus the fallback).
+PLAN_JOB_LEASE_SECONDS = int(getenv('PLAN_JOB_LEASE_SECONDS', '900'))
+PLAN_JOB_MAX_ATTEMPTS = int(getenv('PLAN_JOB_MAX_ATTEMPTS', '2'))
+
+# Generated plan cache
+# Plans are cached by a fingerprint of the prompt-relevant profile fields.
+# LocMemCache is per process; use a DatabaseCache or Redis backend to share it.
+
+PLAN_CACHE_ENABLED = getenv('PLAN_CACHE_ENABLED', 'True') == 'True'
+PLAN_CACHE_ALIAS = 'plan_responses'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    PLAN_CACHE_ALIAS: {
+        'BACKEND': getenv('PLAN_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': getenv('PLAN_CACHE_LOCATION', 'plan-responses'),
+        'TIMEOUT': int(getenv('PLAN_CACHE_TTL_SECONDS', str(60 * 60 * 24 * 7))),  # seconds
+        'OPTIONS': {
+            'MAX_ENTRIES': int(getenv('PLAN_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+}
+
+# Fan-out generation
+# Request the workout and nutrition halves (optionally split into day ranges)
+# in parallel instead of as one long response.
+
+PLAN_GENERATION_FANOUT = getenv('PLAN_GENERATION_FANOUT', 'False') == 'True'
+PLAN_FANOUT_DAY_SPLITS = int(getenv('PLAN_FANOUT_DAY_SPLITS', '1'))  # ranges per half, 1-7
+PLAN_FANOUT_MAX_WORKERS = int(getenv('PLAN_FANOUT_MAX_WORKERS', '4'))  # concurrent sub-requests per plan
+
+# AI call telemetry
+# Prices in USD per million (prompt, output) tokens, used to record the
+# estimated cost of each AICallRecord. Local model and rule-based calls cost
+# nothing; calls to models not listed here have no cost recorded.
+
+AI_MODEL_PRICES = {
+    'gemini-2.5-flash': (
+        float(getenv('GEMINI_PROMPT_PRICE_PER_MTOK', '0.30')),
+        float(getenv('GEMINI_OUTPUT_PRICE_PER_MTOK', '2.50')),
+    ),
+}
+
+# AI artifact storage
+# Prompts and raw responses of new plans are stored compressed and deduplicated.
+# 'zstd' needs the zstandard package and falls back to zlib without it.
+# Move older plans over with `python manage.py backfill_ai_artifacts`.
+
+AI_ARTIFACT_CODEC = getenv('AI_ARTIFACT_CODEC', 'zlib')  # 'zlib' or 'zstd'
+AI_ARTIFACT_COMPRESSION_LEVEL = int(getenv('AI_ARTIFACT_COMPRESSION_LEVEL', '6'))
+
+# Plan generator backends
+# Backends in order of preference: registered names ('gemini', 'local',
+# 'fallback') or dotted paths of rest.plan_backends.PlanBackend subclasses.
+# The router skips unavailable backends, backends cooling down after repeated
+# failures, and backends whose rolling p95 is over the latency budget while a
+# faster one is healthy.
+
+PLAN_GENERATOR_BACKENDS = getenv('PLAN_GENERATOR_BACKENDS', 'gemini,local,fallback').split(',')
+PLAN_ROUTER_LATENCY_BUDGET_SECONDS = float(getenv('PLAN_ROUTER_LATENCY_BUDGET_SECONDS', '30'))
+PLAN_ROUTER_FAILURE_THRESHOLD = int(getenv('PLAN_ROUTER_FAILURE_THRESHOLD', '3'))
+PLAN_ROUTER_COOLDOWN_SECONDS = float(getenv('PLAN_ROUTER_COOLDOWN_SECONDS', '60'))
+PLAN_ROUTER_LATENCY_WINDOW = int(getenv('PLAN_ROUTER_LATENCY_WINDOW', '50'))  # latest calls per backend
+PLAN_ROUTER_LATENCY_MAX_AGE_SECONDS = float(getenv('PLAN_ROUTER_LATENCY_MAX_AGE_SECONDS', '300'))  # older samples are ignored
+
+# Hedged generation: if the preferred backend has not answered within
+# PLAN_HEDGE_AFTER_SECONDS (default: its rolling p95), PLAN_HEDGE_BACKEND is
+# started as well and the first valid plan wins.
+PLAN_HEDGING_ENABLED = getenv('PLAN_HEDGING_ENABLED', 'False') == 'True'
+PLAN_HEDGE_AFTER_SECONDS = float(getenv('PLAN_HEDGE_AFTER_SECONDS', '0'))  # 0 to use the p95
+PLAN_HEDGE_DEFAULT_SECONDS = float(getenv('PLAN_HEDGE_DEFAULT_SECONDS', '20'))  # until there is a p95
+PLAN_HEDGE_BACKEND = getenv('PLAN_HEDGE_BACKEND', 'fallback')  # empty for the next backend in line
+
+# Archetype plans
+# A user's first plan is created instantly from the closest pre-generated
+# archetype (`python manage.py build_plan_archetypes`) with their nutrition
+# targets, and then personalized by a background job.
+
+PLAN_ARCHETYPES_ENABLED = getenv('PLAN_ARCHETYPES_ENABLED', 'True') == 'True'
+PLAN_ARCHETYPE_PERSONALIZE = getenv('PLAN_ARCHETYPE_PERSONALIZE', 'True') == 'True'
+PLAN_ARCHETYPE_BUILD_CONCURRENCY = int(getenv('PLAN_ARCHETYPE_BUILD_CONCURRENCY', '2'))
+
+# Nutrition targets
+# Daily calories, macros and water are computed locally (Mifflin-St Jeor,
+# rest/nutrition_targets.py); the model only generates meals. Days whose meals
+# are further than NUTRITION_MEAL_TOLERANCE from the calorie target have
+# their portions scaled to it.
+
+NUTRITION_TARGETS_ENABLED = getenv('NUTRITION_TARGETS_ENABLED', 'True') == 'True'
+NUTRITION_MEAL_TOLERANCE = float(getenv('NUTRITION_MEAL_TOLERANCE', '0.1'))  # fraction of the target
+
+# Wire schema the model writes plans in (rest/wire_schema.py): 'compact' (short
+# keys and meal type codes, expanded after validation) or 'full'. Streaming and
+# fan-out always use the full keys.
+PLAN_WIRE_SCHEMA = getenv('PLAN_WIRE_SCHEMA', 'compact')
+
+# Plans that fail validation are repaired (rest/plan_repair.py): truncated JSON
+# is closed, types coerced, values clamped, and only the missing days are
+# requested again from Gemini before any gaps are filled in.
+PLAN_REPAIR_ENABLED = getenv('PLAN_REPAIR_ENABLED', 'True') == 'True'
+PLAN_REPAIR_REQUEST_MISSING_DAYS = getenv('PLAN_REPAIR_REQUEST_MISSING_DAYS', 'True') == 'True'
+
+# Weekly plan renewal (`python manage.py renew_weekly_plans`)
+
+PLAN_RENEWAL_WITHIN_DAYS = int(getenv('PLAN_RENEWAL_WITHIN_DAYS', '2'))  # renew plans ending this soon
+PLAN_RENEWAL_CONCURRENCY = int(getenv('PLAN_RENEWAL_CONCURRENCY', '4'))
+PLAN_RENEWAL_PER_MINUTE = int(getenv('PLAN_RENEWAL_PER_MINUTE', '30'))  # Gemini quota budget, 0 for no limit
+
+# Gemini client
+# Calls are retried with jittered exponential backoff on timeouts, connection
+# errors and 408/429/5xx responses, within an overall deadline. After repeated
+# failures the circuit breaker opens and the router moves on to the next
+# backend in PLAN_GENERATOR_BACKENDS.
+
+GEMINI_ATTEMPT_TIMEOUT_SECONDS = float(getenv('GEMINI_ATTEMPT_TIMEOUT_SECONDS', '60'))
+GEMINI_DEADLINE_SECONDS = float(getenv('GEMINI_DEADLINE_SECONDS', '90'))
+GEMINI_MAX_ATTEMPTS = int(getenv('GEMINI_MAX_ATTEMPTS', '3'))
+GEMINI_MAX_CONNECTIONS = int(getenv('GEMINI_MAX_CONNECTIONS', '20'))
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(getenv('GEMINI_BREAKER_FAILURE_THRESHOLD', '5'))
+GEMINI_BREAKER_RECOVERY_SECONDS = float(getenv('GEMINI_BREAKER_RECOVERY_SECONDS', '30'))
+GEMINI_FALLBACK_TO_LOCAL = getenv('GEMINI_FALLBACK_TO_LOCAL', 'True') == 'True'  # streamed plans; others use PLAN_GENERATOR_BACKENDS
+
+# Shared local inference server (`python manage.py run_local_inference_server`).
+# When set, LocalModel is a thin client of the server (unix:///path/to.sock or
+# http://127.0.0.1:8765) instead of loading the GGUF model in every worker.
+LOCAL_INFERENCE_URL = getenv('LOCAL_INFERENCE_URL', '')
+LOCAL_INFERENCE_CONNECT_TIMEOUT_SECONDS = float(getenv('LOCAL_INFERENCE_CONNECT_TIMEOUT_SECONDS', '2'))
+LOCAL_INFERENCE_TIMEOUT_SECONDS = float(getenv('LOCAL_INFERENCE_TIMEOUT_SECONDS', '120'))
+# Completions run one at a time; more than this many waiting are rejected right away
+LOCAL_INFERENCE_MAX_QUEUE = int(getenv('LOCAL_INFERENCE_MAX_QUEUE', '8'))
+LOCAL_MODEL_GRAMMAR = getenv('LOCAL_MODEL_GRAMMAR', 'True') == 'True'  # constrain local output to the plan JSON schema
+LOCAL_MODEL_PREFIX_CACHE = getenv('LOCAL_MODEL_PREFIX_CACHE', 'True') == 'True'  # reuse the evaluated static prompt prefix
+
+# Local model lifecycle (ai_local/lifecycle.py). The in-process model loads on
+# first use, or in the background at startup with LOCAL_MODEL_WARMUP, and is
+# unloaded after LOCAL_MODEL_IDLE_UNLOAD_SECONDS without completions (0 keeps it).
+# Warmup loads a copy in every serving process (each gunicorn worker), so it is
+# off by default; run_local_inference_server always loads its model at startup.
+# The Llama options also apply to run_local_inference_server.
+LOCAL_MODEL_N_CTX = int(getenv('LOCAL_MODEL_N_CTX', '4096'))
+LOCAL_MODEL_N_THREADS = int(getenv('LOCAL_MODEL_N_THREADS', '4'))
+LOCAL_MODEL_N_BATCH = int(getenv('LOCAL_MODEL_N_BATCH', '512'))
+LOCAL_MODEL_N_GPU_LAYERS = int(getenv('LOCAL_MODEL_N_GPU_LAYERS', '-1'))  # -1 offloads all layers if a GPU is available
+LOCAL_MODEL_USE_MMAP = getenv('LOCAL_MODEL_USE_MMAP', 'True') == 'True'  # map the weights instead of reading them in
+LOCAL_MODEL_USE_MLOCK = getenv('LOCAL_MODEL_USE_MLOCK', 'False') == 'True'  # keep the weights from being swapped out
+LOCAL_MODEL_WARMUP = getenv('LOCAL_MODEL_WARMUP', 'False') == 'True'
+LOCAL_MODEL_IDLE_UNLOAD_SECONDS = float(getenv('LOCAL_MODEL_IDLE_UNLOAD_SECONDS', '0'))
+LOCAL_MODEL_LOAD_RETRY_SECONDS = float(getenv('LOCAL_MODEL_LOAD_RETRY_SECONDS', '300'))  # wait before loading again after a failed load
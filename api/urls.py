@@ -50,4 +50,7 @@ urlpatterns = [
     # other api urls
     path('api/', include(router.urls)),
     path('api/status/', rest_views.StatusView.as_view(), name='status'),
+    path('api/status/plan-cache/', rest_views.PlanCacheStatsView.as_view(), name='plan-cache-stats'),
+    path('api/status/ai-calls/', rest_views.AICallStatsView.as_view(), name='ai-call-stats'),
+    path('api/status/plan-backends/', rest_views.PlanBackendStatsView.as_view(), name='plan-backend-stats'),
 ]
@@ -1,7 +1,7 @@
 # rest/admin.py
 from django.contrib import admin
 from rest_framework.authtoken.admin import TokenAdmin
-from .models import Profile, FitnessPlan, Meal, Exercise, WorkoutDay, NutritionDay
+from .models import Profile, FitnessPlan, Meal, Exercise, WorkoutDay, NutritionDay, PlanGenerationJob, AICallRecord, AIArtifact, PlanArchetype
 # Register your models here.
 
 TokenAdmin.raw_id_fields = ('user',)
@@ -11,4 +11,8 @@ admin.site.register(FitnessPlan)  # Register the FitnessPlan model
 admin.site.register(Meal)  # Register the Meal model
 admin.site.register(Exercise)  # Register the Exercise model
 admin.site.register(WorkoutDay)  # Register the WorkoutDay model
-admin.site.register(NutritionDay)  # Register the NutritionDay model
\ No newline at end of file
+admin.site.register(NutritionDay)  # Register the NutritionDay model
+admin.site.register(PlanGenerationJob)  # Register the PlanGenerationJob model
+admin.site.register(AICallRecord)  # Register the AICallRecord model
+admin.site.register(AIArtifact)  # Register the AIArtifact model
+admin.site.register(PlanArchetype)  # Register the PlanArchetype model
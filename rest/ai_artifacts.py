@@ -0,0 +1,91 @@
+# rest/ai_artifacts.py
+"""
+Content-addressed storage for AI prompts and responses.
+
+Each artifact is keyed by the SHA-256 of its uncompressed content, so a
+prompt or response that is sent or received again (same profile, cached
+plan) is stored only once. Content is compressed with zlib, or with
+Zstandard when AI_ARTIFACT_CODEC = 'zstd' and the zstandard package is
+installed. Plans reference artifacts by foreign key and only load them
+when get_ai_prompt() / get_ai_response() is called.
+"""
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+
+from .models import AIArtifact
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+def _codec():
+    codec = getattr(settings, 'AI_ARTIFACT_CODEC', AIArtifact.CODEC_ZLIB)
+    if codec == AIArtifact.CODEC_ZSTD and not ZSTD_AVAILABLE:
+        return AIArtifact.CODEC_ZLIB
+    return codec
+
+
+def compress(content: bytes, codec: str) -> bytes:
+    level = getattr(settings, 'AI_ARTIFACT_COMPRESSION_LEVEL', 6)
+    if codec == AIArtifact.CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(content)
+    return zlib.compress(content, level)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == AIArtifact.CODEC_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("The zstandard package is required to read this artifact.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def store_bytes(content: bytes) -> AIArtifact:
+    """
+    Stores the content unless an artifact with the same digest exists,
+    and returns the artifact. Safe to call concurrently for the same content.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    artifact = AIArtifact.objects.filter(pk=digest).only('pk').first()
+    if artifact:
+        return artifact
+    codec = _codec()
+    artifact = AIArtifact(digest=digest, codec=codec, data=compress(content, codec), size=len(content))
+    # ignore_conflicts: another request may have stored the same content meanwhile
+    AIArtifact.objects.bulk_create([artifact], ignore_conflicts=True)
+    return artifact
+
+
+def store_text(text):
+    """Stores a prompt; returns None for an empty one."""
+    if not text:
+        return None
+    return store_bytes(text.encode('utf-8'))
+
+
+def store_json(value):
+    """
+    Stores a JSON value in canonical form (sorted keys, no whitespace), so
+    equal responses share an artifact. Returns None for None.
+    """
+    if value is None:
+        return None
+    return store_bytes(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+
+def read_bytes(artifact: AIArtifact) -> bytes:
+    return decompress(bytes(artifact.data), artifact.codec)
+
+
+def read_text(artifact: AIArtifact) -> str:
+    return read_bytes(artifact).decode('utf-8')
+
+
+def read_json(artifact: AIArtifact):
+    return json.loads(read_bytes(artifact))
@@ -0,0 +1,207 @@
+# rest/ai_client.py
+"""
+A resilient client layer around google-genai for plan generation.
+
+- One genai.Client per process, so HTTP connections are pooled and reused.
+- Every call has a per-attempt timeout and an overall deadline.
+- Retryable errors (timeouts, connection errors, 408/429/5xx) are retried
+  with jittered exponential backoff.
+- A circuit breaker fails fast while Gemini is degraded, so callers can go
+  straight to the fallback plan instead of waiting for timeouts.
+"""
+import threading
+import time
+from os import getenv
+
+import httpx
+from django.conf import settings
+from google import genai
+from google.genai import errors, types
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, stop_after_delay, wait_random_exponential
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class AIServiceUnavailable(Exception):
+    """Raised when the circuit breaker is open and calls are not attempted."""
+
+
+def is_retryable(exc):
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `recovery_timeout` seconds. After that a single trial call is let
+    through (half-open); its outcome closes or re-opens the breaker.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            # Half-open: let exactly one trial call through
+            if self._trial_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Lets another trial call through without recording an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print("Gemini circuit breaker opened")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+# Global client and breaker for this process
+_client = None
+_client_lock = threading.Lock()
+breaker = CircuitBreaker(
+    failure_threshold=getattr(settings, 'GEMINI_BREAKER_FAILURE_THRESHOLD', 5),
+    recovery_timeout=getattr(settings, 'GEMINI_BREAKER_RECOVERY_SECONDS', 30.0),
+)
+
+
+def get_client():
+    """Get or create the shared genai client with a pooled HTTP connection."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = genai.Client(
+                api_key=getenv('GOOGLE_AI_API_KEY'),
+                http_options=types.HttpOptions(
+                    timeout=int(getattr(settings, 'GEMINI_ATTEMPT_TIMEOUT_SECONDS', 60) * 1000),
+                    client_args={
+                        'limits': httpx.Limits(
+                            max_connections=getattr(settings, 'GEMINI_MAX_CONNECTIONS', 20),
+                            max_keepalive_connections=getattr(settings, 'GEMINI_MAX_CONNECTIONS', 20),
+                            keepalive_expiry=60,
+                        ),
+                    },
+                ),
+            )
+    return _client
+
+
+def _with_timeout(config, seconds):
+    """A copy of the config whose HTTP timeout is capped to `seconds`."""
+    timeout_ms = max(1000, int(seconds * 1000))
+    http_options = (config.http_options or types.HttpOptions()).model_copy(update={'timeout': timeout_ms})
+    return config.model_copy(update={'http_options': http_options})
+
+
+def generate_content(model, contents, config, deadline=None, call=None):
+    """
+    Calls models.generate_content with retries, a per-attempt timeout and
+    an overall deadline (seconds). Raises AIServiceUnavailable if the
+    breaker is open, or the last error once retries are exhausted.
+    Retries are counted on the telemetry `call`, if one is given.
+    """
+    if not breaker.allow_request():
+        raise AIServiceUnavailable("Gemini is temporarily unavailable.")
+
+    deadline = deadline or getattr(settings, 'GEMINI_DEADLINE_SECONDS', 90)
+    attempt_timeout = getattr(settings, 'GEMINI_ATTEMPT_TIMEOUT_SECONDS', 60)
+    expires_at = time.monotonic() + deadline
+    retrying = Retrying(
+        retry=retry_if_exception(is_retryable),
+        wait=wait_random_exponential(multiplier=0.5, max=8),
+        stop=stop_after_attempt(getattr(settings, 'GEMINI_MAX_ATTEMPTS', 3)) | stop_after_delay(deadline),
+        reraise=True,
+    )
+    failed = False
+    try:
+        for attempt in retrying:
+            with attempt:
+                if attempt.retry_state.attempt_number > 1:
+                    print(f"Retrying Gemini call (attempt {attempt.retry_state.attempt_number})")
+                    if call:
+                        call.retries = attempt.retry_state.attempt_number - 1
+                remaining = expires_at - time.monotonic()
+                return get_client().models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=_with_timeout(config, min(attempt_timeout, remaining)),
+                )
+    except Exception as e:
+        # A non-retryable error means the service answered; the request itself was bad
+        failed = is_retryable(e)
+        raise
+    finally:
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+
+def generate_content_stream(model, contents, config, call=None):
+    """
+    Streams models.generate_content_stream through the circuit breaker.
+    Streams are not retried, since chunks may already have been consumed.
+    The first chunk and the token usage are recorded on the telemetry `call`.
+    """
+    if not breaker.allow_request():
+        raise AIServiceUnavailable("Gemini is temporarily unavailable.")
+
+    try:
+        for chunk in get_client().models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=_with_timeout(config, getattr(settings, 'GEMINI_DEADLINE_SECONDS', 90)),
+        ):
+            if call:
+                call.mark_first_byte()
+                call.set_gemini_usage(chunk)
+            yield chunk
+    except Exception as e:
+        if is_retryable(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except BaseException:
+        # The consumer stopped reading (GeneratorExit) or the process was
+        # interrupted, so the call has no outcome
+        breaker.release_trial()
+        raise
+    breaker.record_success()
@@ -1,30 +1,27 @@
 # rest/ai_services.py (or views.py)
-from google import genai
 from google.genai import types
-from os import getenv
 from django.conf import settings
-from django.db import transaction
-from .models import Profile, FitnessPlan, WorkoutDay, Exercise, NutritionDay, Meal
+from django.db import connection
+from .models import Profile, AICallRecord
+from .ai_telemetry import track_ai_call
 from .schemas import GeneratedPlanSchema # Import your new Pydantic schema
-from datetime import date, timedelta
-import json
+from .plan_materializer import materialize_plan, PlanOverlapError
+from .plan_cache import get_cached_plan, cache_plan
+from .plan_backends import get_router, GeminiBackend
+from .nutrition_targets import compute_nutrition_targets, nutrition_targets_enabled, prompt_targets_line, apply_profile_targets
+from .plan_repair import repair_plan, is_plan_schema, build_missing_days_prompt
+from .schemas import GeneratedWorkoutDaysSchema, GeneratedNutritionDaysSchema, GeneratedNutritionMealsSchema, NutritionDaySchema
+from . import ai_client
+from datetime import date
 
-client = genai.Client(api_key=getenv('GOOGLE_AI_API_KEY'))
+GEMINI_MODEL = "gemini-2.5-flash"  # Use the appropriate model
 
-@transaction.atomic
-def generate_and_save_plan_for_user(user_profile: Profile, start_date: date):
+
+def build_user_details(user_profile: Profile):
     """
-    Generates a new fitness and nutrition plan using the Gemini API
-    with structured output and saves it to the database.
+    The 'User Details' section shared by the plan and regeneration prompts.
     """
-
-    print(f"Generating plan for user: {user_profile.user.username}")
-    # 1. Construct a detailed prompt from the user's profile
-    prompt = f"""
-    Generate a comprehensive 7-day fitness and nutrition plan for a user in Ghana.
-    The response MUST be a valid JSON object that adheres to the provided schema.
-
-    User Details:
+    return f"""User Details:
     - Age: {user_profile.age}
     - Gender: {user_profile.gender}
     - Weight: {user_profile.current_weight} kg
@@ -36,13 +33,24 @@ def generate_and_save_plan_for_user(user_profile: Profile, start_date: date):
     - Liked Foods: {user_profile.liked_foods or 'None specified'}
     - Disliked Foods: {user_profile.disliked_foods or 'None specified'}
     - Disabilities: {user_profile.disabilities or 'None specified'}
-    - Medical Conditions: {user_profile.medical_conditions or 'None specified'}
-    
+    - Medical Conditions: {user_profile.medical_conditions or 'None specified'}"""
+
+
+def build_plan_prompt(user_profile: Profile, start_date: date):
+    """
+    Builds the plan generation prompt from the user's profile.
+    """
+    return f"""
+    Generate a comprehensive 7-day fitness and nutrition plan for a user in Ghana.
+    The response MUST be a valid JSON object that adheres to the provided schema.
+
+    {build_user_details(user_profile)}
+
     Plan Details:
     - Start Date: {start_date} weekday = {start_date.isoweekday()}
 
     Instructions:
-    - The nutrition plan must focus on common, accessible Ghanaian foods.
+    - The nutrition plan must focus on common, accessible Ghanaian foods.{prompt_targets_line(compute_nutrition_targets(user_profile))}
     - The workout plan should include exercises that require minimal or no gym equipment.
     - The workouts do not necessarily have to be localized to Ghana.
     - Ensure all fields in the schema are populated accurately. For rest days, the 'exercises' list should be empty.
@@ -50,106 +58,178 @@ def generate_and_save_plan_for_user(user_profile: Profile, start_date: date):
     - Plans are supposed to span up to a maximum of 7 days (weekly, Monday to Sunday).
     """
 
-    # 2. Call the Gemini API with your Pydantic schema
-    try:
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",  # Use the appropriate model
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(thinking_budget=0),
-                safety_settings=[
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    ),
-                    types.SafetySetting(
-                        category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=types.HarmBlockThreshold.BLOCK_NONE
-                    )
-                ],
-                response_mime_type="application/json",
-                response_schema=GeneratedPlanSchema,  # Use the Pydantic schema for validation
-        )
-        )
-        
-        # The response.text will be a JSON string that is guaranteed to match your Pydantic schema
-        plan_data = json.loads(response.text)
 
-    except Exception as e:
-        # Handle potential API errors (e.g., content filtering, bad response)
-        print(f"Error calling Gemini API: {e}")
-        return None
+def build_generation_config(response_schema=GeneratedPlanSchema):
+    """
+    The structured-output config used for every plan generation call.
+    """
+    return types.GenerateContentConfig(
+        thinking_config=types.ThinkingConfig(thinking_budget=0),
+        safety_settings=[
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE
+            ),
+            types.SafetySetting(
+                category=types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                threshold=types.HarmBlockThreshold.BLOCK_NONE
+            )
+        ],
+        response_mime_type="application/json",
+        response_schema=response_schema,  # Use the Pydantic schema for validation
+    )
 
-    # 3. Parse the validated data and save it to your Django models
-    # The data is already validated by Pydantic via the API!
-    
-    print(f"Generated plan data: {plan_data}")
-    # Create the main FitnessPlan object
-    try: 
-        new_plan = FitnessPlan.objects.create(
-            profile=user_profile,
-            start_date=start_date,
-            end_date=start_date + timedelta(days=6),
-            goal_at_creation=user_profile.goal,
-            ai_prompt_text=prompt,
-            ai_response_raw=plan_data
+
+def request_missing_days(prompt: str, user=None):
+    """
+    A repair_plan() regenerate_days callable that asks Gemini for just the
+    missing days of one half of the plan.
+    """
+    def regenerate_days(field, missing_days):
+        if not getattr(settings, 'PLAN_REPAIR_REQUEST_MISSING_DAYS', True):
+            return None
+        if field == 'workout_days':
+            schema = GeneratedWorkoutDaysSchema
+        else:
+            schema = GeneratedNutritionMealsSchema if nutrition_targets_enabled() else GeneratedNutritionDaysSchema
+        print(f"Requesting missing {field} {missing_days}")
+        fragment = generate_plan_data(
+            build_missing_days_prompt(prompt, field, missing_days), user=user, schema=schema, purpose='plan-repair'
         )
+        if fragment is None:
+            return None
+        if field == 'nutrition_days':
+            return [NutritionDaySchema.model_validate(day.model_dump()) for day in fragment.nutrition_days]
+        return fragment.workout_days
+    return regenerate_days
 
-        # Create Workout Days and Exercises
-        for wd_data in plan_data['workout_days']:
-            workout_day = WorkoutDay.objects.create(
-                plan=new_plan,
-                day_of_week=wd_data['day_of_week'],
-                title=wd_data['title'],
-                description=wd_data['description'],
-                is_rest_day=wd_data['is_rest_day']
-            )
-            for ex_data in wd_data['exercises']:
-                Exercise.objects.create(
-                    workout_day=workout_day,
-                    name=ex_data['name'],
-                    sets=ex_data['sets'],
-                    reps=ex_data['reps'],
-                    duration_mins=ex_data['duration_mins'],
-                    met_value=ex_data['met_value'],
-                    rest_period_seconds=ex_data['rest_period_seconds'],
-                    notes=ex_data['notes']
-                )
-
-        # Create Nutrition Days and Meals
-        for nd_data in plan_data['nutrition_days']:
-            nutrition_day = NutritionDay.objects.create(
-                plan=new_plan,
-                day_of_week=nd_data['day_of_week'],
-                notes=nd_data['notes'],
-                target_calories=nd_data['target_calories'],
-                target_protein_grams=nd_data['target_protein_grams'],
-                target_carbs_grams=nd_data['target_carbs_grams'],
-                target_fats_grams=nd_data['target_fats_grams'],
-                target_water_litres=nd_data['target_water_litres'] # Handle optional field
+
+def generate_plan_data(prompt: str, user=None, schema=GeneratedPlanSchema, purpose='plan'):
+    """
+    Calls the Gemini API with structured output and returns the validated
+    GeneratedPlanSchema (or the given partial schema), or None if the call
+    fails after retries or the circuit breaker is open.
+    A whole plan that does not validate is repaired (see rest/plan_repair.py)
+    and returned as a GeneratedPlanSchema, if PLAN_REPAIR_ENABLED.
+    Must be called without a database transaction open.
+    """
+    with track_ai_call('gemini', GEMINI_MODEL, user=user, purpose=purpose) as call:
+        try:
+            response = ai_client.generate_content(
+                model=GEMINI_MODEL,
+                contents=prompt,
+                config=build_generation_config(schema),
+                call=call,
             )
-            for meal_data in nd_data['meals']:
-                Meal.objects.create(
-                    nutrition_day=nutrition_day,
-                    meal_type=meal_data['meal_type'],
-                    description=meal_data['description'],
-                    calories=meal_data['calories'],
-                    protein_grams=meal_data['protein_grams'],
-                    carbs_grams=meal_data['carbs_grams'],
-                    fats_grams=meal_data['fats_grams'],
-                    portion_size=meal_data['portion_size']
-                )
+        except Exception as e:
+            # Handle potential API errors (e.g., content filtering, bad response)
+            print(f"Error calling Gemini API: {e}")
+            call.set_outcome(AICallRecord.OUTCOME_ERROR, e)
+            return None
+
+        call.set_gemini_usage(response)
+        try:
+            # The response.text will be a JSON string that is guaranteed to match your Pydantic schema
+            plan_data = schema.model_validate_json(response.text)
+        except ValueError as e:
+            print(f"Invalid plan returned by Gemini API: {e}")
+            if not (is_plan_schema(schema) and getattr(settings, 'PLAN_REPAIR_ENABLED', True)):
+                call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                return None
+            plan_data, report = repair_plan(response.text or '', request_missing_days(prompt, user=user))
+            if plan_data is None:
+                call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                return None
+            print(f"Repaired plan returned by Gemini API: {report}")
+            call.set_outcome(AICallRecord.OUTCOME_REPAIRED, report)
+            return plan_data
+        call.set_outcome(AICallRecord.OUTCOME_VALID)
+        return plan_data
+
+
+def get_fallback_plan_data(prompt: str, user=None):
+    """
+    A plan from the backends the router would try after Gemini (the local
+    model, then the rule-based plan), used when a streamed Gemini plan
+    fails. Returns (plan_data, backend), or (None, None) if every backend
+    failed or GEMINI_FALLBACK_TO_LOCAL is disabled.
+    """
+    if not getattr(settings, 'GEMINI_FALLBACK_TO_LOCAL', True):
+        return None, None
+    router = get_router()
+    backends = [backend for backend in router.route() if backend.name != GeminiBackend.name]
+    print(f"Falling back to the {', '.join(b.name for b in backends) or 'no'} backends")
+    return router.generate(prompt, user=user, backends=backends)
+
+
+def release_db_connection():
+    """
+    Closes this thread's idle database connection before a long network call,
+    so it is not held for the whole generation. Django reopens it on next use.
+    """
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def generate_and_save_plan_for_user(user_profile: Profile, start_date: date):
+    """
+    Generates a new fitness and nutrition plan with the generator backend
+    picked by the router (see rest/plan_backends.py) and saves it to the
+    database.
+
+    Runs in three phases so no transaction is open during the API call:
+    build the prompt, generate and validate (or reuse a cached plan for
+    an equivalent profile), then persist in one short atomic block that
+    re-checks for overlapping plans.
+    Raises PlanOverlapError if a plan for the date was saved meanwhile.
+    """
+
+    print(f"Generating plan for user: {user_profile.user.username}")
+    # 1. Construct a detailed prompt from the user's profile
+    prompt = build_plan_prompt(user_profile, start_date)
+
+    # 2. Generate with the backend chosen by the router (Gemini, the local
+    # model or the rule-based fallback), unless a plan for an equivalent
+    # profile is already cached
+    plan_data = get_cached_plan(user_profile, start_date)
+    if plan_data is None:
+        release_db_connection()
+        router = get_router()
+        if getattr(settings, 'PLAN_HEDGING_ENABLED', False):
+            plan_data, backend = router.generate_hedged(prompt, user=user_profile.user)
+        else:
+            plan_data, backend = router.generate(prompt, user=user_profile.user)
+        if plan_data is None:
+            return None
+        print(f"Plan generated by the '{backend.name}' backend")
+        if backend.cacheable:
+            cache_plan(user_profile, start_date, plan_data)
+    else:
+        print(f"Using cached plan for user: {user_profile.user.username}")
+    # Cached plans may be for a slightly different body, so targets are always recomputed
+    plan_data = apply_profile_targets(user_profile, plan_data)
+
+    # 3. Save the validated data to your Django models
+    print(f"Generated plan data: {plan_data}")
+    try:
+        new_plan = materialize_plan(
+            user_profile,
+            start_date,
+            plan_data,
+            prompt=prompt
+        )
         print(f"Plan successfully generated and saved for user: {user_profile.user.username}")
         return new_plan
+    except PlanOverlapError:
+        raise
     except Exception as e:
         print(f"Error saving plan to database: {e}")
-        return None
\ No newline at end of file
+        return None
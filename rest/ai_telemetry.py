@@ -0,0 +1,199 @@
+# rest/ai_telemetry.py
+"""
+Telemetry for AI calls.
+
+Every call to Gemini or the LocalModel is recorded as an AICallRecord with
+its latency, time to first byte (streamed calls), token counts, estimated
+cost, retries and whether the output validated. The calls of a hedged generation are
+recorded with purpose 'plan-hedge', and the router marks whether each one
+won as the primary or the secondary backend or was superseded (see
+hedge_attempt()). summarize_ai_calls() turns the records into
+latency percentiles and token and cost totals for the staff stats
+endpoint.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import AICallRecord
+
+_hedge = threading.local()
+
+# Backends that run on our own hardware, with no per-token price
+FREE_BACKENDS = ('local', 'fallback')
+
+
+def estimate_cost(backend, model, prompt_tokens, output_tokens):
+    """
+    The cost of a call in USD from AI_MODEL_PRICES, or None if the model
+    has no price or the token counts are unknown.
+    """
+    if backend in FREE_BACKENDS:
+        return Decimal(0)
+    prices = getattr(settings, 'AI_MODEL_PRICES', {}).get(model)
+    if prices is None or prompt_tokens is None or output_tokens is None:
+        return None
+    prompt_price, output_price = prices
+    cost = (prompt_tokens * prompt_price + output_tokens * output_price) / 1_000_000
+    return Decimal(str(round(cost, 6)))
+
+
+class AICallTracker:
+    """Collects the measurements of one AI call until it is recorded."""
+
+    def __init__(self, backend, model, user=None, purpose='plan'):
+        self.backend = backend
+        self.model = model
+        self.user = user
+        self.purpose = purpose
+        self.retries = 0
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.outcome = None
+        self.error = None
+        self._started = time.perf_counter()
+        self._first_byte = None
+
+    def mark_first_byte(self):
+        if self._first_byte is None:
+            self._first_byte = time.perf_counter()
+
+    def set_usage(self, prompt_tokens, output_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+    def set_gemini_usage(self, response):
+        """Reads token counts from a Gemini response or stream chunk."""
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            self.set_usage(usage.prompt_token_count, usage.candidates_token_count)
+
+    def set_outcome(self, outcome, error=None):
+        self.outcome = outcome
+        self.error = str(error) if error else None
+
+    def save(self):
+        now = time.perf_counter()
+        hedge_record_ids = getattr(_hedge, 'record_ids', None)
+        try:
+            record = AICallRecord.objects.create(
+                user=self.user,
+                backend=self.backend,
+                model=self.model,
+                purpose='plan-hedge' if hedge_record_ids is not None else self.purpose,
+                prompt_tokens=self.prompt_tokens,
+                output_tokens=self.output_tokens,
+                time_to_first_byte_ms=round((self._first_byte - self._started) * 1000) if self._first_byte else None,
+                latency_ms=round((now - self._started) * 1000),
+                retries=self.retries,
+                estimated_cost_usd=estimate_cost(self.backend, self.model, self.prompt_tokens, self.output_tokens),
+                validation_outcome=self.outcome or AICallRecord.OUTCOME_ERROR,
+                error=self.error,
+            )
+            if hedge_record_ids is not None:
+                hedge_record_ids.append(record.pk)
+        except Exception as e:
+            # Telemetry must never break plan generation
+            print(f"Error recording AI call telemetry: {e}")
+
+
+@contextmanager
+def track_ai_call(backend, model, user=None, purpose='plan'):
+    """
+    Measures the AI call made inside the block and records it on exit.
+    An exception escaping the block is recorded as an 'error' outcome.
+    """
+    call = AICallTracker(backend, model, user=user, purpose=purpose)
+    try:
+        yield call
+    except Exception as e:
+        if call.outcome is None:
+            call.set_outcome(AICallRecord.OUTCOME_ERROR, e)
+        raise
+    finally:
+        call.save()
+
+
+@contextmanager
+def hedge_attempt(record_ids):
+    """
+    Records the AI calls made in the block, on this thread, with purpose
+    'plan-hedge' and appends their ids to record_ids.
+    """
+    _hedge.record_ids = record_ids
+    try:
+        yield
+    finally:
+        _hedge.record_ids = None
+
+
+def _percentile(records, field, count, percent):
+    """
+    Nearest-rank percentile of `field` over `count` records, read as a
+    single ordered row so the records are never loaded.
+    """
+    if not count:
+        return None
+    rank = max(1, math.ceil(percent / 100 * count))
+    return records.order_by(field).values_list(field, flat=True)[rank - 1]
+
+
+def summarize_ai_calls(since):
+    """
+    Latency percentiles and token and estimated cost totals of the AI calls
+    made since the given time, grouped by backend and model.
+    """
+    records = AICallRecord.objects.filter(created_at__gte=since)
+    groups = records.values('backend', 'model').annotate(
+        calls=Count('id'),
+        streamed_calls=Count('time_to_first_byte_ms'),
+        errors=Count('id', filter=Q(validation_outcome=AICallRecord.OUTCOME_ERROR)),
+        invalid=Count('id', filter=Q(validation_outcome=AICallRecord.OUTCOME_INVALID)),
+        repaired=Count('id', filter=Q(validation_outcome=AICallRecord.OUTCOME_REPAIRED)),
+        fallbacks=Count('id', filter=Q(validation_outcome=AICallRecord.OUTCOME_FALLBACK)),
+        hedge_secondary_wins=Count('id', filter=Q(hedge_path=AICallRecord.HEDGE_SECONDARY)),
+        retries=Sum('retries'),
+        prompt_tokens=Sum('prompt_tokens'),
+        output_tokens=Sum('output_tokens'),
+        estimated_cost_usd=Sum('estimated_cost_usd'),
+    ).order_by('backend', 'model')
+
+    summary = []
+    for group in groups:
+        group_records = records.filter(backend=group['backend'], model=group['model'])
+        streamed_records = group_records.exclude(time_to_first_byte_ms=None)
+        streamed_calls = group.pop('streamed_calls')
+        summary.append({
+            **group,
+            'retries': group['retries'] or 0,
+            'prompt_tokens': group['prompt_tokens'] or 0,
+            'output_tokens': group['output_tokens'] or 0,
+            'estimated_cost_usd': float(group['estimated_cost_usd'] or 0),
+            'latency_ms': {
+                f'p{p}': _percentile(group_records, 'latency_ms', group['calls'], p) for p in (50, 95, 99)
+            },
+            'time_to_first_byte_ms': {
+                f'p{p}': _percentile(streamed_records, 'time_to_first_byte_ms', streamed_calls, p) for p in (50, 95, 99)
+            },
+        })
+    return summary
+
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(days=1),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
+
+
+def summarize_ai_call_windows(windows=None):
+    """summarize_ai_calls() for each named time window, e.g. ['1h', '24h']."""
+    now = timezone.now()
+    return {window: summarize_ai_calls(now - WINDOWS[window]) for window in (windows or WINDOWS)}
@@ -1,6 +1,39 @@
 # rest/apps.py
+import os
+import sys
+
 from django.apps import AppConfig
 
+# Set by api/wsgi.py and api/asgi.py, or by hand for any other server
+SERVING_ENV = 'DJANGO_SERVING'
+
+
+def is_serving():
+    """
+    Whether this process serves requests: it was started through the WSGI or
+    ASGI entry point, or is the serving process of runserver. Workers,
+    scripts, tests and other commands are not.
+    """
+    if os.environ.get(SERVING_ENV) == 'true':
+        return True
+    if os.path.basename(sys.argv[0]) != 'manage.py' or sys.argv[1:2] != ['runserver']:
+        return False
+    # The autoreloader's parent process only watches files
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+
 class RestConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rest'
+
+    def ready(self):
+        """
+        Starts the embedded plan job workers in serving processes, so jobs
+        queued before a restart, or left running by a process that died,
+        are picked up without waiting for the next enqueue.
+        """
+        from django.conf import settings
+        if not getattr(settings, 'PLAN_JOB_EMBEDDED_WORKERS', True) or not is_serving():
+            return
+        from .plan_jobs import get_worker_pool
+        get_worker_pool().start()
@@ -0,0 +1,350 @@
+# rest/fallback_plans.py
+"""
+Procedural fallback plans.
+
+When no model backend can generate a plan, build_fallback_plan() assembles
+one from the built-in exercise and Ghanaian meal catalogs below, without
+any model call:
+
+- training days and their focus follow the profile's activity level and
+  goal; sets, reps and rest follow the goal, and only low-impact exercises
+  are used for users over 60 or with disabilities or medical conditions
+- meals rotate through the week, skipping those that contain an allergen
+  or disliked food or don't fit a vegan, vegetarian or pescatarian diet;
+  liked foods come first
+- portions are scaled so each day's meals add up to the profile's calorie
+  target (rest/nutrition_targets.py); when the meals alone fall short of
+  the protein target, lunch and dinner come with a lean protein side
+  sized to make it up
+"""
+from django.conf import settings
+
+from .models import Profile
+from .nutrition_targets import DEFAULT_TARGETS, compute_nutrition_targets
+from .schemas import ExerciseSchema, GeneratedPlanSchema, MealSchema, NutritionDaySchema, WorkoutDaySchema
+
+# name, category, MET value, minutes, low impact, notes; timed exercises also
+# have their own (sets, reps, rest seconds), the others follow GOAL_TRAINING
+EXERCISES = [
+    ('Push-ups', 'upper', 3.8, 8, True, "Keep your core tight and body straight", None),
+    ('Incline push-ups', 'upper', 3.0, 8, True, "Hands on a bench or wall; easier than floor push-ups", None),
+    ('Chair dips', 'upper', 3.8, 6, True, "Use a sturdy chair or the edge of a bench", None),
+    ('Pike push-ups', 'upper', 4.0, 6, True, "Hips high, lower your head towards the floor", None),
+    ('Bucket rows', 'upper', 3.5, 8, True, "A filled water bucket works as a weight; keep your back flat", None),
+    ('Squats', 'lower', 5.0, 10, True, "Keep your knees in line with your toes", None),
+    ('Lunges', 'lower', 4.0, 10, True, "Alternate legs; keep your front knee over your ankle", None),
+    ('Glute bridges', 'lower', 3.0, 8, True, "Squeeze your glutes at the top", None),
+    ('Step-ups', 'lower', 4.0, 8, True, "Use a stair or a sturdy bench", None),
+    ('Jump squats', 'lower', 8.0, 6, False, "Land softly on the balls of your feet", None),
+    ('Wall sit', 'lower', 3.0, 5, True, "Thighs parallel to the floor", (3, '30-45 seconds', 45)),
+    ('Plank', 'core', 3.8, 5, True, "Hold the position steadily", (3, '30-60 seconds', 45)),
+    ('Bicycle crunches', 'core', 3.5, 6, True, "Slow and controlled, elbow to opposite knee", None),
+    ('Dead bugs', 'core', 3.0, 6, True, "Keep your lower back pressed to the floor", None),
+    ('Leg raises', 'core', 3.0, 6, True, "Lower your legs slowly", None),
+    ('Mountain climbers', 'core', 8.0, 5, False, "Keep your hips level", (3, '30 seconds', 30)),
+    ('Brisk walk', 'cardio', 4.3, 20, True, "Early morning or evening, when it is cooler", (1, '20 minutes', 0)),
+    ('Azonto dance workout', 'cardio', 6.0, 15, True, "Dance to highlife or afrobeats", (1, '15 minutes', 0)),
+    ('Jumping jacks', 'cardio', 8.0, 6, False, "Land softly", (3, '45 seconds', 30)),
+    ('Ampe', 'cardio', 7.0, 10, False, "The clapping and jumping game; great with friends", (4, '2 minutes', 60)),
+    ('Skipping rope', 'cardio', 11.0, 10, False, "Stay on the balls of your feet", (4, '1 minute', 45)),
+    ('Stair climbs', 'cardio', 8.0, 10, False, "Walk down to recover", (4, '2 minutes', 60)),
+    ('Jogging', 'cardio', 7.0, 20, False, "A pace at which you can still talk", (1, '20 minutes', 0)),
+]
+
+# (sets, reps, rest seconds) of strength exercises
+GOAL_TRAINING = {
+    'weight_loss': (3, '12-15', 45),
+    'maintenance': (3, '10-12', 60),
+    'muscle_gain': (4, '8-12', 90),
+    'endurance': (3, '15-20', 30),
+}
+
+# title, description, exercise categories
+FOCUSES = {
+    'full_body': ('Full Body Workout', "A full-body session with bodyweight exercises", ['lower', 'upper', 'core', 'cardio']),
+    'upper': ('Upper Body Strength', "Chest, shoulders, back and arms", ['upper', 'upper', 'upper', 'core']),
+    'lower': ('Lower Body Strength', "Legs and glutes", ['lower', 'lower', 'lower', 'core']),
+    'cardio_core': ('Cardio & Core', "Cardiovascular conditioning and core strength", ['cardio', 'core', 'cardio', 'core']),
+    'cardio': ('Cardio Endurance', "Longer, steady cardio for stamina", ['cardio', 'cardio', 'lower']),
+}
+
+GOAL_FOCUS_ROTATION = {
+    'weight_loss': ['full_body', 'cardio_core', 'lower', 'upper', 'cardio_core', 'full_body'],
+    'maintenance': ['full_body', 'cardio_core', 'upper', 'lower', 'full_body', 'cardio_core'],
+    'muscle_gain': ['upper', 'lower', 'full_body', 'upper', 'lower', 'full_body'],
+    'endurance': ['cardio', 'full_body', 'cardio_core', 'lower', 'cardio', 'full_body'],
+}
+
+TRAINING_DAYS = {
+    'sedentary': [1, 3, 5],
+    'lightly_active': [1, 3, 5],
+    'moderately_active': [1, 2, 4, 5],
+    'very_active': [1, 2, 3, 5, 6],
+    'athlete': [1, 2, 3, 4, 5, 6],
+}
+
+# meal type, description, calories, protein, carbs, fats, portion, diet, ingredients.
+# The diet is the strictest one the meal fits: vegan, vegetarian, pescatarian or any.
+MEALS = [
+    ('breakfast', "Hausa koko with koose", 380, 12, 60, 11, "1 cup + 3 koose", 'vegan', ['millet', 'beans']),
+    ('breakfast', "Tom brown porridge with milk and groundnuts", 400, 14, 58, 13, "1 bowl", 'vegetarian', ['maize', 'soy', 'groundnut', 'milk']),
+    ('breakfast', "Oats with banana and groundnut paste", 420, 14, 60, 14, "1 bowl", 'vegan', ['oats', 'banana', 'groundnut']),
+    ('breakfast', "Bread with fried egg and tea", 350, 15, 45, 12, "2 slices + 1 egg", 'vegetarian', ['wheat', 'egg', 'milk']),
+    ('breakfast', "Waakye with boiled egg", 450, 17, 70, 10, "1 plate", 'vegetarian', ['rice', 'beans', 'egg']),
+    ('breakfast', "Millet porridge with coconut milk", 360, 9, 58, 11, "1 bowl", 'vegan', ['millet', 'coconut']),
+    ('breakfast', "Boiled plantain with avocado and boiled egg", 400, 12, 55, 16, "1 plate", 'vegetarian', ['plantain', 'avocado', 'egg']),
+    ('breakfast', "Pawpaw with yoghurt and tiger nuts", 300, 12, 45, 9, "1 bowl", 'vegetarian', ['pawpaw', 'milk', 'tiger nut']),
+    ('lunch', "Jollof rice with grilled chicken and salad", 600, 35, 70, 18, "1 plate", 'any', ['rice', 'tomato', 'chicken']),
+    ('lunch', "Banku with grilled tilapia and pepper", 620, 40, 65, 20, "1 ball + 1 fish", 'pescatarian', ['maize', 'cassava', 'fish']),
+    ('lunch', "Red red with fried plantain", 580, 22, 80, 18, "1 plate", 'vegan', ['beans', 'plantain', 'palm oil']),
+    ('lunch', "Fufu with light soup and goat meat", 650, 35, 75, 20, "1 bowl", 'any', ['cassava', 'plantain', 'goat']),
+    ('lunch', "Kenkey with fried fish and shito", 600, 32, 72, 18, "1 ball + 1 fish", 'pescatarian', ['maize', 'fish', 'shrimp']),
+    ('lunch', "Omo tuo with groundnut soup and chicken", 640, 35, 70, 22, "2 rice balls", 'any', ['rice', 'groundnut', 'chicken']),
+    ('lunch', "Boiled yam with kontomire stew", 520, 16, 72, 18, "1 plate", 'vegan', ['yam', 'kontomire', 'egusi', 'palm oil']),
+    ('lunch', "Gari and beans with avocado", 500, 18, 70, 14, "1 bowl", 'vegan', ['cassava', 'beans', 'avocado']),
+    ('lunch', "Rice with garden egg stew and wagashi", 560, 24, 70, 18, "1 plate", 'vegetarian', ['rice', 'eggplant', 'milk']),
+    ('dinner', "Tuo zaafi with ayoyo soup and beef", 580, 30, 70, 18, "1 portion", 'any', ['maize', 'ayoyo', 'beef']),
+    ('dinner', "Konkonte with groundnut soup and fish", 540, 28, 60, 20, "1 bowl", 'pescatarian', ['cassava', 'groundnut', 'fish']),
+    ('dinner', "Ampesi with kontomire and boiled egg", 500, 20, 60, 18, "1 plate", 'vegetarian', ['yam', 'plantain', 'kontomire', 'egg', 'palm oil']),
+    ('dinner', "Grilled tilapia with steamed vegetables and brown rice", 480, 38, 45, 14, "1 fish + 1 cup rice", 'pescatarian', ['fish', 'rice']),
+    ('dinner', "Okro stew with banku and beef", 540, 30, 62, 18, "1 ball", 'any', ['okro', 'maize', 'cassava', 'beef']),
+    ('dinner', "Bean stew with boiled ripe plantain", 470, 20, 72, 11, "1 plate", 'vegan', ['beans', 'plantain', 'palm oil']),
+    ('dinner', "Rice and stew with grilled chicken", 520, 32, 60, 15, "1 plate", 'any', ['rice', 'tomato', 'chicken']),
+    ('dinner', "Vegetable jollof with soya chunks", 500, 22, 72, 13, "1 plate", 'vegan', ['rice', 'tomato', 'soy']),
+    ('dinner', "Ampesi with garden egg stew and mackerel", 510, 28, 60, 17, "1 plate", 'pescatarian', ['yam', 'plantain', 'eggplant', 'fish']),
+    ('snack', "Roasted groundnuts and banana", 220, 8, 22, 12, "1 handful + 1 banana", 'vegan', ['groundnut', 'banana']),
+    ('snack', "Kelewele with groundnuts", 250, 5, 35, 11, "1 portion", 'vegan', ['plantain', 'groundnut']),
+    ('snack', "Pawpaw and watermelon", 120, 2, 28, 1, "1 bowl", 'vegan', ['pawpaw', 'watermelon']),
+    ('snack', "Boiled corn with coconut", 220, 5, 38, 7, "1 cob + 2 pieces", 'vegan', ['maize', 'coconut']),
+    ('snack', "Tiger nuts with an orange", 200, 3, 30, 9, "1 handful + 1 orange", 'vegan', ['tiger nut', 'orange']),
+    ('snack', "Yoghurt with pineapple", 180, 8, 30, 4, "1 cup", 'vegetarian', ['milk', 'pineapple']),
+    ('snack', "Boiled eggs with cucumber", 160, 13, 4, 10, "2 eggs", 'vegetarian', ['egg', 'cucumber']),
+    ('snack', "Sobolo with roasted plantain", 220, 2, 52, 1, "1 glass + 1 plantain", 'vegan', ['hibiscus', 'plantain']),
+]
+
+MEAL_SHARES = {'breakfast': 0.25, 'lunch': 0.35, 'dinner': 0.30, 'snack': 0.10}
+
+# Protein sides, laid out like MEALS with the portion in grams; per 100 g cooked
+PROTEIN_SIDES = [
+    ('side', "grilled chicken breast", 165, 31, 0, 3.6, 100, 'any', ['chicken']),
+    ('side', "grilled tilapia", 128, 26, 0, 2.7, 100, 'pescatarian', ['fish']),
+    ('side', "lean beef", 170, 26, 0, 7, 100, 'any', ['beef']),
+    ('side', "soya chunks stew", 115, 17, 11, 0.5, 100, 'vegan', ['soy']),
+    ('side', "boiled eggs", 155, 13, 1.1, 11, 100, 'vegetarian', ['egg']),
+    ('side', "grilled wagashi", 200, 18, 3, 13, 100, 'vegetarian', ['milk']),
+]
+
+# The most of a day's calories a protein side may take up
+MAX_SIDE_SHARE = 0.4
+
+# Diets and the meal diets that fit them
+DIET_MEALS = {
+    'vegan': {'vegan'},
+    'vegetarian': {'vegan', 'vegetarian'},
+    'pescatarian': {'vegan', 'vegetarian', 'pescatarian'},
+}
+
+# Allergies and dislikes, as users write them, to the meal ingredients they rule out.
+# Anything else is matched against meal descriptions and ingredients as written.
+FOOD_TERMS = {
+    'peanut': ['groundnut'],
+    'groundnut': ['groundnut'],
+    'nut': ['groundnut', 'tiger nut'],
+    'tiger nut': ['tiger nut'],
+    'fish': ['fish'],
+    'shellfish': ['shrimp'],
+    'shrimp': ['shrimp'],
+    'seafood': ['fish', 'shrimp'],
+    'egg': ['egg'],
+    'milk': ['milk'],
+    'dairy': ['milk'],
+    'lactose': ['milk'],
+    'gluten': ['wheat', 'oats'],
+    'wheat': ['wheat'],
+    'soy': ['soy'],
+    'soya': ['soy'],
+    'corn': ['maize'],
+    'maize': ['maize'],
+    'meat': ['chicken', 'goat', 'beef'],
+    'red meat': ['goat', 'beef'],
+    'garden egg': ['eggplant'],
+}
+
+def _normalize(term):
+    term = term.strip().lower()
+    if term.endswith('s') and term[:-1] in FOOD_TERMS:
+        term = term[:-1]
+    return term
+
+
+def _excludes(meal, term):
+    description, ingredients = meal[1].lower(), meal[8]
+    if term in FOOD_TERMS:
+        return any(ingredient in ingredients for ingredient in FOOD_TERMS[term])
+    return term in description or any(term in ingredient for ingredient in ingredients)
+
+
+def select_meals(profile: Profile = None):
+    """The catalog meals the profile can eat, by meal type, liked foods first."""
+    avoid, liked, diets = [], [], None
+    if profile is not None:
+        avoid = [_normalize(term) for term in profile.get_allergies_list() + profile.get_disliked_foods_list()]
+        liked = [_normalize(term) for term in profile.get_liked_foods_list()]
+        preferences = [_normalize(p) for p in profile.get_dietary_preferences_list()]
+        diets = next((DIET_MEALS[diet] for diet in DIET_MEALS if diet in preferences), None)
+
+    meals = {meal_type: [] for meal_type in [*MEAL_SHARES, 'side']}
+    for meal in MEALS + PROTEIN_SIDES:
+        if diets is not None and meal[7] not in diets:
+            continue
+        if any(_excludes(meal, term) for term in avoid if term):
+            continue
+        meals[meal[0]].append(meal)
+    for candidates in meals.values():
+        # Stable, so the catalog order is kept otherwise
+        candidates.sort(key=lambda meal: not any(_excludes(meal, term) for term in liked if term))
+    return meals
+
+
+def _portion(portion, factor):
+    return portion if abs(factor - 1) < 0.1 else f"{portion} (x{factor:.1f})"
+
+
+def _goes_with(side, meal):
+    """Whether a protein side can be added to a meal without repeating an ingredient."""
+    return not any(ingredient in meal[8] for ingredient in side[8])
+
+
+def _protein_side(sides, day_index, base_density, calories, protein, meals):
+    """
+    The protein side for a day and the calories it should take up, so that
+    meals with base_density grams of protein per kcal plus the side give
+    `protein` grams in `calories`; (None, 0) if no side helps. Only sides
+    that go with at least one of `meals` are used. Sides that get there
+    within MAX_SIDE_SHARE of the calories take turns, otherwise the densest
+    one is used as far as it may go.
+    """
+    def side_calories(side):
+        return (protein - calories * base_density) / (side[3] / side[2] - base_density)
+
+    sides = [
+        side for side in sides
+        if side[3] / side[2] > base_density and any(_goes_with(side, meal) for meal in meals)
+    ]
+    enough = [side for side in sides if side_calories(side) <= calories * MAX_SIDE_SHARE]
+    if enough:
+        side = enough[day_index % len(enough)]
+        return side, side_calories(side)
+    return max(sides, key=lambda side: side[3] / side[2]), calories * MAX_SIDE_SHARE
+
+
+def build_nutrition_days(profile: Profile = None, targets=None, training_days=()):
+    meals = select_meals(profile)
+    shares = {meal_type: share for meal_type, share in MEAL_SHARES.items() if meals[meal_type]}
+    total_share = sum(shares.values()) or 1
+    side_meals = [meal_type for meal_type in ('lunch', 'dinner') if meal_type in shares] or list(shares)
+    tolerance = getattr(settings, 'NUTRITION_MEAL_TOLERANCE', 0.1)
+    offset = (profile.pk or 0) if profile is not None else 0
+    days = []
+    for day_of_week in range(1, 8):
+        index = day_of_week - 1 + offset
+        picked = {meal_type: meals[meal_type][index % len(meals[meal_type])] for meal_type in shares}
+        # Grams of protein per kcal of the day's meals once scaled to their shares
+        base_density = sum(shares[meal_type] / total_share * meal[3] / meal[2] for meal_type, meal in picked.items())
+        side, side_calories = None, 0
+        if targets['target_calories'] * base_density < targets['target_protein_grams'] * (1 - tolerance):
+            side, side_calories = _protein_side(
+                meals['side'], index, base_density, targets['target_calories'], targets['target_protein_grams'],
+                [picked[meal_type] for meal_type in side_meals],
+            )
+        # The side is shared by the side meals it does not repeat an ingredient of
+        with_side = [meal_type for meal_type in side_meals if side and _goes_with(side, picked[meal_type])]
+
+        day_meals = []
+        for meal_type, share in shares.items():
+            _, description, calories, protein, carbs, fats, portion, _, _ = picked[meal_type]
+            factor = (targets['target_calories'] - side_calories) * share / total_share / calories
+            portion = _portion(portion, factor)
+            calories, protein, carbs, fats = calories * factor, protein * factor, carbs * factor, fats * factor
+            if meal_type in with_side:
+                side_factor = side_calories / len(with_side) / side[2]
+                grams = round(side[6] * side_factor / 10) * 10
+                description = f"{description} plus {side[1]}"
+                portion = f"{portion} + {grams} g {side[1]}"
+                calories += side[2] * side_factor
+                protein += side[3] * side_factor
+                carbs += side[4] * side_factor
+                fats += side[5] * side_factor
+            day_meals.append(MealSchema(
+                meal_type=meal_type,
+                description=description,
+                calories=round(calories),
+                protein_grams=round(protein, 1),
+                carbs_grams=round(carbs, 1),
+                fats_grams=round(fats, 1),
+                portion_size=portion,
+            ))
+        if day_of_week in training_days:
+            notes = f"Training day: have a meal or snack 1-2 hours before your workout. Drink {targets['target_water_litres']} L of water."
+        else:
+            notes = f"Rest day: focus on recovery. Drink {targets['target_water_litres']} L of water."
+        days.append(NutritionDaySchema(day_of_week=day_of_week, notes=notes, meals=day_meals, **targets))
+    return days
+
+
+def build_workout_days(profile: Profile = None):
+    goal = (profile.goal if profile is not None else None) or 'maintenance'
+    activity_level = (profile.activity_level if profile is not None else None) or 'lightly_active'
+    low_impact = profile is not None and bool(
+        (profile.age or 0) >= 60 or profile.get_disabilities_list() or profile.get_medical_conditions_list()
+    )
+    sets, reps, rest = GOAL_TRAINING.get(goal, GOAL_TRAINING['maintenance'])
+    exercises = {}
+    for exercise in EXERCISES:
+        if exercise[4] or not low_impact:
+            exercises.setdefault(exercise[1], []).append(exercise)
+
+    training_days = TRAINING_DAYS.get(activity_level, TRAINING_DAYS['lightly_active'])
+    rotation = GOAL_FOCUS_ROTATION.get(goal, GOAL_FOCUS_ROTATION['maintenance'])
+    days = []
+    for day_of_week in range(1, 8):
+        if day_of_week not in training_days:
+            days.append(WorkoutDaySchema(
+                day_of_week=day_of_week, title="Rest Day", is_rest_day=True,
+                description="Active recovery: light walking or stretching", exercises=[],
+            ))
+            continue
+        index = training_days.index(day_of_week)
+        title, description, categories = FOCUSES[rotation[index % len(rotation)]]
+        used = {}
+        day_exercises = []
+        for category in categories:
+            candidates = exercises[category]
+            name, _, met_value, minutes, _, notes, timed = candidates[(index + used.get(category, 0)) % len(candidates)]
+            used[category] = used.get(category, 0) + 1
+            exercise_sets, exercise_reps, exercise_rest = timed or (sets, reps, rest)
+            day_exercises.append(ExerciseSchema(
+                name=name, sets=exercise_sets, met_value=met_value, duration_mins=minutes,
+                reps=exercise_reps, rest_period_seconds=exercise_rest, notes=notes,
+            ))
+        if low_impact:
+            description = f"{description}, low impact"
+        days.append(WorkoutDaySchema(
+            day_of_week=day_of_week, title=title, is_rest_day=False, description=description, exercises=day_exercises,
+        ))
+    return days
+
+
+def build_fallback_plan(profile: Profile = None):
+    """
+    A week's plan for the profile from the built-in catalogs, with the
+    profile's nutrition targets (or DEFAULT_TARGETS without body data).
+    Without a profile, a generic beginner plan.
+    """
+    targets = (compute_nutrition_targets(profile) if profile is not None else None) or DEFAULT_TARGETS
+    workout_days = build_workout_days(profile)
+    training_days = [day.day_of_week for day in workout_days if not day.is_rest_day]
+    return GeneratedPlanSchema(
+        workout_days=workout_days,
+        nutrition_days=build_nutrition_days(profile, targets, training_days),
+    )
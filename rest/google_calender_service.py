@@ -41,11 +41,9 @@ def get_or_create_fitpal_calendar(service, calendar_name="FitPal", user_timezone
         raise Exception(f"Could not get or create the {calendar_name} calendar. Please ensure permissions are correct.")
 
 
-# --- UPDATED MAIN FUNCTION ---
-def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
+def get_calendar_service(user):
     """
-    Creates Google Calendar events on a dedicated 'FitPal' calendar
-    for a user's fitness plan.
+    Builds a Google Calendar API client from the user's stored Google token.
     """
     google_token = SocialToken.objects.filter(account__user=user, account__provider='google').first()
     if not google_token:
@@ -62,7 +60,69 @@ def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
         scopes=['https://www.googleapis.com/auth/calendar']
     )
 
-    service = build('calendar', 'v3', credentials=credentials)
+    return build('calendar', 'v3', credentials=credentials)
+
+
+def get_reminders_override(user):
+    """ Reminders based on user profile settings. """
+    reminders_override = [{'method': 'popup', 'minutes': 5}]
+    if user.profile.email_reminders_enabled:
+        reminders_override.append({'method': 'email', 'minutes': user.profile.minutes_before_email_reminder})
+    return reminders_override
+
+
+def build_workout_event(fitness_plan, workout_day, user_timezone, reminders_override):
+    """ The calendar event body for a workout day. """
+    event_date = fitness_plan.start_date + timedelta(days=workout_day.day_of_week - 1)
+
+    workout_time = fitness_plan.profile.workout_time
+    start_datetime = datetime.combine(event_date, workout_time)
+    end_datetime = start_datetime + timedelta(hours=1)
+
+    exercise_list = "\n".join([f"- {ex.name} ({ex.sets} sets of {ex.reps})" for ex in workout_day.exercises.all()])
+
+    return {
+        'summary': f'💪 Workout: {workout_day.title}',
+        'description': f'Your scheduled workout for the day.\n\nExercises:\n{exercise_list}',
+        'start': {'dateTime': start_datetime.isoformat(), 'timeZone': user_timezone},
+        'end': {'dateTime': end_datetime.isoformat(), 'timeZone': user_timezone},
+        'reminders': {
+            'useDefault': False,
+            'overrides': reminders_override
+        }
+    }
+
+
+def build_meal_event(fitness_plan, nutrition_day, meal, user_timezone, reminders_override):
+    """ The calendar event body for a meal. """
+    event_date = fitness_plan.start_date + timedelta(days=nutrition_day.day_of_week - 1)
+    breakfast_time = fitness_plan.profile.breakfast_time
+    lunch_time = fitness_plan.profile.lunch_time
+    dinner_time = fitness_plan.profile.dinner_time
+    snack_time = fitness_plan.profile.snack_time
+    meal_time = {'breakfast': breakfast_time or time(8,0), 'lunch': lunch_time or time(12,30), 'dinner': dinner_time or time(19,0), 'snack': snack_time or time(15,0)}.get(meal.meal_type, time(12,0))
+    start_datetime = datetime.combine(event_date, meal_time)
+    end_datetime = start_datetime + timedelta(minutes=60)
+
+    return {
+        'summary': f'🥗 {meal.get_meal_type_display()}: {meal.description}',
+        'description': f"Portion: {meal.portion_size}\nCalories: {meal.calories} kcal",
+        'start': {'dateTime': start_datetime.isoformat(), 'timeZone': user_timezone},
+        'end': {'dateTime': end_datetime.isoformat(), 'timeZone': user_timezone},
+        'reminders': {
+            'useDefault': False,
+            'overrides': reminders_override
+        }
+    }
+
+
+# --- UPDATED MAIN FUNCTION ---
+def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
+    """
+    Creates Google Calendar events on a dedicated 'FitPal' calendar
+    for a user's fitness plan.
+    """
+    service = get_calendar_service(user)
 
     # --- Get or create the dedicated calendar for our app ---
     user_timezone = fitness_plan.profile.time_zone or 'UTC'
@@ -76,35 +136,15 @@ def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
 
     success_count = 0
     failure_count = 0
-    plan_start_date = fitness_plan.start_date
 
     # Define reminders based on user profile settings
-    reminders_override = [{'method': 'popup', 'minutes': 5}]
-    if user.profile.email_reminders_enabled:
-        reminders_override.append({'method': 'email', 'minutes': user.profile.minutes_before_email_reminder})
+    reminders_override = get_reminders_override(user)
     
     # --- Create Workout Events ----
     if event_type in ['workout', 'all']:
         workout_days = fitness_plan.workout_days.filter(is_rest_day=False)
         for workout_day in workout_days:
-            event_date = plan_start_date + timedelta(days=workout_day.day_of_week - 1)
-            
-            workout_time = fitness_plan.profile.workout_time
-            start_datetime = datetime.combine(event_date, workout_time)
-            end_datetime = start_datetime + timedelta(hours=1)
-            
-            exercise_list = "\n".join([f"- {ex.name} ({ex.sets} sets of {ex.reps})" for ex in workout_day.exercises.all()])
-    
-            event = {
-                'summary': f'💪 Workout: {workout_day.title}',
-                'description': f'Your scheduled workout for the day.\n\nExercises:\n{exercise_list}',
-                'start': {'dateTime': start_datetime.isoformat(), 'timeZone': user_timezone},
-                'end': {'dateTime': end_datetime.isoformat(), 'timeZone': user_timezone},
-                'reminders': {
-                    'useDefault': False,
-                    'overrides': reminders_override
-                }
-            }
+            event = build_workout_event(fitness_plan, workout_day, user_timezone, reminders_override)
             try:
                 # --- CHANGE: Use the new calendar ID ---
                 created_event = service.events().insert(calendarId=fitpal_calendar_id, body=event).execute()
@@ -124,26 +164,8 @@ def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
     if event_type in ['nutrition', 'all']:
         nutrition_days = fitness_plan.nutrition_days.all()
         for nutrition_day in nutrition_days:
-            event_date = plan_start_date + timedelta(days=nutrition_day.day_of_week - 1)
             for meal in nutrition_day.meals.all():
-                breakfast_time = fitness_plan.profile.breakfast_time
-                lunch_time = fitness_plan.profile.lunch_time
-                dinner_time = fitness_plan.profile.dinner_time
-                snack_time = fitness_plan.profile.snack_time
-                meal_time = {'breakfast': breakfast_time or time(8,0), 'lunch': lunch_time or time(12,30), 'dinner': dinner_time or time(19,0), 'snack': snack_time or time(15,0)}.get(meal.meal_type, time(12,0))
-                start_datetime = datetime.combine(event_date, meal_time)
-                end_datetime = start_datetime + timedelta(minutes=60)
-                
-                event = {
-                    'summary': f'🥗 {meal.get_meal_type_display()}: {meal.description}',
-                    'description': f"Portion: {meal.portion_size}\nCalories: {meal.calories} kcal",
-                    'start': {'dateTime': start_datetime.isoformat(), 'timeZone': user_timezone},
-                    'end': {'dateTime': end_datetime.isoformat(), 'timeZone': user_timezone},
-                    'reminders': {
-                        'useDefault': False,
-                        'overrides': reminders_override
-                    }
-                }
+                event = build_meal_event(fitness_plan, nutrition_day, meal, user_timezone, reminders_override)
                 
                 try:
                     # --- CHANGE: Use the new calendar ID ---
@@ -163,6 +185,62 @@ def create_calendar_events_for_plan(user, fitness_plan, event_type='all'):
     return success_count, failure_count
 
 
+def sync_regenerated_events(user, fitness_plan, workout_days=(), meals=(), removed_event_ids=()):
+    """
+    Brings the calendar in line after part of a plan was regenerated:
+    existing events of the given workout days and meals are updated in
+    place (their event ids stay the same), new meals get an event if the
+    plan's nutrition is on the calendar, and events of removed meals are
+    deleted. Returns (success_count, failure_count).
+    """
+    if not fitness_plan.google_calendar_id:
+        return 0, 0
+    service = get_calendar_service(user)
+    fitpal_calendar_id = fitness_plan.google_calendar_id
+    user_timezone = fitness_plan.profile.time_zone or 'UTC'
+    reminders_override = get_reminders_override(user)
+
+    success_count = 0
+    failure_count = 0
+    # (object, event body, should have an event, plan's events of this type are on the calendar)
+    items = [
+        (wd, build_workout_event(fitness_plan, wd, user_timezone, reminders_override), not wd.is_rest_day, fitness_plan.workout_added_to_calendar)
+        for wd in workout_days
+    ] + [
+        (meal, build_meal_event(fitness_plan, meal.nutrition_day, meal, user_timezone, reminders_override), True, fitness_plan.nutrition_added_to_calendar)
+        for meal in meals
+    ]
+    for obj, event, wants_event, on_calendar in items:
+        try:
+            if obj.google_calendar_event_id and wants_event:
+                service.events().patch(calendarId=fitpal_calendar_id, eventId=obj.google_calendar_event_id, body=event).execute()
+            elif obj.google_calendar_event_id:
+                # A workout day that became a rest day
+                service.events().delete(calendarId=fitpal_calendar_id, eventId=obj.google_calendar_event_id).execute()
+                obj.google_calendar_event_id = None
+                obj.save(update_fields=['google_calendar_event_id'])
+            elif wants_event and on_calendar:
+                created_event = service.events().insert(calendarId=fitpal_calendar_id, body=event).execute()
+                obj.google_calendar_event_id = created_event['id']
+                obj.save(update_fields=['google_calendar_event_id'])
+            else:
+                continue
+            success_count += 1
+        except Exception as e:
+            print(f"Failed to sync calendar event: {e}")
+            failure_count += 1
+
+    for event_id in removed_event_ids:
+        try:
+            service.events().delete(calendarId=fitpal_calendar_id, eventId=event_id).execute()
+            success_count += 1
+        except Exception as e:
+            print(f"Failed to delete calendar event: {e}")
+            failure_count += 1
+
+    return success_count, failure_count
+
+
 def delete_calendar_events_for_plan(user, fitness_plan, event_type='all'):
     """
     Deletes Google Calendar events for a user's fitness plan.
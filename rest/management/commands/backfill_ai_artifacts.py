@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from rest.ai_artifacts import store_text, store_json
+from rest.models import FitnessPlan
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the ai_prompt_text and ai_response_raw of existing fitness plans into "
+        "compressed, deduplicated AI artifacts, one chunk of plans at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200, help="Plans loaded and updated per transaction.")
+        parser.add_argument('--keep-legacy', action='store_true', help="Keep the old text columns filled instead of clearing them.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        pending = FitnessPlan.objects.filter(
+            (Q(ai_prompt_artifact__isnull=True) & ~Q(ai_prompt_text=''))
+            | Q(ai_response_artifact__isnull=True, ai_response_raw__isnull=False)
+        ).order_by('pk').only('pk', 'ai_prompt_text', 'ai_response_raw', 'ai_prompt_artifact', 'ai_response_artifact')
+
+        # Keyset pagination: only one chunk of rows is in memory at a time,
+        # and an interrupted run resumes where it stopped.
+        last_pk = 0
+        migrated = 0
+        while True:
+            with transaction.atomic():
+                plans = list(pending.filter(pk__gt=last_pk)[:chunk_size])
+                if not plans:
+                    break
+                for plan in plans:
+                    if plan.ai_prompt_artifact_id is None:
+                        plan.ai_prompt_artifact = store_text(plan.ai_prompt_text)
+                    if plan.ai_response_artifact_id is None:
+                        plan.ai_response_artifact = store_json(plan.ai_response_raw)
+                    if not options['keep_legacy']:
+                        plan.ai_prompt_text = ''
+                        plan.ai_response_raw = None
+                FitnessPlan.objects.bulk_update(
+                    plans, ['ai_prompt_artifact', 'ai_response_artifact', 'ai_prompt_text', 'ai_response_raw']
+                )
+            last_pk = plans[-1].pk
+            migrated += len(plans)
+            self.stdout.write(f"Backfilled {migrated} plans (up to id {last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill finished: {migrated} plans moved to AI artifacts"))
@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_local.benchmark import measure_completion, summarize
+from ai_local.services import get_local_model, plan_json_schema
+from rest.ai_service import build_plan_prompt
+from rest.models import Profile
+from rest.wire_schema import plan_generation_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares local model plan completions with and without grammar-constrained decoding: "
+        "valid output rate, rate salvageable by repair, latency and tokens/sec."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Completions per mode.")
+
+    def handle(self, *args, **options):
+        local_model = get_local_model()
+        if not local_model.ensure_loaded():
+            raise CommandError("The local model is not loaded (see ai_local/SETUP.md or LOCAL_INFERENCE_URL).")
+        profile = Profile(
+            goal='weight_loss', activity_level='moderately_active', gender='female', age=30,
+            current_weight=70, height=165,
+        )
+        prompt = build_plan_prompt(profile, date.today())
+
+        json_schema = plan_json_schema() or plan_generation_schema().model_json_schema()
+        for label, schema in [('unconstrained', None), ('grammar', json_schema)]:
+            results = []
+            for run in range(options['runs']):
+                try:
+                    results.append(measure_completion(local_model, prompt, schema))
+                except Exception as e:
+                    self.stdout.write(f"{label:>13}: run {run + 1} failed: {e}")
+            summary = summarize(results)
+            if not summary:
+                continue
+            self.stdout.write(
+                f"{label:>13}: {summary['valid_rate']:.0%} valid, {summary['repaired_rate']:.0%} repairable, "
+                f"mean {summary['mean_seconds']:.1f}s, {summary['mean_completion_tokens']:.0f} tokens, "
+                f"{summary['mean_tokens_per_second']:.1f} tok/s over {summary['runs']} runs"
+            )
@@ -0,0 +1,171 @@
+import contextlib
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_local.benchmark import (
+    BENCHMARK_PROFILES, CallRecorder, StubLlama, TimedLlama, benchmark_prompts, peak_rss_mb, reset_peak_rss,
+)
+from ai_local.lifecycle import llama_options
+from ai_local.services import LLAMA_CPP_AVAILABLE, LocalModel
+from rest.schemas import GeneratedPlanSchema
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def _mean(values):
+    return round(statistics.mean(values), 4) if values else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks LocalModel.generate_plan over a fixed corpus of profile prompts for each combination "
+        "of n_threads, n_batch and n_ctx: prompt-eval and generation tokens/sec, time to first token, "
+        "peak RSS and the rate of output passing GeneratedPlanSchema. Writes a JSON report."
+    )
+
+    def add_arguments(self, parser):
+        defaults = llama_options()
+        parser.add_argument('--model', help="Path of the GGUF model (defaults to BASE_DIR/model.gguf).")
+        parser.add_argument('--stub', action='store_true', help="Use a stub instead of llama.cpp; no model file needed.")
+        parser.add_argument('--threads', type=int_list, default=[defaults['n_threads']], help="n_threads values, e.g. 2,4,8.")
+        parser.add_argument('--batch', type=int_list, default=[defaults['n_batch']], help="n_batch values, e.g. 128,512.")
+        parser.add_argument('--ctx', type=int_list, default=[defaults['n_ctx']], help="n_ctx values, e.g. 2048,4096.")
+        parser.add_argument('--runs', type=int, default=1, help="Passes over the profile corpus per configuration.")
+        parser.add_argument('--max-tokens', type=int, help="Cap generated tokens (truncated plans fail the schema).")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        model_path = options['model'] or os.path.join(settings.BASE_DIR, 'model.gguf')
+        if options['stub']:
+            backend, llama = 'stub', StubLlama
+        elif not LLAMA_CPP_AVAILABLE:
+            raise CommandError("llama-cpp-python is not installed; use --stub to check the harness.")
+        elif not os.path.exists(model_path):
+            raise CommandError(f"Model file not found at {model_path}; pass --model or use --stub.")
+        else:
+            from llama_cpp import Llama
+            backend, llama = 'llama.cpp', Llama
+
+        prompts = benchmark_prompts() * options['runs']
+        results = []
+        for n_threads, n_batch, n_ctx in itertools.product(options['threads'], options['batch'], options['ctx']):
+            config = {'n_threads': n_threads, 'n_batch': n_batch, 'n_ctx': n_ctx}
+            self.stderr.write(f"Benchmarking {config} over {len(prompts)} prompts...")
+            # Keep the model's progress messages out of the report on stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                result = self.run_config(model_path, llama, config, prompts, options['max_tokens'])
+            results.append(result)
+            self.stderr.write(
+                f"  ttft {result['ttft_seconds']}s, prompt {result['prompt_tokens_per_second']} tok/s, "
+                f"generation {result['generation_tokens_per_second']} tok/s, "
+                f"peak RSS {result['peak_rss_mb']} MB, schema pass rate {result['schema_pass_rate']:.0%}"
+            )
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'backend': backend,
+            'model': os.path.basename(model_path) if backend != 'stub' else None,
+            'model_bytes': os.path.getsize(model_path) if backend != 'stub' else None,
+            'host': {
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count(),
+                'python': platform.python_version(),
+                'llama_cpp': self.llama_cpp_version(),
+            },
+            'corpus': {'profiles': len(BENCHMARK_PROFILES), 'prompts': len(prompts), 'max_tokens': options['max_tokens']},
+            'settings': {
+                'plan_wire_schema': getattr(settings, 'PLAN_WIRE_SCHEMA', None),
+                'grammar': getattr(settings, 'LOCAL_MODEL_GRAMMAR', True) and backend != 'stub',
+                'prefix_cache': getattr(settings, 'LOCAL_MODEL_PREFIX_CACHE', True),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def llama_cpp_version():
+        try:
+            import llama_cpp
+        except ImportError:
+            return None
+        return getattr(llama_cpp, '__version__', None)
+
+    def run_config(self, model_path, llama, config, prompts, max_tokens):
+        """Loads a fresh model with `config`, generates a plan per prompt and unloads it."""
+        timed = []
+
+        def llama_factory(**options):
+            model = TimedLlama(llama(**options), max_tokens=max_tokens)
+            timed.append(model)
+            return model
+
+        gc.collect()
+        rss_resettable = reset_peak_rss()
+        local_model = LocalModel(model_path, options=config, llama_factory=llama_factory)
+        started = time.perf_counter()
+        if not local_model.ensure_loaded():
+            raise CommandError(f"The model could not be loaded with {config}.")
+        load_seconds = time.perf_counter() - started
+
+        passed = fell_back = 0
+        seconds = []
+        for prompt in prompts:
+            call = CallRecorder()
+            started = time.perf_counter()
+            response_text = local_model.generate_plan(prompt, call=call)
+            seconds.append(time.perf_counter() - started)
+            if call.fell_back:
+                fell_back += 1
+                continue
+            try:
+                GeneratedPlanSchema.model_validate_json(response_text)
+                passed += 1
+            except ValueError:
+                pass
+
+        peak_rss = peak_rss_mb()
+        local_model.unload_model()
+        completions = timed[0].completions if timed else []
+        # The scheduler's worker thread keeps local_model, and so llama_factory, alive
+        timed.clear()
+        prompt_tokens = sum(c['prompt_tokens'] for c in completions)
+        ttft = sum(c['ttft_seconds'] for c in completions)
+        generated = sum(max(c['completion_tokens'] - 1, 0) for c in completions)
+        generation_seconds = sum(c['generation_seconds'] for c in completions)
+        return {
+            **config,
+            'load_seconds': round(load_seconds, 3),
+            'runs': len(prompts),
+            'completions': len(completions),
+            'mean_seconds': _mean(seconds),
+            'ttft_seconds': _mean([c['ttft_seconds'] for c in completions]),
+            # With the prefix cache, part of the prompt is not evaluated again
+            'prompt_tokens_per_second': round(prompt_tokens / ttft, 1) if ttft else None,
+            # The first token is counted in the time to first token
+            'generation_tokens_per_second': round(generated / generation_seconds, 1) if generation_seconds else None,
+            'mean_prompt_tokens': _mean([c['prompt_tokens'] for c in completions]),
+            'mean_completion_tokens': _mean([c['completion_tokens'] for c in completions]),
+            'peak_rss_mb': round(peak_rss, 1),
+            # Otherwise the peak since the process started, including earlier configurations
+            'peak_rss_isolated': rss_resettable,
+            'schema_pass_rate': passed / len(prompts) if prompts else 0.0,
+            'fallback_rate': fell_back / len(prompts) if prompts else 0.0,
+        }
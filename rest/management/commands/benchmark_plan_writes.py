@@ -0,0 +1,134 @@
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from rest.models import Profile, FitnessPlan, WorkoutDay, Exercise, NutritionDay, Meal
+from rest.plan_materializer import materialize_plan
+from rest.schemas import GeneratedPlanSchema
+
+
+def build_sample_plan(exercises_per_day=5, meals_per_day=4):
+    """A realistic 7-day plan, used as the payload for every benchmark run."""
+    meal_types = ['breakfast', 'lunch', 'dinner', 'snack']
+    return GeneratedPlanSchema.model_validate({
+        'workout_days': [
+            {
+                'day_of_week': day,
+                'title': 'Rest Day' if day in (3, 7) else f'Workout {day}',
+                'is_rest_day': day in (3, 7),
+                'description': 'Benchmark workout day',
+                'exercises': [] if day in (3, 7) else [
+                    {
+                        'name': f'Exercise {index}',
+                        'sets': 3,
+                        'met_value': 5.0,
+                        'duration_mins': 10,
+                        'reps': '10-12',
+                        'rest_period_seconds': 60,
+                        'notes': 'Benchmark exercise',
+                    }
+                    for index in range(exercises_per_day)
+                ],
+            }
+            for day in range(1, 8)
+        ],
+        'nutrition_days': [
+            {
+                'day_of_week': day,
+                'target_calories': 2000,
+                'target_protein_grams': 120,
+                'target_carbs_grams': 220,
+                'target_fats_grams': 70,
+                'target_water_litres': 2.5,
+                'notes': 'Benchmark nutrition day',
+                'meals': [
+                    {
+                        'meal_type': meal_types[index % len(meal_types)],
+                        'description': 'Jollof rice with grilled chicken',
+                        'calories': 500,
+                        'protein_grams': 30.0,
+                        'carbs_grams': 55.0,
+                        'fats_grams': 15.0,
+                        'portion_size': '1 plate',
+                    }
+                    for index in range(meals_per_day)
+                ],
+            }
+            for day in range(1, 8)
+        ],
+    })
+
+
+@transaction.atomic
+def save_plan_row_by_row(user_profile, start_date, plan_data):
+    """The previous persistence path: one INSERT per row."""
+    new_plan = FitnessPlan.objects.create(
+        profile=user_profile,
+        start_date=start_date,
+        end_date=start_date + timedelta(days=6),
+        goal_at_creation=user_profile.goal,
+        ai_response_raw=plan_data.model_dump(mode='json')
+    )
+    for wd_data in plan_data.workout_days:
+        workout_day = WorkoutDay.objects.create(
+            plan=new_plan,
+            day_of_week=wd_data.day_of_week,
+            title=wd_data.title,
+            description=wd_data.description or '',
+            is_rest_day=wd_data.is_rest_day
+        )
+        for ex_data in wd_data.exercises:
+            Exercise.objects.create(workout_day=workout_day, **ex_data.model_dump())
+    for nd_data in plan_data.nutrition_days:
+        nutrition_day = NutritionDay.objects.create(
+            plan=new_plan, **nd_data.model_dump(exclude={'meals'})
+        )
+        for meal_data in nd_data.meals:
+            Meal.objects.create(nutrition_day=nutrition_day, **meal_data.model_dump())
+    return new_plan
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures per-plan write latency of the bulk plan materializer against row-by-row inserts "
+        "on the configured database. Run it once per database backend (e.g. SQLite and PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--exercises-per-day', type=int, default=5)
+        parser.add_argument('--meals-per-day', type=int, default=4)
+
+    def handle(self, *args, **options):
+        plan_data = build_sample_plan(options['exercises_per_day'], options['meals_per_day'])
+        user = User.objects.create_user(username='plan-write-benchmark', email='plan-write-benchmark@example.com')
+        profile = Profile.objects.create(user=user, goal='maintenance')
+        self.stdout.write(f"Database: {connection.vendor}, iterations: {options['iterations']}")
+
+        try:
+            for label, writer in [('row-by-row', save_plan_row_by_row), ('bulk', materialize_plan)]:
+                timings = []
+                queries = 0
+                for iteration in range(options['iterations']):
+                    start_date = date(2000, 1, 3) + timedelta(weeks=iteration)
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        writer(profile, start_date, plan_data)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    queries = len(captured.captured_queries)
+                    profile.fitness_plans.all().delete()
+
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                self.stdout.write(
+                    f"{label:>10}: mean {statistics.mean(timings):.2f} ms, "
+                    f"p50 {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms, "
+                    f"{queries} queries per plan"
+                )
+        finally:
+            user.delete()
@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai_local.benchmark import benchmark_prompts
+from ai_local.prefix_cache import PrefixCache
+from ai_local.services import get_local_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures prompt evaluation of local plan prompts with and without the cached prompt prefix "
+        "(see ai_local/prefix_cache.py). Needs the model loaded in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=8, help="Prompts per mode, cycling through sample profiles.")
+
+    def handle(self, *args, **options):
+        local_model = get_local_model()
+        if local_model.server_url or not local_model.ensure_loaded():
+            raise CommandError("The model must be loaded in process: unset LOCAL_INFERENCE_URL and see ai_local/SETUP.md.")
+        with local_model.lifecycle.in_use():
+            self.run_benchmark(local_model, options['runs'])
+
+    def run_benchmark(self, local_model, runs):
+        model = local_model.model
+        prompts = [local_model.build_prompt(prompt) for prompt in benchmark_prompts(count=runs)]
+        prefix_cache = local_model.prefix_cache
+        if prefix_cache is None:
+            prefix_cache = PrefixCache(model, local_model.prompt_prefix())
+            prefix_cache.warm()
+
+        results = {}
+        for label, prepare in [('no cache', None), ('prefix cache', prefix_cache.prepare)]:
+            seconds, prompt_tokens = [], []
+            for prompt in prompts:
+                # Start from an empty context, as after another prompt or a restart
+                model.reset()
+                started = time.perf_counter()
+                if prepare:
+                    prepare(prompt)
+                # One generated token, so the time is dominated by prompt evaluation
+                response = model(prompt, max_tokens=1, temperature=0.0, echo=False)
+                seconds.append(time.perf_counter() - started)
+                prompt_tokens.append((response.get('usage') or {}).get('prompt_tokens') or 0)
+            results[label] = statistics.mean(seconds)
+            self.stdout.write(
+                f"{label:>12}: mean {results[label] * 1000:.0f} ms to first token, "
+                f"{statistics.mean(prompt_tokens):.0f} prompt tokens over {len(prompts)} prompts"
+            )
+
+        stats = prefix_cache.get_stats()
+        self.stdout.write(
+            f"Prefix of {stats['prefix_tokens']} tokens, warmed in {stats['warm_seconds']}s; "
+            f"speedup {results['no cache'] / results['prefix cache']:.1f}x"
+        )
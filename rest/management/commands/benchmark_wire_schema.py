@@ -0,0 +1,117 @@
+import re
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rest import ai_client
+from rest.ai_service import GEMINI_MODEL, build_plan_prompt, build_generation_config
+from rest.management.commands.benchmark_plan_writes import build_sample_plan
+from rest.models import Profile
+from rest.schemas import GeneratedPlanSchema, GeneratedPlanMealsSchema
+from rest.wire_schema import CompactPlanSchema, CompactPlanMealsSchema, parse_plan, to_wire
+
+SCHEMAS = {
+    'full': GeneratedPlanSchema,
+    'full-meals': GeneratedPlanMealsSchema,
+    'compact': CompactPlanSchema,
+    'compact-meals': CompactPlanMealsSchema,
+}
+
+# Words, numbers and single punctuation characters; close to what BPE tokenizers produce for JSON
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def get_token_counter(tokenizer):
+    if tokenizer == 'estimate':
+        return estimate_tokens
+    if tokenizer == 'gemini':
+        return lambda text: ai_client.get_client().models.count_tokens(model=GEMINI_MODEL, contents=text).total_tokens
+    if tokenizer == 'local':
+        from ai_local.services import get_local_model
+        local_model = get_local_model()
+        if not local_model.ensure_loaded():
+            raise CommandError("The local model is not loaded (see ai_local/SETUP.md or LOCAL_INFERENCE_URL).")
+        # With LOCAL_INFERENCE_URL, local_model.model is the inference server client, which tokenizes on the server
+        return lambda text: len(local_model.model.tokenize(text.encode('utf-8'), add_bos=False))
+    raise CommandError(f"Unknown tokenizer '{tokenizer}'.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the full and compact wire schemas: output size and tokens of a sample plan, "
+        "and with --live, real Gemini output tokens and latency per schema."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokenizer', choices=['estimate', 'gemini', 'local'], default='estimate',
+                            help="How to count tokens: a regex estimate, Gemini's count_tokens or the local GGUF "
+                                 "tokenizer (in process, or on the LOCAL_INFERENCE_URL server).")
+        parser.add_argument('--exercises-per-day', type=int, default=5)
+        parser.add_argument('--meals-per-day', type=int, default=4)
+        parser.add_argument('--live', type=int, default=0, metavar='N', help="Also generate N plans with Gemini per schema.")
+        parser.add_argument('--schema', action='append', dest='schemas', choices=list(SCHEMAS),
+                            help="Schemas to compare (repeatable, default all).")
+
+    def handle(self, *args, **options):
+        count_tokens = get_token_counter(options['tokenizer'])
+        plan_data = build_sample_plan(options['exercises_per_day'], options['meals_per_day'])
+        schemas = options['schemas'] or list(SCHEMAS)
+
+        self.stdout.write(f"Sample plan, tokens counted with '{options['tokenizer']}':")
+        baseline = None
+        for label in schemas:
+            text = to_wire(plan_data, SCHEMAS[label])
+            tokens = count_tokens(text)
+            baseline = baseline or tokens
+            started = time.perf_counter()
+            parse_plan(text, SCHEMAS[label])
+            parse_ms = (time.perf_counter() - started) * 1000
+            self.stdout.write(
+                f"{label:>14}: {len(text.encode('utf-8'))} bytes, {tokens} tokens "
+                f"({tokens / baseline:.0%} of {schemas[0]}), parse and expand {parse_ms:.2f} ms"
+            )
+
+        if options['live']:
+            self._benchmark_live(schemas, options['live'])
+
+    def _benchmark_live(self, schemas, runs):
+        profile = Profile(
+            goal='weight_loss', activity_level='moderately_active', gender='female', age=30,
+            current_weight=70, height=165,
+        )
+        prompt = build_plan_prompt(profile, date.today())
+        self.stdout.write(f"Live Gemini generations ({GEMINI_MODEL}), {runs} per schema:")
+        for label in schemas:
+            latencies, output_tokens, valid = [], [], 0
+            for _ in range(runs):
+                started = time.perf_counter()
+                try:
+                    response = ai_client.generate_content(
+                        model=GEMINI_MODEL, contents=prompt, config=build_generation_config(SCHEMAS[label])
+                    )
+                except Exception as e:
+                    self.stdout.write(f"{label:>14}: call failed: {e}")
+                    continue
+                latencies.append(time.perf_counter() - started)
+                usage = getattr(response, 'usage_metadata', None)
+                if usage and usage.candidates_token_count:
+                    output_tokens.append(usage.candidates_token_count)
+                try:
+                    parse_plan(response.text, SCHEMAS[label])
+                    valid += 1
+                except ValueError:
+                    pass
+            if not latencies:
+                continue
+            self.stdout.write(
+                f"{label:>14}: latency mean {statistics.mean(latencies):.2f}s, "
+                f"p50 {statistics.median(latencies):.2f}s, "
+                f"output tokens mean {statistics.mean(output_tokens) if output_tokens else 0:.0f}, "
+                f"{valid}/{len(latencies)} valid"
+            )
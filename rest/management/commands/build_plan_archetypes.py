@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from rest.plan_archetypes import build_archetypes
+
+
+class Command(BaseCommand):
+    help = "Generates the archetype plan library used for instant first plans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goal', action='append', dest='goals', help="Only build this goal (repeatable).")
+        parser.add_argument('--activity-level', action='append', dest='activity_levels', help="Only build this activity level (repeatable).")
+        parser.add_argument('--gender', action='append', dest='genders', help="Only build this gender (repeatable).")
+        parser.add_argument('--diet', action='append', dest='diets', help="Only build this diet, e.g. 'none' or 'vegetarian' (repeatable).")
+        parser.add_argument('--concurrency', type=int, help="Archetypes generated at once (defaults to PLAN_ARCHETYPE_BUILD_CONCURRENCY).")
+        parser.add_argument('--overwrite', action='store_true', help="Regenerate archetypes that already exist.")
+
+    def handle(self, *args, **options):
+        summary = build_archetypes(
+            goals=options['goals'],
+            activity_levels=options['activity_levels'],
+            genders=options['genders'],
+            diets=options['diets'],
+            overwrite=options['overwrite'],
+            concurrency=options['concurrency'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archetypes finished in {summary['duration_seconds']}s: {summary['built']} built, "
+            f"{summary['failed']} failed, {summary['skipped']} already existed"
+        ))
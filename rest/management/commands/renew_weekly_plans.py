@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from rest.plan_renewal import renew_weekly_plans
+
+
+class Command(BaseCommand):
+    help = "Pre-generates next week's fitness plan for every profile whose latest plan ends soon."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within-days', type=int, help="Renew plans ending within this many days (defaults to PLAN_RENEWAL_WITHIN_DAYS).")
+        parser.add_argument('--concurrency', type=int, help="Plans generated at once (defaults to PLAN_RENEWAL_CONCURRENCY).")
+        parser.add_argument('--per-minute', type=int, help="Generations started per minute, 0 for no limit (defaults to PLAN_RENEWAL_PER_MINUTE).")
+        parser.add_argument('--dry-run', action='store_true', help="List the profiles that are due without generating anything.")
+
+    def handle(self, *args, **options):
+        summary = renew_weekly_plans(
+            within_days=options['within_days'],
+            concurrency=options['concurrency'],
+            per_minute=options['per_minute'],
+            dry_run=options['dry_run'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Renewal finished in {summary['duration_seconds']}s: {summary['due']} due, "
+            f"{summary['succeeded']} succeeded, {summary['failed']} failed, "
+            f"{summary['skipped']} skipped, {summary['errors']} errors"
+            + (" (dry run)" if summary['dry_run'] else "")
+        ))
@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ai_local.inference_server import serve
+from ai_local.lifecycle import llama_options
+from ai_local.services import LocalModel
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the shared local inference server, which loads the GGUF model once for all "
+        "Django workers on this host (see LOCAL_INFERENCE_URL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', help="unix:///path/to.sock or http://127.0.0.1:port (defaults to LOCAL_INFERENCE_URL).")
+        parser.add_argument('--model', help="Path of the GGUF model (defaults to BASE_DIR/model.gguf).")
+        parser.add_argument('--n-ctx', type=int, help="Context window size (defaults to LOCAL_MODEL_N_CTX).")
+        parser.add_argument('--n-threads', type=int, help="CPU threads used for inference (defaults to LOCAL_MODEL_N_THREADS).")
+        parser.add_argument('--n-batch', type=int, help="Prompt tokens evaluated per batch (defaults to LOCAL_MODEL_N_BATCH).")
+        parser.add_argument('--n-gpu-layers', type=int, help="Layers offloaded to the GPU, -1 for all (defaults to LOCAL_MODEL_N_GPU_LAYERS).")
+        parser.add_argument('--max-queue', type=int, help="Completions allowed to wait (defaults to LOCAL_INFERENCE_MAX_QUEUE).")
+
+    def handle(self, *args, **options):
+        bind = options['bind'] or getattr(settings, 'LOCAL_INFERENCE_URL', '') or 'http://127.0.0.1:8765'
+        model_path = options['model'] or os.path.join(settings.BASE_DIR, 'model.gguf')
+        llama = llama_options()
+        for option in ('n_ctx', 'n_threads', 'n_batch', 'n_gpu_layers'):
+            if options[option] is not None:
+                llama[option] = options[option]
+        try:
+            serve(
+                bind,
+                model_path,
+                max_queue=options['max_queue'] or getattr(settings, 'LOCAL_INFERENCE_MAX_QUEUE', 8),
+                queue_timeout=getattr(settings, 'LOCAL_INFERENCE_TIMEOUT_SECONDS', 120.0),
+                prompt_prefix=LocalModel.prompt_prefix() if getattr(settings, 'LOCAL_MODEL_PREFIX_CACHE', True) else None,
+                **llama,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping the local inference server...")
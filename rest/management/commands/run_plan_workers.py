@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rest.plan_jobs import PlanJobWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Runs a pool of workers that process queued plan generation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Number of worker threads (defaults to PLAN_JOB_WORKERS).")
+        parser.add_argument('--poll-interval', type=float, help="Seconds to wait between polls when the queue is empty.")
+
+    def handle(self, *args, **options):
+        pool = PlanJobWorkerPool(workers=options['workers'], poll_interval=options['poll_interval'])
+        pool.start()
+        self.stdout.write(self.style.SUCCESS(f"Processing plan jobs with {pool.workers} worker(s). Press Ctrl+C to stop."))
+        try:
+            while pool.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping plan job workers...")
+        finally:
+            pool.stop(timeout=60)
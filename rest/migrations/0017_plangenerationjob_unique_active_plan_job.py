@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0016_plangenerationjob'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='plangenerationjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('profile', 'start_date'), name='unique_active_plan_job'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0017_plangenerationjob_unique_active_plan_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICallRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend', models.CharField(help_text="e.g. 'gemini' or 'local'", max_length=30)),
+                ('model', models.CharField(max_length=100)),
+                ('purpose', models.CharField(default='plan', help_text="e.g. 'plan', 'plan-stream', 'plan-shard'", max_length=50)),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('output_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('time_to_first_byte_ms', models.PositiveIntegerField(blank=True, help_text='Only recorded for streamed calls.', null=True)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('retries', models.PositiveIntegerField(default=0)),
+                ('validation_outcome', models.CharField(choices=[('valid', 'Valid'), ('invalid', 'Failed validation'), ('error', 'Call failed'), ('fallback', 'Fallback plan used')], max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ai_calls', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
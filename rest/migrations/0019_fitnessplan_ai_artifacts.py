@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0018_aicallrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIArtifact',
+            fields=[
+                ('digest', models.CharField(help_text='SHA-256 of the uncompressed content.', max_length=64, primary_key=True, serialize=False)),
+                ('codec', models.CharField(choices=[('zlib', 'zlib'), ('zstd', 'Zstandard')], default='zlib', max_length=10)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(help_text='Uncompressed size in bytes.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='fitnessplan',
+            name='ai_prompt_artifact',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='rest.aiartifact'),
+        ),
+        migrations.AddField(
+            model_name='fitnessplan',
+            name='ai_response_artifact',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='rest.aiartifact'),
+        ),
+    ]
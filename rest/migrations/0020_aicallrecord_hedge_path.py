@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0019_fitnessplan_ai_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aicallrecord',
+            name='hedge_path',
+            field=models.CharField(blank=True, choices=[('primary', 'Primary backend won'), ('secondary', 'Secondary backend won')], help_text="For hedged generations, which backend's plan was used.", max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='aicallrecord',
+            name='purpose',
+            field=models.CharField(default='plan', help_text="e.g. 'plan', 'plan-stream', 'plan-shard', 'plan-hedge'", max_length=50),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0020_aicallrecord_hedge_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanArchetype',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goal', models.CharField(choices=[('weight_loss', 'Weight Loss'), ('maintenance', 'Maintenance'), ('muscle_gain', 'Muscle Gain'), ('endurance', 'Endurance/Performance')], max_length=50)),
+                ('activity_level', models.CharField(choices=[('sedentary', 'Sedentary (little or no exercise)'), ('lightly_active', 'Lightly Active (light exercise/sports 1-3 days/week)'), ('moderately_active', 'Moderately Active (moderate exercise/sports 3-5 days/week)'), ('very_active', 'Very Active (hard exercise/sports 6-7 days a week)'), ('athlete', 'Intense daily exercise')], max_length=50)),
+                ('gender', models.CharField(choices=[('male', 'Male'), ('female', 'Female')], max_length=10)),
+                ('age_band', models.CharField(choices=[('18-29', '18-29'), ('30-44', '30-44'), ('45-59', '45-59'), ('60+', '60+')], max_length=10)),
+                ('diet', models.CharField(default='none', help_text="e.g. 'none', 'vegetarian', 'vegan', 'halal'", max_length=30)),
+                ('base_calories', models.PositiveIntegerField(help_text='Average daily target calories of the stored plan.')),
+                ('backend', models.CharField(help_text='The generator backend that produced the plan.', max_length=30)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('plan_artifact', models.ForeignKey(help_text='The compressed GeneratedPlanSchema JSON.', on_delete=django.db.models.deletion.PROTECT, related_name='+', to='rest.aiartifact')),
+            ],
+            options={
+                'unique_together': {('goal', 'activity_level', 'gender', 'age_band', 'diet')},
+            },
+        ),
+    ]
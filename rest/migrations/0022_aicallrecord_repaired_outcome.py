@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0021_planarchetype'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aicallrecord',
+            name='validation_outcome',
+            field=models.CharField(choices=[('valid', 'Valid'), ('repaired', 'Valid after repair'), ('invalid', 'Failed validation'), ('error', 'Call failed'), ('fallback', 'Fallback plan used')], max_length=20),
+        ),
+    ]
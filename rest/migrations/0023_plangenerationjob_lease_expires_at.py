@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0022_aicallrecord_repaired_outcome'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plangenerationjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Renewed by the running worker; a job past it is requeued.', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0023_plangenerationjob_lease_expires_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aicallrecord',
+            name='hedge_path',
+            field=models.CharField(blank=True, choices=[('primary', 'Primary backend won'), ('secondary', 'Secondary backend won'), ('cancelled', 'Finished after the other backend won')], help_text="For the calls of a hedged generation, whether this call's plan was used.", max_length=10, null=True),
+        ),
+    ]
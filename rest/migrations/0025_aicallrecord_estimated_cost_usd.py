@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest', '0024_aicallrecord_hedge_cancelled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aicallrecord',
+            name='estimated_cost_usd',
+            field=models.DecimalField(blank=True, decimal_places=6, help_text='From the token counts and AI_MODEL_PRICES.', max_digits=12, null=True),
+        ),
+    ]
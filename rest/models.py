@@ -101,6 +101,24 @@ class Profile(models.Model):
 
 # --- New Models for Fitness Plans ---
 
+class AIArtifact(models.Model):
+    """ A compressed AI prompt or response, stored once per distinct content. """
+    CODEC_ZLIB = 'zlib'
+    CODEC_ZSTD = 'zstd'
+    CODEC_CHOICES = [
+        (CODEC_ZLIB, 'zlib'),
+        (CODEC_ZSTD, 'Zstandard'),
+    ]
+    digest = models.CharField(max_length=64, primary_key=True, help_text="SHA-256 of the uncompressed content.")
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES, default=CODEC_ZLIB)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.codec}, {self.size} bytes)"
+
+
 class FitnessPlan(models.Model):
     """ The main container for a complete plan for a specific period. """
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='fitness_plans')
@@ -114,11 +132,29 @@ class FitnessPlan(models.Model):
     # For debugging and fine-tuning your AI
     ai_prompt_text = models.TextField(blank=True, help_text="The exact prompt sent to the AI.")
     ai_response_raw = models.JSONField(blank=True, null=True, help_text="The raw JSON response from the AI.")
+    # New plans store the prompt and response as deduplicated, compressed artifacts
+    # (see rest/ai_artifacts.py); the text fields above are kept for older rows.
+    ai_prompt_artifact = models.ForeignKey(AIArtifact, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
+    ai_response_artifact = models.ForeignKey(AIArtifact, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
 
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Plan for {self.profile.user.username} from {self.start_date} to {self.end_date}"
+
+    def get_ai_prompt(self):
+        """The prompt sent to the AI, loaded from its artifact on demand."""
+        from .ai_artifacts import read_text
+        if self.ai_prompt_artifact_id:
+            return read_text(self.ai_prompt_artifact)
+        return self.ai_prompt_text
+
+    def get_ai_response(self):
+        """The raw AI response, loaded from its artifact on demand."""
+        from .ai_artifacts import read_json
+        if self.ai_response_artifact_id:
+            return read_json(self.ai_response_artifact)
+        return self.ai_response_raw
     
     class Meta:
         ordering = ['-created_at']
@@ -244,6 +280,120 @@ class WaterTracking(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.litres_consumed}L on {self.date}"
 
+class PlanGenerationJob(models.Model):
+    """ A queued request to generate a FitnessPlan in the background. """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='plan_jobs')
+    start_date = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    plan = models.ForeignKey(FitnessPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs')
+    error = models.TextField(blank=True, null=True, help_text="Why the job failed, if it did.")
+    attempts = models.PositiveIntegerField(default=0)
+    worker_id = models.CharField(max_length=100, blank=True, null=True, help_text="The worker that claimed this job.")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, help_text="Renewed by the running worker; a job past it is requeued.")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        constraints = [
+            # At most one generation in flight per profile and start date;
+            # this is the cross-process lock used to coalesce duplicate requests.
+            models.UniqueConstraint(
+                fields=['profile', 'start_date'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_plan_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Plan job {self.pk} for {self.profile.user.username} ({self.status})"
+
+class PlanArchetype(models.Model):
+    """
+    A pre-generated plan for a group of similar profiles, used to give new
+    users a plan instantly (see rest/plan_archetypes.py).
+    """
+    AGE_BAND_CHOICES = [
+        ('18-29', '18-29'),
+        ('30-44', '30-44'),
+        ('45-59', '45-59'),
+        ('60+', '60+'),
+    ]
+    goal = models.CharField(max_length=50, choices=Profile._meta.get_field('goal').choices)
+    activity_level = models.CharField(max_length=50, choices=Profile._meta.get_field('activity_level').choices)
+    gender = models.CharField(max_length=10, choices=Profile._meta.get_field('gender').choices)
+    age_band = models.CharField(max_length=10, choices=AGE_BAND_CHOICES)
+    diet = models.CharField(max_length=30, default='none', help_text="e.g. 'none', 'vegetarian', 'vegan', 'halal'")
+    plan_artifact = models.ForeignKey(AIArtifact, on_delete=models.PROTECT, related_name='+', help_text="The compressed GeneratedPlanSchema JSON.")
+    base_calories = models.PositiveIntegerField(help_text="Average daily target calories of the stored plan.")
+    backend = models.CharField(max_length=30, help_text="The generator backend that produced the plan.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['goal', 'activity_level', 'gender', 'age_band', 'diet']
+
+    def __str__(self):
+        return f"{self.goal}/{self.activity_level}/{self.gender}/{self.age_band}/{self.diet}"
+
+
+class AICallRecord(models.Model):
+    """ Telemetry for a single call to a plan generation model. """
+    OUTCOME_VALID = 'valid'
+    OUTCOME_INVALID = 'invalid'
+    OUTCOME_ERROR = 'error'
+    OUTCOME_FALLBACK = 'fallback'
+    OUTCOME_REPAIRED = 'repaired'
+    OUTCOME_CHOICES = [
+        (OUTCOME_VALID, 'Valid'),
+        (OUTCOME_REPAIRED, 'Valid after repair'),
+        (OUTCOME_INVALID, 'Failed validation'),
+        (OUTCOME_ERROR, 'Call failed'),
+        (OUTCOME_FALLBACK, 'Fallback plan used'),
+    ]
+    HEDGE_PRIMARY = 'primary'
+    HEDGE_SECONDARY = 'secondary'
+    HEDGE_CANCELLED = 'cancelled'
+    HEDGE_CHOICES = [
+        (HEDGE_PRIMARY, 'Primary backend won'),
+        (HEDGE_SECONDARY, 'Secondary backend won'),
+        (HEDGE_CANCELLED, 'Finished after the other backend won'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='ai_calls')
+    backend = models.CharField(max_length=30, help_text="e.g. 'gemini' or 'local'")
+    model = models.CharField(max_length=100)
+    purpose = models.CharField(max_length=50, default='plan', help_text="e.g. 'plan', 'plan-stream', 'plan-shard', 'plan-hedge'")
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    output_tokens = models.PositiveIntegerField(null=True, blank=True)
+    time_to_first_byte_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Only recorded for streamed calls.")
+    latency_ms = models.PositiveIntegerField()
+    retries = models.PositiveIntegerField(default=0)
+    estimated_cost_usd = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True, help_text="From the token counts and AI_MODEL_PRICES.")
+    validation_outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    error = models.TextField(blank=True, null=True)
+    hedge_path = models.CharField(max_length=10, choices=HEDGE_CHOICES, blank=True, null=True, help_text="For the calls of a hedged generation, whether this call's plan was used.")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.backend}/{self.model} {self.purpose} ({self.validation_outcome}, {self.latency_ms} ms)"
+
 @receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
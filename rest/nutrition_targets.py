@@ -0,0 +1,198 @@
+# rest/nutrition_targets.py
+"""
+Deterministic daily nutrition targets.
+
+Calories come from the Mifflin-St Jeor BMR times an activity factor,
+adjusted for the user's goal; protein is set per kg of body weight, fat as
+a share of calories and carbs make up the rest. Water is 35 ml per kg plus
+an allowance for activity.
+
+With NUTRITION_TARGETS_ENABLED the model is only asked for meals (see
+rest/wire_schema.py); the targets of every NutritionDay are filled in
+here, and days whose meal totals are not near the calorie target have
+their meal portions scaled to fit.
+"""
+import re
+
+from django.conf import settings
+
+from .models import Profile
+from .schemas import GeneratedPlanSchema
+
+ACTIVITY_FACTORS = {
+    'sedentary': 1.2,
+    'lightly_active': 1.375,
+    'moderately_active': 1.55,
+    'very_active': 1.725,
+    'athlete': 1.9,
+}
+
+GOAL_CALORIE_FACTORS = {
+    'weight_loss': 0.8,
+    'maintenance': 1.0,
+    'muscle_gain': 1.1,
+    'endurance': 1.1,
+}
+
+# (protein grams per kg of body weight, share of calories from fat)
+MACRO_SPLITS = {
+    'weight_loss': (2.0, 0.25),
+    'maintenance': (1.6, 0.30),
+    'muscle_gain': (2.0, 0.25),
+    'endurance': (1.4, 0.25),
+}
+
+# Extra litres of water per day for the activity level
+ACTIVITY_WATER_LITRES = {
+    'sedentary': 0.0,
+    'lightly_active': 0.25,
+    'moderately_active': 0.5,
+    'very_active': 0.75,
+    'athlete': 1.0,
+}
+
+MINIMUM_CALORIES = {
+    'male': 1500,
+    'female': 1200,
+}
+
+# Daily targets for profiles missing the body data to compute them
+DEFAULT_TARGETS = {
+    'target_calories': 2000,
+    'target_protein_grams': 110,
+    'target_carbs_grams': 240,
+    'target_fats_grams': 65,
+    'target_water_litres': 2.5,
+}
+
+
+def calculate_bmr(weight, height, age, gender):
+    """Mifflin-St Jeor basal metabolic rate in kcal/day."""
+    return 10 * weight + 6.25 * height - 5 * age + (5 if gender == 'male' else -161)
+
+
+def calculate_tdee(weight, height, age, gender, activity_level):
+    """Total daily energy expenditure in kcal/day."""
+    return calculate_bmr(weight, height, age, gender) * ACTIVITY_FACTORS.get(activity_level, 1.2)
+
+
+def estimate_daily_calories(weight, height, age, gender, activity_level, goal):
+    """TDEE adjusted for the goal, never below a safe minimum."""
+    calories = calculate_tdee(weight, height, age, gender, activity_level) * GOAL_CALORIE_FACTORS.get(goal, 1.0)
+    return round(max(calories, MINIMUM_CALORIES.get(gender, 1200)))
+
+
+def compute_nutrition_targets(profile: Profile):
+    """
+    The daily targets for the profile, keyed like the NutritionDaySchema
+    fields, or None if weight, height, age or gender is missing.
+    """
+    if not (profile.current_weight and profile.height and profile.age and profile.gender):
+        return None
+    weight = profile.current_weight
+    calories = estimate_daily_calories(
+        weight, profile.height, profile.age, profile.gender, profile.activity_level, profile.goal
+    )
+    protein_per_kg, fat_share = MACRO_SPLITS.get(profile.goal, MACRO_SPLITS['maintenance'])
+    # Protein is capped at 35% of calories for heavy users
+    protein = min(weight * protein_per_kg, calories * 0.35 / 4)
+    fats = calories * fat_share / 9
+    carbs = max(calories - protein * 4 - fats * 9, 0) / 4
+    water = weight * 0.035 + ACTIVITY_WATER_LITRES.get(profile.activity_level, 0.0)
+    return {
+        'target_calories': calories,
+        'target_protein_grams': round(protein),
+        'target_carbs_grams': round(carbs),
+        'target_fats_grams': round(fats),
+        'target_water_litres': round(water, 1),
+    }
+
+
+# The multiplier _scale_meal() appends to a portion, e.g. "1 plate (x1.2)"
+PORTION_MULTIPLIER = re.compile(r"\s*\(x(\d+(?:\.\d+)?)\)$")
+
+
+def _scale_meal(meal, factor):
+    meal.calories = round(meal.calories * factor)
+    meal.protein_grams = round(meal.protein_grams * factor, 1)
+    meal.carbs_grams = round(meal.carbs_grams * factor, 1)
+    meal.fats_grams = round(meal.fats_grams * factor, 1)
+    # A meal scaled before keeps one multiplier, relative to its base portion
+    portion = meal.portion_size or '1 portion'
+    match = PORTION_MULTIPLIER.search(portion)
+    if match:
+        portion = portion[:match.start()]
+        factor *= float(match.group(1))
+    meal.portion_size = f"{portion} (x{factor:.1f})"
+
+
+def check_meal_totals(plan_data: GeneratedPlanSchema, tolerance=None):
+    """
+    The (day_of_week, meal calories, target calories) of every day whose
+    meals are more than `tolerance` (a fraction) away from its target.
+    """
+    tolerance = tolerance if tolerance is not None else getattr(settings, 'NUTRITION_MEAL_TOLERANCE', 0.1)
+    off_target = []
+    for day in plan_data.nutrition_days:
+        total = sum(meal.calories for meal in day.meals)
+        if day.target_calories and total and abs(total - day.target_calories) > day.target_calories * tolerance:
+            off_target.append((day.day_of_week, total, day.target_calories))
+    return off_target
+
+
+def apply_nutrition_targets(plan_data: GeneratedPlanSchema, targets, tolerance=None):
+    """
+    Returns a copy of plan_data with the targets on every nutrition day and
+    the meals of off-target days scaled to the calorie target.
+    """
+    plan_data = plan_data.model_copy(deep=True)
+    if not targets:
+        return plan_data
+    for day in plan_data.nutrition_days:
+        for field, value in targets.items():
+            setattr(day, field, value)
+
+    off_target = dict((day, total) for day, total, _ in check_meal_totals(plan_data, tolerance))
+    for day in plan_data.nutrition_days:
+        if day.day_of_week in off_target:
+            print(f"Meals of day {day.day_of_week} total {off_target[day.day_of_week]} kcal "
+                  f"for a {day.target_calories} kcal target; scaling portions")
+            factor = day.target_calories / off_target[day.day_of_week]
+            for meal in day.meals:
+                _scale_meal(meal, factor)
+    return plan_data
+
+
+def nutrition_targets_enabled():
+    return getattr(settings, 'NUTRITION_TARGETS_ENABLED', True)
+
+
+def apply_profile_targets(profile: Profile, plan_data: GeneratedPlanSchema):
+    """
+    Fills in the profile's nutrition targets, if NUTRITION_TARGETS_ENABLED.
+    The model was only asked for meals then, so days of profiles missing
+    body data get DEFAULT_TARGETS wherever they have none; their meals are
+    not scaled to them.
+    """
+    if not nutrition_targets_enabled():
+        return plan_data
+    targets = compute_nutrition_targets(profile)
+    if targets:
+        return apply_nutrition_targets(plan_data, targets)
+    plan_data = plan_data.model_copy(deep=True)
+    for day in plan_data.nutrition_days:
+        for field, value in DEFAULT_TARGETS.items():
+            if getattr(day, field) is None:
+                setattr(day, field, value)
+    return plan_data
+
+
+def prompt_targets_line(targets):
+    """The prompt instruction describing the precomputed targets."""
+    if not targets or not nutrition_targets_enabled():
+        return ""
+    return (
+        f"\n    - Daily nutrition targets (already computed, do not output them): {targets['target_calories']} kcal, "
+        f"{targets['target_protein_grams']} g protein, {targets['target_carbs_grams']} g carbs, "
+        f"{targets['target_fats_grams']} g fat. Plan meals whose totals land close to these."
+    )
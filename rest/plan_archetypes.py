@@ -0,0 +1,239 @@
+# rest/plan_archetypes.py
+"""
+A library of pre-generated "archetype" plans for instant first plans.
+
+An archetype is a plan generated offline (`python manage.py
+build_plan_archetypes`) with the normal generator backends for a
+representative profile of each goal, activity level, gender, age band and
+diet. It is stored once as a compressed artifact.
+
+When a new user asks for their first plan, the closest archetype gets
+the user's nutrition targets (rest/nutrition_targets.py), its meals are
+scaled to them, and it is bulk inserted right away, instead of waiting
+for a live model call. A PlanGenerationJob can then personalize
+it in the background: the plan's days are replaced by a fully generated
+plan, unless the user has already started using the plan.
+
+Archetypes hold the meals as generated; they are scaled once, to the
+user's targets, when the plan is saved.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .ai_artifacts import read_json, store_json
+from .ai_service import build_plan_prompt
+from .models import Profile, PlanArchetype, FitnessPlan, WorkoutTracking, MealTracking, WaterTracking
+from .nutrition_targets import compute_nutrition_targets, apply_nutrition_targets, apply_profile_targets
+from .plan_backends import get_router
+from .plan_cache import cache_plan
+from .plan_materializer import materialize_plan, replace_plan_days
+from .schemas import GeneratedPlanSchema
+
+AGE_BANDS = [
+    # (upper age, band, representative age)
+    (29, '18-29', 24),
+    (44, '30-44', 37),
+    (59, '45-59', 52),
+    (None, '60+', 65),
+]
+
+DIETS = ['vegan', 'vegetarian', 'pescatarian', 'halal']
+
+# Representative weight (kg) and height (cm) used when generating archetypes
+REFERENCE_BODY = {
+    'male': (75, 175),
+    'female': (65, 162),
+}
+
+
+def get_age_band(age):
+    for upper, band, _ in AGE_BANDS:
+        if upper is None or age <= upper:
+            return band
+
+
+def get_diet(profile: Profile):
+    """
+    The archetype diet of a profile: the first known diet it lists, 'none'
+    if it lists none, or None if it lists a diet no archetype covers.
+    """
+    preferences = {p.lower() for p in profile.get_dietary_preferences_list()} - {'none'}
+    if preferences - set(DIETS):
+        return None
+    return next((diet for diet in DIETS if diet in preferences), 'none')
+
+
+def can_use_archetype(profile: Profile):
+    """
+    Archetypes know nothing about allergies, medical conditions or diets
+    other than DIETS, so those profiles always get a live generation.
+    """
+    required = [profile.goal, profile.activity_level, profile.gender, profile.age, profile.current_weight, profile.height]
+    if any(value in (None, '') for value in required):
+        return False
+    if get_diet(profile) is None:
+        return False
+    return not (profile.get_allergies_list() or profile.get_medical_conditions_list() or profile.get_disabilities_list())
+
+
+def find_archetype(profile: Profile):
+    """
+    The closest archetype for the profile: an exact match, else the same
+    goal, gender and diet with another age band, else any activity level.
+    Goal and diet always match. Returns None if there is none.
+    """
+    archetypes = PlanArchetype.objects.filter(goal=profile.goal, gender=profile.gender, diet=get_diet(profile))
+    age_band = get_age_band(profile.age)
+    for candidates in (
+        archetypes.filter(activity_level=profile.activity_level, age_band=age_band),
+        archetypes.filter(activity_level=profile.activity_level),
+        archetypes.filter(age_band=age_band),
+        archetypes,
+    ):
+        archetype = candidates.select_related('plan_artifact').first()
+        if archetype:
+            return archetype
+    return None
+
+
+def materialize_archetype_plan(profile: Profile, start_date: date):
+    """
+    Saves the closest archetype, with the profile's nutrition targets and
+    meal portions scaled to them, as the profile's plan starting on
+    start_date. Returns the FitnessPlan, or None if the profile can't use
+    an archetype or none matches.
+    Raises PlanOverlapError if the date range is already covered.
+    """
+    if not can_use_archetype(profile):
+        return None
+    archetype = find_archetype(profile)
+    if archetype is None:
+        return None
+
+    plan_data = GeneratedPlanSchema.model_validate(read_json(archetype.plan_artifact))
+    plan_data = apply_nutrition_targets(plan_data, compute_nutrition_targets(profile))
+    print(f"Using archetype {archetype} for user: {profile.user.username}")
+    return materialize_plan(profile, start_date, plan_data, prompt=f"archetype:{archetype}")
+
+
+def _in_use(plan: FitnessPlan):
+    return (
+        plan.workout_added_to_calendar or plan.nutrition_added_to_calendar
+        or WorkoutTracking.objects.filter(exercise__workout_day__plan=plan).exists()
+        or MealTracking.objects.filter(meal__nutrition_day__plan=plan).exists()
+        or WaterTracking.objects.filter(nutrition_day__plan=plan).exists()
+    )
+
+
+def personalize_plan(plan: FitnessPlan):
+    """
+    Replaces an archetype plan's days with a plan generated for the user.
+    The archetype is kept if the user already put it on their calendar or
+    tracked part of it, or if only the rule-based fallback could answer.
+    Returns the plan, or None if generation failed.
+    """
+    profile = plan.profile
+    if _in_use(plan):
+        print(f"Keeping archetype plan {plan.pk}; it is already in use")
+        return plan
+
+    prompt = build_plan_prompt(profile, plan.start_date)
+    plan_data, backend = get_router().generate(prompt, user=profile.user)
+    if plan_data is None:
+        return None
+    if not backend.cacheable:
+        return plan
+    cache_plan(profile, plan.start_date, plan_data)
+    plan_data = apply_profile_targets(profile, plan_data)
+    with transaction.atomic():
+        plan = FitnessPlan.objects.select_for_update().get(pk=plan.pk)
+        if _in_use(plan):
+            # The user started using the plan while it was being generated
+            return plan
+        print(f"Personalizing archetype plan {plan.pk} for user: {profile.user.username}")
+        return replace_plan_days(plan, plan_data, prompt=prompt)
+
+
+def _archetype_profile(goal, activity_level, gender, age, diet):
+    """An unsaved profile standing in for everyone in an archetype."""
+    weight, height = REFERENCE_BODY[gender]
+    return Profile(
+        goal=goal,
+        activity_level=activity_level,
+        gender=gender,
+        age=age,
+        current_weight=weight,
+        height=height,
+        dietary_preferences=None if diet == 'none' else diet,
+    )
+
+
+def _build_archetype(key, log):
+    goal, activity_level, gender, (age_band, age), diet = key
+    try:
+        profile = _archetype_profile(goal, activity_level, gender, age, diet)
+        today = date.today()
+        prompt = build_plan_prompt(profile, today + timedelta(days=7 - today.weekday()))
+        plan_data, backend = get_router().generate(prompt)
+        if plan_data is None or not backend.cacheable:
+            log(f"Could not generate archetype {goal}/{activity_level}/{gender}/{age_band}/{diet}")
+            return False
+        targets = compute_nutrition_targets(profile)
+        # The meals are stored unscaled; materialize_archetype_plan() scales them to each user
+        PlanArchetype.objects.update_or_create(
+            goal=goal, activity_level=activity_level, gender=gender, age_band=age_band, diet=diet,
+            defaults={
+                'plan_artifact': store_json(plan_data.model_dump(mode='json')),
+                'base_calories': targets['target_calories'],
+                'backend': backend.name,
+            },
+        )
+        log(f"Built archetype {goal}/{activity_level}/{gender}/{age_band}/{diet} with '{backend.name}'")
+        return True
+    except Exception as e:
+        log(f"Error building archetype {goal}/{activity_level}/{gender}/{age_band}/{diet}: {e}")
+        return False
+    finally:
+        close_old_connections()
+
+
+def build_archetypes(goals=None, activity_levels=None, genders=None, diets=None,
+                     overwrite=False, concurrency=None, log=print):
+    """
+    Generates the archetype library. Existing archetypes are kept unless
+    overwrite is set, so an interrupted build can simply be re-run.
+    Returns a summary.
+    """
+    goals = goals or [value for value, _ in Profile._meta.get_field('goal').choices]
+    activity_levels = activity_levels or [value for value, _ in Profile._meta.get_field('activity_level').choices]
+    genders = genders or [value for value, _ in Profile._meta.get_field('gender').choices]
+    diets = diets or ['none'] + DIETS
+    concurrency = concurrency or getattr(settings, 'PLAN_ARCHETYPE_BUILD_CONCURRENCY', 2)
+
+    existing = set(PlanArchetype.objects.values_list('goal', 'activity_level', 'gender', 'age_band', 'diet'))
+    all_keys = [
+        (goal, activity_level, gender, (band, age), diet)
+        for goal in goals
+        for activity_level in activity_levels
+        for gender in genders
+        for _, band, age in AGE_BANDS
+        for diet in diets
+    ]
+    keys = [
+        key for key in all_keys
+        if overwrite or (key[0], key[1], key[2], key[3][0], key[4]) not in existing
+    ]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='plan-archetype') as executor:
+        results = list(executor.map(lambda key: _build_archetype(key, log), keys))
+    return {
+        'built': sum(results),
+        'failed': len(results) - sum(results),
+        'skipped': len(all_keys) - len(keys),
+        'duration_seconds': round(time.monotonic() - started, 2),
+    }
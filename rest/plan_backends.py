@@ -0,0 +1,365 @@
+# rest/plan_backends.py
+"""
+Pluggable plan generator backends and a latency-aware router.
+
+A backend turns a plan prompt into a validated GeneratedPlanSchema. The
+built-in backends are Gemini, the ai_local LocalModel and the rule-based
+fallback plan; others can be added with register_backend() or by listing
+their dotted class path in PLAN_GENERATOR_BACKENDS.
+
+The router tries the configured backends in order of preference, but
+skips backends that are unavailable (Gemini's circuit breaker is open, no
+local model file), cooling down after repeated failures, or whose rolling
+p95 latency is over PLAN_ROUTER_LATENCY_BUDGET_SECONDS while a faster
+backend is healthy. A node can thus serve from the local model while
+Gemini is slow or over quota, and move back once it recovers.
+
+With PLAN_HEDGING_ENABLED, generate_hedged() also starts a secondary
+backend when the preferred one has not answered within its p95 (or
+PLAN_HEDGE_AFTER_SECONDS), and uses whichever valid plan arrives first.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from . import ai_client
+from .ai_telemetry import hedge_attempt, track_ai_call
+from .models import AICallRecord
+from .plan_repair import repair_plan
+from .schemas import GeneratedPlanSchema
+from .wire_schema import plan_generation_schema, to_full_plan
+
+
+class PlanBackend:
+    """
+    The interface of a plan generator backend.
+
+    generate() returns a validated GeneratedPlanSchema, or None (or raises)
+    when it could not produce one. Plans from `cacheable` backends are
+    stored in the plan cache.
+    """
+    name = None
+    cacheable = True
+
+    def is_available(self):
+        return True
+
+    def generate(self, prompt, user=None):
+        raise NotImplementedError
+
+
+_registry = {}
+
+
+def register_backend(cls):
+    """Class decorator adding a backend to the registry under its name."""
+    _registry[cls.name] = cls
+    return cls
+
+
+@register_backend
+class GeminiBackend(PlanBackend):
+    name = 'gemini'
+
+    def is_available(self):
+        return ai_client.breaker.state != ai_client.CircuitBreaker.OPEN
+
+    def generate(self, prompt, user=None):
+        if getattr(settings, 'PLAN_GENERATION_FANOUT', False):
+            from .plan_fanout import generate_plan_data_fanout
+            return generate_plan_data_fanout(prompt, user=user)
+        from .ai_service import generate_plan_data
+        return to_full_plan(generate_plan_data(prompt, user=user, schema=plan_generation_schema()))
+
+
+@register_backend
+class LocalModelBackend(PlanBackend):
+    name = 'local'
+
+    def is_available(self):
+        try:
+            from ai_local.services import LLAMA_CPP_AVAILABLE, get_local_model
+        except ImportError:
+            return False
+        if getattr(settings, 'LOCAL_INFERENCE_URL', ''):
+            # Served by the shared inference server; its health check is cached
+            return get_local_model().is_ready()
+        return LLAMA_CPP_AVAILABLE and os.path.exists(os.path.join(settings.BASE_DIR, 'model.gguf'))
+
+    def generate(self, prompt, user=None):
+        from ai_local.services import get_local_model
+        local_model = get_local_model()
+        with track_ai_call('local', os.path.basename(local_model.model_path), user=user) as call:
+            response_text = local_model.generate_plan(prompt, call=call)
+            if call.outcome == AICallRecord.OUTCOME_FALLBACK:
+                # LocalModel fell back to the canned plan; leave that to the fallback backend
+                return None
+            try:
+                plan_data = GeneratedPlanSchema.model_validate_json(response_text)
+            except ValueError as e:
+                print(f"Invalid plan returned by local model: {e}")
+                plan_data, report = repair_local_plan(response_text)
+                if plan_data is None:
+                    call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                    return None
+                call.set_outcome(AICallRecord.OUTCOME_REPAIRED, report)
+                return plan_data
+            call.set_outcome(AICallRecord.OUTCOME_VALID)
+            return plan_data
+
+
+@register_backend
+class RuleBasedBackend(PlanBackend):
+    name = 'fallback'
+    # Not cached, so the next request for this profile tries the model backends again
+    cacheable = False
+
+    def generate(self, prompt, user=None):
+        from ai_local.services import generate_fallback_plan_data
+        with track_ai_call('fallback', 'rule-based', user=user) as call:
+            plan_data = generate_fallback_plan_data(getattr(user, 'profile', None))
+            call.set_outcome(AICallRecord.OUTCOME_FALLBACK)
+        return plan_data
+
+
+def repair_local_plan(response_text):
+    """
+    Repairs a local model plan that did not validate. Missing days are
+    filled in rather than requested again, since the local model is too
+    slow to ask twice. Returns (plan_data or None, report).
+    """
+    if not getattr(settings, 'PLAN_REPAIR_ENABLED', True):
+        return None, None
+    plan_data, report = repair_plan(response_text or '')
+    if plan_data is not None:
+        print(f"Repaired plan returned by local model: {report}")
+    return plan_data, report
+
+
+def get_backend_class(name):
+    """A registered backend name, or the dotted path of a PlanBackend subclass."""
+    if name in _registry:
+        return _registry[name]
+    return import_string(name)
+
+
+class BackendStats:
+    """
+    Rolling latency and health of one backend in this process. Latency
+    samples expire after `max_age` seconds, so a backend that was slow is
+    tried again once its old samples are gone.
+    """
+
+    def __init__(self, window, max_age):
+        self.latencies = deque(maxlen=window)  # (monotonic time, seconds)
+        self.max_age = max_age
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def p95(self):
+        now = time.monotonic()
+        ordered = sorted(latency for at, latency in self.latencies if now - at <= self.max_age)
+        if not ordered:
+            return None
+        return ordered[max(0, int(len(ordered) * 0.95 + 0.5) - 1)]
+
+
+class HedgeRace:
+    """The first valid plan of a hedged generation."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner = None
+        self.plan_data = None
+
+
+class PlanBackendRouter:
+    """Chooses a backend per request from live health and rolling latency."""
+
+    def __init__(self, backend_names=None, latency_budget=None, failure_threshold=None,
+                 cooldown_seconds=None, window=None, max_age=None):
+        backend_names = backend_names or getattr(settings, 'PLAN_GENERATOR_BACKENDS', ['gemini', 'local', 'fallback'])
+        self.backends = [get_backend_class(name)() for name in backend_names]
+        self.latency_budget = latency_budget or getattr(settings, 'PLAN_ROUTER_LATENCY_BUDGET_SECONDS', 30.0)
+        self.failure_threshold = failure_threshold or getattr(settings, 'PLAN_ROUTER_FAILURE_THRESHOLD', 3)
+        self.cooldown_seconds = cooldown_seconds or getattr(settings, 'PLAN_ROUTER_COOLDOWN_SECONDS', 60.0)
+        window = window or getattr(settings, 'PLAN_ROUTER_LATENCY_WINDOW', 50)
+        max_age = max_age or getattr(settings, 'PLAN_ROUTER_LATENCY_MAX_AGE_SECONDS', 300.0)
+        self.stats = {backend.name: BackendStats(window, max_age) for backend in self.backends}
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, backend):
+        with self._lock:
+            cooling_down = self.stats[backend.name].cooldown_until > time.monotonic()
+        return not cooling_down and backend.is_available()
+
+    def route(self):
+        """
+        The healthy backends in the order they should be tried. A backend
+        whose p95 is over the latency budget moves behind faster ones.
+        """
+        healthy = [backend for backend in self.backends if self._is_healthy(backend)]
+        with self._lock:
+            fast = [b for b in healthy if (self.stats[b.name].p95() or 0) <= self.latency_budget]
+        return fast + [backend for backend in healthy if backend not in fast]
+
+    def record(self, backend, latency, success):
+        with self._lock:
+            stats = self.stats[backend.name]
+            if success:
+                stats.latencies.append((time.monotonic(), latency))
+                stats.consecutive_failures = 0
+                stats.successes += 1
+            else:
+                stats.consecutive_failures += 1
+                stats.failures += 1
+                if stats.consecutive_failures >= self.failure_threshold:
+                    print(f"Plan backend '{backend.name}' failed {stats.consecutive_failures} times, cooling down")
+                    stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+                    stats.consecutive_failures = 0
+
+    def _attempt(self, backend, prompt, user=None):
+        """Runs one backend and records its latency and outcome."""
+        started = time.monotonic()
+        try:
+            plan_data = backend.generate(prompt, user=user)
+        except Exception as e:
+            print(f"Error generating plan with backend '{backend.name}': {e}")
+            plan_data = None
+        self.record(backend, time.monotonic() - started, plan_data is not None)
+        return plan_data
+
+    def _attempt_hedged(self, race, backend, hedge_path, prompt, user=None):
+        """
+        Runs one side of a hedged generation on its own thread and marks its
+        AI call records with hedge_path if its plan wins, or as cancelled if
+        it finishes after the other side won.
+        """
+        record_ids = []
+        try:
+            with hedge_attempt(record_ids):
+                plan_data = self._attempt(backend, prompt, user=user)
+            with race.lock:
+                if plan_data is not None and race.winner is None:
+                    race.winner, race.plan_data = backend, plan_data
+                elif race.winner is None:
+                    hedge_path = None
+                else:
+                    hedge_path = AICallRecord.HEDGE_CANCELLED
+            if hedge_path and record_ids:
+                AICallRecord.objects.filter(pk__in=record_ids).update(hedge_path=hedge_path)
+            return plan_data
+        finally:
+            # Telemetry opened a connection on this hedge thread
+            connection.close()
+
+    def generate(self, prompt, user=None, backends=None):
+        """
+        Generates the plan with the first backend that succeeds.
+        Returns (plan_data, backend), or (None, None) if every backend failed.
+        """
+        for backend in (self.route() if backends is None else backends):
+            plan_data = self._attempt(backend, prompt, user=user)
+            if plan_data is not None:
+                return plan_data, backend
+        return None, None
+
+    def hedge_delay(self, backend):
+        """
+        How long to wait for `backend` before starting the secondary:
+        PLAN_HEDGE_AFTER_SECONDS, or the backend's rolling p95 if unset.
+        """
+        delay = getattr(settings, 'PLAN_HEDGE_AFTER_SECONDS', None)
+        if delay:
+            return delay
+        with self._lock:
+            p95 = self.stats[backend.name].p95()
+        return p95 if p95 is not None else getattr(settings, 'PLAN_HEDGE_DEFAULT_SECONDS', 20.0)
+
+    def _pick_secondary(self, candidates):
+        name = getattr(settings, 'PLAN_HEDGE_BACKEND', None)
+        for backend in candidates:
+            if not name or backend.name == name:
+                return backend
+        return None
+
+    def generate_hedged(self, prompt, user=None, hedge_after=None):
+        """
+        Starts the preferred backend and, if it has not produced a plan
+        within the hedge delay (or failed before it), starts a secondary
+        backend too; the first valid plan wins. The losing call is not
+        interrupted, its result is just ignored. If both fail, the remaining
+        backends are tried in order.
+        Returns (plan_data, backend) like generate().
+        """
+        backends = self.route()
+        secondary = self._pick_secondary(backends[1:])
+        if secondary is None:
+            return self.generate(prompt, user=user, backends=backends)
+        primary = backends[0]
+        hedge_after = hedge_after or self.hedge_delay(primary)
+
+        race = HedgeRace()
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='plan-hedge')
+        try:
+            pending = [executor.submit(
+                self._attempt_hedged, race, primary, AICallRecord.HEDGE_PRIMARY, prompt, user
+            )]
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done or next(iter(done)).result() is None:
+                print(f"Plan backend '{primary.name}' is slow or failed, hedging with '{secondary.name}'")
+                pending.append(executor.submit(
+                    self._attempt_hedged, race, secondary, AICallRecord.HEDGE_SECONDARY, prompt, user
+                ))
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    if future.result() is not None:
+                        # Both may have finished; the race decides which plan is used
+                        return race.plan_data, race.winner
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        print("Both hedged backends failed")
+
+        remaining = [backend for backend in backends if backend not in (primary, secondary)]
+        return self.generate(prompt, user=user, backends=remaining)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                name: {
+                    'successes': s.successes,
+                    'failures': s.failures,
+                    'p95_seconds': round(s.p95(), 3) if s.p95() is not None else None,
+                    'consecutive_failures': s.consecutive_failures,
+                    'cooling_down': s.cooldown_until > time.monotonic(),
+                }
+                for name, s in self.stats.items()
+            }
+        for backend in self.backends:
+            stats[backend.name]['available'] = backend.is_available()
+        return stats
+
+
+# Global router for this process
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Get or create the plan backend router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = PlanBackendRouter()
+    return _router
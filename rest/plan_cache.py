@@ -0,0 +1,120 @@
+# rest/plan_cache.py
+"""
+Caches generated plans by a fingerprint of the prompt-relevant profile fields.
+
+Users with the same age bucket, gender, goal, activity level, body size
+bucket, food preferences and start weekday get the same prompt in all but
+name, so a validated plan generated for one of them is reused for the rest.
+
+Entries live in the Django cache named by PLAN_CACHE_ALIAS. The default
+LocMemCache expires entries after TIMEOUT seconds and culls the least
+recently used ones past MAX_ENTRIES; point the alias at a shared backend
+(database or Redis) to share the cache between processes.
+"""
+import hashlib
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Profile
+from .schemas import GeneratedPlanSchema
+
+KEY_PREFIX = 'plan-response'
+HITS_KEY = f'{KEY_PREFIX}:stats:hits'
+MISSES_KEY = f'{KEY_PREFIX}:stats:misses'
+
+
+def _get_cache():
+    return caches[getattr(settings, 'PLAN_CACHE_ALIAS', 'plan_responses')]
+
+
+def _is_enabled():
+    return getattr(settings, 'PLAN_CACHE_ENABLED', True)
+
+
+def _bucket(value, size):
+    """Rounds a number down to its bucket so nearby values share a key."""
+    if value is None:
+        return None
+    return int(value // size * size)
+
+
+def _normalize_list(values):
+    return sorted({value.lower() for value in values})
+
+
+def profile_fingerprint(user_profile: Profile, start_date: date):
+    """A stable hash of everything in the profile that shapes the generated plan."""
+    fields = {
+        'age': _bucket(user_profile.age, 5),
+        'weight': _bucket(user_profile.current_weight, 5),
+        'height': _bucket(user_profile.height, 5),
+        'gender': user_profile.gender,
+        'goal': user_profile.goal,
+        'activity_level': user_profile.activity_level,
+        'dietary_preferences': _normalize_list(user_profile.get_dietary_preferences_list()),
+        'allergies': _normalize_list(user_profile.get_allergies_list()),
+        'liked_foods': _normalize_list(user_profile.get_liked_foods_list()),
+        'disliked_foods': _normalize_list(user_profile.get_disliked_foods_list()),
+        'disabilities': _normalize_list(user_profile.get_disabilities_list()),
+        'medical_conditions': _normalize_list(user_profile.get_medical_conditions_list()),
+        'start_weekday': start_date.isoweekday(),
+    }
+    payload = json.dumps(fields, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _incr(key):
+    cache = _get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_cached_plan(user_profile: Profile, start_date: date):
+    """Returns the cached GeneratedPlanSchema for this profile, or None."""
+    if not _is_enabled():
+        return None
+
+    cached = _get_cache().get(f'{KEY_PREFIX}:{profile_fingerprint(user_profile, start_date)}')
+    if cached is None:
+        _incr(MISSES_KEY)
+        return None
+
+    try:
+        plan_data = GeneratedPlanSchema.model_validate_json(cached)
+    except ValueError as e:
+        print(f"Discarding invalid cached plan: {e}")
+        _incr(MISSES_KEY)
+        return None
+    _incr(HITS_KEY)
+    return plan_data
+
+
+def cache_plan(user_profile: Profile, start_date: date, plan_data: GeneratedPlanSchema):
+    """Stores a validated plan under this profile's fingerprint."""
+    if not _is_enabled():
+        return
+    _get_cache().set(
+        f'{KEY_PREFIX}:{profile_fingerprint(user_profile, start_date)}',
+        plan_data.model_dump_json()
+    )
+
+
+def get_plan_cache_stats():
+    """Hit and miss counters for the plan cache."""
+    cache = _get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'enabled': _is_enabled(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / lookups, 4) if lookups else None,
+    }
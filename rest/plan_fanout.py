@@ -0,0 +1,136 @@
+# rest/plan_fanout.py
+"""
+Fan-out plan generation.
+
+Instead of one request that writes the whole plan token by token, the
+workout days and the nutrition days (optionally split further into day
+ranges) are requested from Gemini at the same time on a bounded thread
+pool, validated separately and merged into one GeneratedPlanSchema.
+Wall-clock time approaches that of the slowest shard.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from . import ai_client
+from .ai_telemetry import track_ai_call
+from .models import AICallRecord
+from .ai_service import GEMINI_MODEL, build_generation_config, request_missing_days
+from .nutrition_targets import nutrition_targets_enabled
+from .plan_repair import ALL_DAYS
+from .schemas import (
+    GeneratedPlanSchema, GeneratedWorkoutDaysSchema, GeneratedNutritionDaysSchema, GeneratedNutritionMealsSchema
+)
+
+SHARD_SCHEMAS = {
+    'workout_days': GeneratedWorkoutDaysSchema,
+    'nutrition_days': GeneratedNutritionDaysSchema,
+}
+
+
+def get_shard_schema(field):
+    if field == 'nutrition_days' and nutrition_targets_enabled():
+        return GeneratedNutritionMealsSchema
+    return SHARD_SCHEMAS[field]
+
+SHARD_INSTRUCTIONS = {
+    'workout_days': "Only generate the workout plan ('workout_days'); the nutrition plan is generated separately.",
+    'nutrition_days': "Only generate the nutrition plan ('nutrition_days'); the workout plan is generated separately.",
+}
+
+
+def split_days(day_splits):
+    """Splits the weekdays 1-7 into day_splits contiguous ranges."""
+    day_splits = max(1, min(day_splits, 7))
+    size, extra = divmod(7, day_splits)
+    ranges = []
+    first = 1
+    for index in range(day_splits):
+        last = first + size - 1 + (1 if index < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def build_shards(prompt: str, day_splits: int):
+    """Returns (field, days, prompt) for every sub-request."""
+    shards = []
+    for field, instruction in SHARD_INSTRUCTIONS.items():
+        for first, last in split_days(day_splits):
+            shard_prompt = f"{prompt}\n    - {instruction}"
+            if (first, last) != (1, 7):
+                shard_prompt += (
+                    f"\n    - Only include days with day_of_week from {first} to {last}; "
+                    "the other days are generated separately."
+                )
+            shards.append((field, set(range(first, last + 1)), shard_prompt))
+    return shards
+
+
+def _generate_shard(field, days, shard_prompt, user=None):
+    try:
+        with track_ai_call('gemini', GEMINI_MODEL, user=user, purpose='plan-shard') as call:
+            response = ai_client.generate_content(
+                model=GEMINI_MODEL,
+                contents=shard_prompt,
+                config=build_generation_config(get_shard_schema(field)),
+                call=call,
+            )
+            call.set_gemini_usage(response)
+            try:
+                shard = get_shard_schema(field).model_validate_json(response.text)
+            except ValueError as e:
+                call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                raise
+            call.set_outcome(AICallRecord.OUTCOME_VALID)
+    finally:
+        # The telemetry write opened a connection on this pool thread
+        connection.close()
+    return [day for day in getattr(shard, field) if day.day_of_week in days]
+
+
+def generate_plan_data_fanout(prompt: str, day_splits: int = None, max_workers: int = None, user=None):
+    """
+    Generates the plan as parallel sub-requests and merges the validated parts.
+    Days a shard left out are requested again, as in repair_plan().
+    Returns None if any shard fails, the shards overlap or days are still
+    missing.
+    """
+    day_splits = day_splits or getattr(settings, 'PLAN_FANOUT_DAY_SPLITS', 1)
+    max_workers = max_workers or getattr(settings, 'PLAN_FANOUT_MAX_WORKERS', 4)
+    shards = build_shards(prompt, day_splits)
+
+    merged = {field: [] for field in SHARD_SCHEMAS}
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(shards)), thread_name_prefix='plan-fanout')
+    failed = False
+    try:
+        futures = [(shard[0], executor.submit(_generate_shard, *shard, user=user)) for shard in shards]
+        for field, future in futures:
+            try:
+                merged[field].extend(future.result())
+            except Exception as e:
+                print(f"Error generating {field} shard: {e}")
+                failed = True
+                return None
+    finally:
+        # On failure, don't wait for the shard calls still in flight
+        executor.shutdown(wait=not failed, cancel_futures=failed)
+
+    for field, days in merged.items():
+        days.sort(key=lambda day: day.day_of_week)
+        if len({day.day_of_week for day in days}) != len(days):
+            print(f"Duplicate days in generated {field}")
+            return None
+        missing = sorted(ALL_DAYS - {day.day_of_week for day in days})
+        if missing:
+            regenerated = request_missing_days(prompt, user=user)(field, missing) or []
+            days.extend(day for day in regenerated if day.day_of_week in missing)
+            days.sort(key=lambda day: day.day_of_week)
+        if [day.day_of_week for day in days] != sorted(ALL_DAYS):
+            print(f"Missing days in generated {field}: {sorted(ALL_DAYS - {day.day_of_week for day in days})}")
+            return None
+
+    return GeneratedPlanSchema.model_validate(
+        {field: [day.model_dump() for day in days] for field, days in merged.items()}
+    )
@@ -0,0 +1,325 @@
+# rest/plan_jobs.py
+"""
+A small DB-backed job queue for plan generation.
+
+POST users/me/plans only enqueues a PlanGenerationJob; a pool of worker
+threads claims queued jobs and runs the (slow) generation outside of the
+request/response cycle. The queue lives in the database, so no outside
+broker is needed and several processes can share it safely.
+
+A job also acts as a single-flight lock: a unique constraint allows only
+one active job per (profile, start_date), so a double tap or client retry
+attaches to the generation already in flight instead of starting another.
+
+A running job holds a lease that its worker keeps renewing (job_lease());
+only jobs whose lease has expired, because their worker died, are put
+back on the queue.
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import PlanGenerationJob
+
+SINGLE_FLIGHT_CONSTRAINT = 'unique_active_plan_job'
+
+
+def lease_seconds():
+    return getattr(settings, 'PLAN_JOB_LEASE_SECONDS', 900)
+
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=lease_seconds())
+
+
+def _get_generator():
+    # Imported lazily so the generator module (and its API client) is only
+    # loaded when a job actually runs. The backend (Gemini, local model or
+    # rule-based fallback) is picked per plan by rest/plan_backends.py.
+    from .ai_service import generate_and_save_plan_for_user
+    return generate_and_save_plan_for_user
+
+
+def _violates_single_flight(error):
+    """Whether an IntegrityError comes from the one-active-job constraint."""
+    constraint = getattr(getattr(error.__cause__, 'diag', None), 'constraint_name', None)
+    if constraint:
+        return constraint == SINGLE_FLIGHT_CONSTRAINT
+    # SQLite names the columns instead of the constraint, e.g. "UNIQUE
+    # constraint failed: rest_plangenerationjob.profile_id, ...start_date"
+    message = str(error)
+    return (
+        'UNIQUE' in message and PlanGenerationJob._meta.db_table in message
+        and 'profile_id' in message and 'start_date' in message
+    )
+
+
+def acquire_plan_job(profile, start_date, **fields):
+    """
+    Creates the active job for (profile, start_date), or returns the one
+    already in flight. Returns (job, created).
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return PlanGenerationJob.objects.create(profile=profile, start_date=start_date, **fields), True
+        except IntegrityError as e:
+            if not _violates_single_flight(e):
+                raise
+            existing = PlanGenerationJob.objects.filter(
+                profile=profile,
+                start_date=start_date,
+                status__in=PlanGenerationJob.ACTIVE_STATUSES,
+            ).first()
+            if existing:
+                return existing, False
+            if attempt:
+                raise
+            # The other job finished in the meantime; try once more.
+
+
+def enqueue_plan_job(profile, start_date, plan=None):
+    """
+    Queues a plan generation job and wakes up the embedded workers.
+    Returns (job, created); created is False when an identical job was
+    already in flight and the caller was attached to it.
+    A job queued with an (archetype) plan personalizes that plan instead
+    of creating a new one.
+    """
+    job, created = acquire_plan_job(profile, start_date, plan=plan)
+    if created and getattr(settings, 'PLAN_JOB_EMBEDDED_WORKERS', True):
+        get_worker_pool().wake()
+    return job, created
+
+
+def wait_for_job(job, timeout=None, poll_interval=1.0):
+    """
+    Blocks until the job has finished or the timeout expires, and returns
+    the refreshed job.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        job.refresh_from_db()
+        if job.status not in PlanGenerationJob.ACTIVE_STATUSES:
+            return job
+        if deadline and time.monotonic() >= deadline:
+            return job
+        time.sleep(poll_interval)
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claims the oldest queued job for this worker.
+    Uses a conditional UPDATE as a compare-and-swap, so it works the same
+    on SQLite and PostgreSQL and two workers never claim the same job.
+    """
+    candidate_ids = PlanGenerationJob.objects.filter(
+        status=PlanGenerationJob.STATUS_QUEUED
+    ).order_by('created_at').values_list('id', flat=True)[:10]
+
+    for job_id in candidate_ids:
+        claimed = PlanGenerationJob.objects.filter(
+            pk=job_id, status=PlanGenerationJob.STATUS_QUEUED
+        ).update(
+            status=PlanGenerationJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+            lease_expires_at=_lease_expiry(),
+            worker_id=worker_id,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PlanGenerationJob.objects.select_related('profile__user').get(pk=job_id)
+    return None
+
+
+def _renew_lease(job):
+    PlanGenerationJob.objects.filter(
+        pk=job.pk, status=PlanGenerationJob.STATUS_RUNNING, worker_id=job.worker_id
+    ).update(
+        lease_expires_at=_lease_expiry()
+    )
+
+
+@contextmanager
+def job_lease(job):
+    """
+    Keeps renewing the lease of a running job for the duration of the
+    block, so requeue_stale_jobs() leaves it alone however long it takes.
+    """
+    _renew_lease(job)
+    stop = threading.Event()
+
+    def heartbeat():
+        try:
+            while not stop.wait(lease_seconds() / 3):
+                _renew_lease(job)
+        except Exception as e:
+            print(f"Error renewing the lease of plan job {job.pk}: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=heartbeat, name=f"plan-job-{job.pk}-lease", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def requeue_stale_jobs():
+    """
+    Puts running jobs whose lease expired (their worker died mid-run) back
+    on the queue, or fails them once they have used up their attempts.
+    """
+    max_attempts = getattr(settings, 'PLAN_JOB_MAX_ATTEMPTS', 2)
+    now = timezone.now()
+    stale = PlanGenerationJob.objects.filter(status=PlanGenerationJob.STATUS_RUNNING).filter(
+        Q(lease_expires_at__lt=now)
+        # Started without a lease and never renewed
+        | Q(lease_expires_at__isnull=True, started_at__lt=now - timedelta(seconds=lease_seconds()))
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=PlanGenerationJob.STATUS_FAILED,
+        error="The job timed out.",
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=PlanGenerationJob.STATUS_QUEUED,
+        worker_id=None,
+        lease_expires_at=None,
+    )
+    return requeued, failed
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records its outcome. A personalization job that
+    fails still succeeds with its archetype plan, and its error says so.
+    """
+    print(f"Running plan job {job.pk} for user: {job.profile.user.username}")
+    try:
+        with job_lease(job):
+            if job.plan_id:
+                from .plan_archetypes import personalize_plan
+                plan = personalize_plan(job.plan)
+            else:
+                plan = _get_generator()(job.profile, job.start_date)
+    except Exception as e:
+        print(f"Error running plan job {job.pk}: {e}")
+        plan = None
+        error = str(e)
+    else:
+        error = None if plan else "Failed to generate fitness plan."
+
+    if plan is None and job.plan_id:
+        # The archetype plan was saved before the job ran and is still usable
+        plan, error = job.plan, f"The plan could not be personalized: {error}"
+    return finish_job(job, plan, error)
+
+
+def finish_job(job, plan, error=None):
+    """
+    Records the outcome of a job, which releases its single-flight lock.
+    Only the worker still holding the job can finish it: if its lease
+    expired and the job was requeued (or failed) meanwhile, the outcome is
+    dropped and the job is returned as it now stands.
+    """
+    finished = PlanGenerationJob.objects.filter(
+        pk=job.pk, status=PlanGenerationJob.STATUS_RUNNING, worker_id=job.worker_id
+    ).update(
+        plan=plan,
+        status=PlanGenerationJob.STATUS_SUCCEEDED if plan else PlanGenerationJob.STATUS_FAILED,
+        error=error,
+        finished_at=timezone.now(),
+    )
+    if not finished:
+        print(f"Plan job {job.pk} was taken over after its lease expired; dropping the outcome of {job.worker_id}")
+    job.refresh_from_db()
+    return job
+
+
+class PlanJobWorkerPool:
+    """
+    A fixed number of worker threads that poll the job table.
+    The number of threads is the generation concurrency of this process.
+    """
+
+    def __init__(self, workers=None, poll_interval=None):
+        self.workers = workers or getattr(settings, 'PLAN_JOB_WORKERS', 2)
+        self.poll_interval = poll_interval or getattr(settings, 'PLAN_JOB_POLL_INTERVAL', 1.0)
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            base_id = f"{socket.gethostname()}-{os.getpid()}"
+            self._threads = [
+                threading.Thread(
+                    target=self._work,
+                    args=(f"{base_id}-{index}",),
+                    name=f"plan-job-worker-{index}",
+                    daemon=True,
+                )
+                for index in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        print(f"Started {self.workers} plan job worker(s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self.start()
+        self._wakeup.set()
+
+    def _work(self, worker_id):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                requeue_stale_jobs()
+                job = claim_next_job(worker_id)
+                if job:
+                    run_job(job)
+                    continue
+            except Exception as e:
+                print(f"Plan job worker {worker_id} error: {e}")
+            finally:
+                close_old_connections()
+
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+# Global worker pool for this process
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Get or create the worker pool for this process"""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = PlanJobWorkerPool()
+    return _worker_pool
@@ -0,0 +1,150 @@
+# rest/plan_materializer.py
+"""
+Persists a validated GeneratedPlanSchema as a FitnessPlan and its child rows.
+
+The whole tree is written with one INSERT for the plan and one bulk INSERT
+per child table, so the number of queries stays constant no matter how many
+days, exercises or meals the generator produced. The prompt and the raw
+response are stored as deduplicated artifacts (rest/ai_artifacts.py).
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from .models import Profile, FitnessPlan, WorkoutDay, Exercise, NutritionDay, Meal
+from .ai_artifacts import store_text, store_json
+from .schemas import GeneratedPlanSchema
+
+
+class PlanOverlapError(Exception):
+    """Raised when a plan already exists for the selected date range."""
+
+    def __init__(self, message="A plan already exists for the selected date range."):
+        super().__init__(message)
+
+
+def find_overlapping_plans(user_profile: Profile, start_date: date):
+    """Plans of this profile that already cover start_date."""
+    return FitnessPlan.objects.filter(
+        profile=user_profile,
+        start_date__lte=start_date,
+        end_date__gte=start_date
+    )
+
+
+def _ensure_pks(objs, model, plan):
+    """
+    Backends that cannot return ids from a bulk insert leave pk unset;
+    look the rows up by their (plan, day_of_week) unique key instead.
+    """
+    if all(obj.pk for obj in objs):
+        return
+    pks = dict(model.objects.filter(plan=plan).values_list('day_of_week', 'pk'))
+    for obj in objs:
+        obj.pk = pks[obj.day_of_week]
+
+
+@transaction.atomic
+def materialize_plan(user_profile: Profile, start_date: date, plan_data: GeneratedPlanSchema,
+                     end_date: date = None, prompt: str = '', response_raw=None):
+    """
+    Writes a generated plan to the database and returns the new FitnessPlan.
+
+    The overlap check from me_plans is repeated here, inside the write
+    transaction, because the slow generation ran after the view checked.
+    The profile row is locked (on backends that support it) so two
+    concurrent writes for the same profile are serialized.
+    Raises PlanOverlapError if the date range is already covered.
+    """
+    Profile.objects.select_for_update().only('pk').get(pk=user_profile.pk)
+    if find_overlapping_plans(user_profile, start_date).exists():
+        raise PlanOverlapError()
+
+    new_plan = FitnessPlan.objects.create(
+        profile=user_profile,
+        start_date=start_date,
+        end_date=end_date or start_date + timedelta(days=6),
+        goal_at_creation=user_profile.goal,
+        ai_prompt_artifact=store_text(prompt),
+        ai_response_artifact=store_json(response_raw if response_raw is not None else plan_data.model_dump(mode='json'))
+    )
+
+    _create_plan_days(new_plan, plan_data)
+
+    return new_plan
+
+
+def _create_plan_days(plan: FitnessPlan, plan_data: GeneratedPlanSchema):
+    """Bulk inserts the workout and nutrition days of a plan with their children."""
+    # Workout Days and Exercises
+    workout_days = WorkoutDay.objects.bulk_create([
+        WorkoutDay(
+            plan=plan,
+            day_of_week=wd_data.day_of_week,
+            title=wd_data.title,
+            description=wd_data.description or '',
+            is_rest_day=wd_data.is_rest_day
+        )
+        for wd_data in plan_data.workout_days
+    ])
+    _ensure_pks(workout_days, WorkoutDay, plan)
+    Exercise.objects.bulk_create([
+        Exercise(
+            workout_day=workout_day,
+            name=ex_data.name,
+            sets=ex_data.sets,
+            reps=ex_data.reps,
+            duration_mins=ex_data.duration_mins,
+            met_value=ex_data.met_value,
+            rest_period_seconds=ex_data.rest_period_seconds,
+            notes=ex_data.notes
+        )
+        for workout_day, wd_data in zip(workout_days, plan_data.workout_days)
+        for ex_data in wd_data.exercises
+    ])
+
+    # Nutrition Days and Meals
+    nutrition_days = NutritionDay.objects.bulk_create([
+        NutritionDay(
+            plan=plan,
+            day_of_week=nd_data.day_of_week,
+            notes=nd_data.notes,
+            target_calories=nd_data.target_calories,
+            target_protein_grams=nd_data.target_protein_grams,
+            target_carbs_grams=nd_data.target_carbs_grams,
+            target_fats_grams=nd_data.target_fats_grams,
+            target_water_litres=nd_data.target_water_litres
+        )
+        for nd_data in plan_data.nutrition_days
+    ])
+    _ensure_pks(nutrition_days, NutritionDay, plan)
+    Meal.objects.bulk_create([
+        Meal(
+            nutrition_day=nutrition_day,
+            meal_type=meal_data.meal_type,
+            description=meal_data.description,
+            calories=meal_data.calories,
+            protein_grams=meal_data.protein_grams,
+            carbs_grams=meal_data.carbs_grams,
+            fats_grams=meal_data.fats_grams,
+            portion_size=meal_data.portion_size
+        )
+        for nutrition_day, nd_data in zip(nutrition_days, plan_data.nutrition_days)
+        for meal_data in nd_data.meals
+    ])
+
+
+@transaction.atomic
+def replace_plan_days(plan: FitnessPlan, plan_data: GeneratedPlanSchema, prompt: str = ''):
+    """
+    Replaces all days, exercises and meals of an existing plan with
+    plan_data, keeping the plan row (and its id) itself.
+    """
+    FitnessPlan.objects.select_for_update().only('pk').get(pk=plan.pk)
+    plan.workout_days.all().delete()
+    plan.nutrition_days.all().delete()
+    _create_plan_days(plan, plan_data)
+    plan.ai_prompt_artifact = store_text(prompt)
+    plan.ai_response_artifact = store_json(plan_data.model_dump(mode='json'))
+    plan.save(update_fields=['ai_prompt_artifact', 'ai_response_artifact'])
+    return plan
@@ -0,0 +1,315 @@
+# rest/plan_regeneration.py
+"""
+Regenerates a single workout day, nutrition day or meal of an existing plan.
+
+Instead of a full 7-day generation, a short prompt asks for just the one
+part (with the rest of the plan as context, so it is not repeated) using
+the matching schema subset. Only the affected rows are rewritten:
+
+- A workout day keeps its row and calendar event; its exercises are replaced.
+- A nutrition day keeps its row; meals are updated in place, matched by
+  meal type, so they keep their ids and calendar events. Extra meals are
+  added and meals no longer in the day are removed.
+- A meal is updated in place.
+
+Gemini is asked for just the part. When it fails or the router
+(rest/plan_backends.py) skips it, the next routed backend (the local model
+or the rule-based plan) generates a whole plan for the profile and the
+part is taken from it, as in a full generation.
+
+Parts the user already logged progress on (workout or meal tracking) are
+not regenerated, since replacing their rows would drop or repoint the
+tracking records; RegenerationConflict is raised instead.
+
+The user's Google Calendar is then updated to match, where the plan is on it.
+"""
+from django.db import transaction
+
+from .ai_service import build_plan_prompt, build_user_details, generate_plan_data, release_db_connection
+from .google_calender_service import sync_regenerated_events
+from .models import WorkoutDay, Exercise, NutritionDay, Meal, WorkoutTracking, MealTracking
+from .plan_backends import get_router, GeminiBackend
+from .plan_repair import normalize_meal_type
+from .nutrition_targets import (
+    compute_nutrition_targets, nutrition_targets_enabled, prompt_targets_line, apply_nutrition_targets
+)
+from .schemas import GeneratedPlanSchema, WorkoutDaySchema, NutritionDaySchema, NutritionDayMealsSchema, MealSchema
+
+
+class RegenerationError(Exception):
+    """Raised when the model could not produce the replacement."""
+
+    def __init__(self, message="Failed to regenerate this part of the plan."):
+        super().__init__(message)
+
+
+class RegenerationConflict(Exception):
+    """Raised when the part to regenerate already has tracking records."""
+
+    def __init__(self, message="This part of the plan already has logged progress and can't be regenerated."):
+        super().__init__(message)
+
+
+def _check_untracked(tracking):
+    if tracking.exists():
+        raise RegenerationConflict()
+
+
+def _describe_workout_days(plan, exclude=None):
+    return "\n".join(
+        f"    - Day {wd.day_of_week}: {wd.title}"
+        + ("" if wd.is_rest_day else f" ({', '.join(ex.name for ex in wd.exercises.all())})")
+        for wd in plan.workout_days.prefetch_related('exercises') if wd.pk != exclude
+    )
+
+
+def _describe_meals(nutrition_day, exclude=None):
+    return "\n".join(
+        f"    - {meal.meal_type}: {meal.description} ({meal.calories} kcal)"
+        for meal in nutrition_day.meals.all() if meal.pk != exclude
+    )
+
+
+def _feedback_line(feedback):
+    return f"\n    - The user's feedback on the current version: {feedback}" if feedback else ""
+
+
+def build_workout_day_prompt(workout_day, feedback=''):
+    plan = workout_day.plan
+    return f"""
+    Generate a replacement for one day of a user's existing weekly workout plan in Ghana.
+    The response MUST be a valid JSON object for a single workout day that adheres to the provided schema.
+
+    {build_user_details(plan.profile)}
+
+    The other days of the plan (do not repeat them):
+{_describe_workout_days(plan, exclude=workout_day.pk)}
+
+    The day being replaced:
+    - Day {workout_day.day_of_week}: {workout_day.title}
+
+    Instructions:
+    - Use day_of_week {workout_day.day_of_week}.
+    - The workout should include exercises that require minimal or no gym equipment.
+    - For rest days, the 'exercises' list should be empty.{_feedback_line(feedback)}
+    """
+
+
+def build_nutrition_day_prompt(nutrition_day, feedback='', targets=None):
+    plan = nutrition_day.plan
+    if targets:
+        targets_line = prompt_targets_line(targets)
+    else:
+        targets_line = f"\n    - Keep the daily targets close to {nutrition_day.target_calories or 'appropriate'} kcal."
+    return f"""
+    Generate a replacement for one day of a user's existing weekly nutrition plan in Ghana.
+    The response MUST be a valid JSON object for a single nutrition day that adheres to the provided schema.
+
+    {build_user_details(plan.profile)}
+
+    The current meals of this day (replace them with different ones):
+{_describe_meals(nutrition_day)}
+
+    Instructions:
+    - Use day_of_week {nutrition_day.day_of_week}.
+    - The meals must focus on common, accessible Ghanaian foods.{targets_line}{_feedback_line(feedback)}
+    """
+
+
+def build_meal_prompt(meal, feedback=''):
+    nutrition_day = meal.nutrition_day
+    return f"""
+    Generate a replacement for one meal of a user's existing nutrition plan in Ghana.
+    The response MUST be a valid JSON object for a single meal that adheres to the provided schema.
+
+    {build_user_details(nutrition_day.plan.profile)}
+
+    The other meals of the day:
+{_describe_meals(nutrition_day, exclude=meal.pk)}
+
+    The meal being replaced:
+    - {meal.meal_type}: {meal.description} ({meal.calories} kcal)
+
+    Instructions:
+    - Use meal_type '{meal.meal_type}' and about {meal.calories} kcal.
+    - The meal must be a common, accessible Ghanaian food and differ from the one being replaced.{_feedback_line(feedback)}
+    """
+
+
+def _generate(prompt, plan, schema, purpose, extract):
+    """
+    The replacement from the first routed backend that produces one. Gemini
+    gets `prompt` and `schema`; other backends generate a whole plan for
+    the profile, from which `extract` picks the part (or None).
+    """
+    user = plan.profile.user
+    release_db_connection()
+    router = get_router()
+    for backend in router.route():
+        if backend.name == GeminiBackend.name:
+            data = generate_plan_data(prompt, user=user, schema=schema, purpose=purpose)
+        else:
+            plan_data, _ = router.generate(
+                build_plan_prompt(plan.profile, plan.start_date), user=user, backends=[backend]
+            )
+            data = extract(plan_data) if plan_data is not None else None
+            if data is not None:
+                print(f"Regenerated {purpose} from the '{backend.name}' backend's plan")
+        if data is not None:
+            return data
+    raise RegenerationError()
+
+
+def _find_day(days, day_of_week):
+    return next((day for day in days if day.day_of_week == day_of_week), None)
+
+
+def _sync_calendar(user, plan, **changes):
+    """Calendar updates are best effort; the regenerated rows are already saved."""
+    try:
+        sync_regenerated_events(user, plan, **changes)
+    except Exception as e:
+        print(f"Error syncing regenerated plan to Google Calendar: {e}")
+
+
+def _apply_meal(meal, meal_data):
+    meal.description = meal_data.description
+    meal.calories = meal_data.calories
+    meal.protein_grams = meal_data.protein_grams
+    meal.carbs_grams = meal_data.carbs_grams
+    meal.fats_grams = meal_data.fats_grams
+    meal.portion_size = meal_data.portion_size
+
+
+MEAL_FIELDS = ['description', 'calories', 'protein_grams', 'carbs_grams', 'fats_grams', 'portion_size']
+
+
+def regenerate_workout_day(workout_day: WorkoutDay, feedback=''):
+    """
+    Replaces a workout day's content and exercises. Returns the updated day.
+    Raises RegenerationError if the model call fails, RegenerationConflict
+    if any of its exercises were tracked.
+    """
+    plan = workout_day.plan
+    user = plan.profile.user
+    tracking = WorkoutTracking.objects.filter(exercise__workout_day=workout_day.pk)
+    _check_untracked(tracking)
+    day_data = _generate(
+        build_workout_day_prompt(workout_day, feedback), plan, WorkoutDaySchema, 'regen-workout-day',
+        lambda plan_data: _find_day(plan_data.workout_days, workout_day.day_of_week),
+    )
+
+    with transaction.atomic():
+        workout_day = WorkoutDay.objects.select_for_update().get(pk=workout_day.pk)
+        # Tracked while the replacement was being generated
+        _check_untracked(tracking)
+        workout_day.title = day_data.title
+        workout_day.description = day_data.description or ''
+        workout_day.is_rest_day = day_data.is_rest_day
+        workout_day.save(update_fields=['title', 'description', 'is_rest_day'])
+        workout_day.exercises.all().delete()
+        Exercise.objects.bulk_create([
+            Exercise(
+                workout_day=workout_day,
+                name=ex_data.name,
+                sets=ex_data.sets,
+                met_value=ex_data.met_value,
+                duration_mins=ex_data.duration_mins,
+                reps=ex_data.reps,
+                rest_period_seconds=ex_data.rest_period_seconds,
+                notes=ex_data.notes
+            )
+            for ex_data in ([] if day_data.is_rest_day else day_data.exercises)
+        ])
+
+    _sync_calendar(user, plan, workout_days=[workout_day])
+    return workout_day
+
+
+def regenerate_nutrition_day(nutrition_day: NutritionDay, feedback=''):
+    """
+    Replaces a nutrition day's targets and meals. Returns the updated day.
+    Raises RegenerationError if the model call fails, RegenerationConflict
+    if any of its meals were tracked.
+    """
+    plan = nutrition_day.plan
+    user = plan.profile.user
+    tracking = MealTracking.objects.filter(meal__nutrition_day=nutrition_day.pk)
+    _check_untracked(tracking)
+    targets = compute_nutrition_targets(plan.profile) if nutrition_targets_enabled() else None
+    prompt = build_nutrition_day_prompt(nutrition_day, feedback, targets)
+    day_data = _generate(
+        prompt, plan, NutritionDayMealsSchema if targets else NutritionDaySchema, 'regen-nutrition-day',
+        lambda plan_data: _find_day(plan_data.nutrition_days, nutrition_day.day_of_week),
+    )
+    if targets:
+        plan_data = GeneratedPlanSchema.model_validate({'workout_days': [], 'nutrition_days': [day_data.model_dump()]})
+        day_data = apply_nutrition_targets(plan_data, targets).nutrition_days[0]
+
+    with transaction.atomic():
+        nutrition_day = NutritionDay.objects.select_for_update().get(pk=nutrition_day.pk)
+        _check_untracked(tracking)
+        nutrition_day.target_calories = day_data.target_calories
+        nutrition_day.target_protein_grams = day_data.target_protein_grams
+        nutrition_day.target_carbs_grams = day_data.target_carbs_grams
+        nutrition_day.target_fats_grams = day_data.target_fats_grams
+        nutrition_day.target_water_litres = day_data.target_water_litres
+        nutrition_day.notes = day_data.notes
+        nutrition_day.save()
+
+        # Reuse the existing meal rows by meal type, so their calendar events stay linked
+        existing = list(nutrition_day.meals.order_by('pk'))
+        updated, created = [], []
+        for meal_data in day_data.meals:
+            # The schema doesn't restrict meal_type to the model's choices
+            meal_type = normalize_meal_type(meal_data.meal_type)
+            meal = next((m for m in existing if m.meal_type == meal_type), None)
+            if meal:
+                existing.remove(meal)
+                _apply_meal(meal, meal_data)
+                updated.append(meal)
+            else:
+                meal = Meal(nutrition_day=nutrition_day, meal_type=meal_type)
+                _apply_meal(meal, meal_data)
+                created.append(meal)
+        Meal.objects.bulk_update(updated, MEAL_FIELDS)
+        created = Meal.objects.bulk_create(created)
+        removed_event_ids = [meal.google_calendar_event_id for meal in existing if meal.google_calendar_event_id]
+        Meal.objects.filter(pk__in=[meal.pk for meal in existing]).delete()
+
+    if not all(meal.pk for meal in created):
+        # Backends that cannot return ids from a bulk insert; events need saved rows
+        created = list(nutrition_day.meals.exclude(pk__in=[meal.pk for meal in updated]))
+    _sync_calendar(user, plan, meals=updated + created, removed_event_ids=removed_event_ids)
+    return nutrition_day
+
+
+def _meal_extractor(meal):
+    """Picks the meal of the same day and type from a whole plan."""
+    def extract(plan_data):
+        day = _find_day(plan_data.nutrition_days, meal.nutrition_day.day_of_week)
+        meals = [m for m in (day.meals if day else []) if normalize_meal_type(m.meal_type) == meal.meal_type]
+        return meals[0] if meals else None
+    return extract
+
+
+def regenerate_meal(meal: Meal, feedback=''):
+    """
+    Replaces a single meal in place. Returns the updated meal.
+    Raises RegenerationError if the model call fails, RegenerationConflict
+    if the meal was tracked.
+    """
+    plan = meal.nutrition_day.plan
+    user = plan.profile.user
+    tracking = MealTracking.objects.filter(meal=meal.pk)
+    _check_untracked(tracking)
+    meal_data = _generate(build_meal_prompt(meal, feedback), plan, MealSchema, 'regen-meal', _meal_extractor(meal))
+
+    with transaction.atomic():
+        meal = Meal.objects.select_for_update().select_related('nutrition_day').get(pk=meal.pk)
+        _check_untracked(tracking)
+        _apply_meal(meal, meal_data)
+        meal.save(update_fields=MEAL_FIELDS)
+
+    _sync_calendar(user, plan, meals=[meal])
+    return meal
@@ -0,0 +1,147 @@
+# rest/plan_renewal.py
+"""
+Pre-generates next week's plan for every profile whose latest plan ends soon,
+so the plans already exist when users open the app on Monday.
+
+Each renewal is recorded as a PlanGenerationJob and generated through the
+same path as POST users/me/plans. A run is resumable: profiles that already
+have next week's plan, or an active job for it, are skipped, and jobs left
+running by an interrupted run are picked up again by the plan job workers.
+
+Call renew_weekly_plans() from a scheduler, or run
+`python manage.py renew_weekly_plans` from cron.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Profile, PlanGenerationJob
+from .plan_jobs import acquire_plan_job, run_job
+
+
+class MinuteBudget:
+    """
+    Blocks callers so that at most `per_minute` acquisitions happen in any
+    sliding 60 second window. Keeps the run inside the Gemini quota.
+    """
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._starts = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.per_minute:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= 60:
+                    self._starts.popleft()
+                if len(self._starts) < self.per_minute:
+                    self._starts.append(now)
+                    return
+                wait = 60 - (now - self._starts[0])
+            time.sleep(wait)
+
+
+def profiles_due_for_renewal(within_days=2, today=None):
+    """
+    Yields (profile, next_start_date) for profiles whose latest plan ends
+    within `within_days` days and that have no active job for the next week.
+    """
+    today = today or date.today()
+    profiles = Profile.objects.select_related('user').annotate(
+        latest_end=Max('fitness_plans__end_date')
+    ).filter(
+        latest_end__gte=today,
+        latest_end__lte=today + timedelta(days=within_days),
+    ).order_by('pk')
+
+    for profile in profiles.iterator():
+        next_start = profile.latest_end + timedelta(days=1)
+        has_active_job = profile.plan_jobs.filter(
+            start_date=next_start, status__in=PlanGenerationJob.ACTIVE_STATUSES
+        ).exists()
+        if not has_active_job:
+            yield profile, next_start
+
+
+def _renew(profile, start_date, budget):
+    try:
+        # Wait for the budget before claiming the job, so no RUNNING job sits
+        # without a lease while this thread sleeps
+        budget.acquire()
+        job, created = acquire_plan_job(
+            profile,
+            start_date,
+            status=PlanGenerationJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+            worker_id='renewal',
+            attempts=1,
+        )
+        if not created:
+            # The user (or another run) is already generating this plan
+            return 'skipped'
+        return run_job(job).status
+    finally:
+        close_old_connections()
+
+
+def renew_weekly_plans(within_days=None, concurrency=None, per_minute=None, dry_run=False, log=print):
+    """
+    Generates next week's plan for every profile that is due, with at most
+    `concurrency` generations at once and `per_minute` started per minute.
+    Returns a summary report.
+    """
+    within_days = within_days if within_days is not None else getattr(settings, 'PLAN_RENEWAL_WITHIN_DAYS', 2)
+    concurrency = concurrency or getattr(settings, 'PLAN_RENEWAL_CONCURRENCY', 4)
+    per_minute = per_minute if per_minute is not None else getattr(settings, 'PLAN_RENEWAL_PER_MINUTE', 30)
+
+    started = time.monotonic()
+    due = list(profiles_due_for_renewal(within_days))
+    summary = {
+        'due': len(due),
+        'succeeded': 0,
+        'failed': 0,
+        'skipped': 0,
+        'errors': 0,
+        'dry_run': dry_run,
+    }
+    if dry_run:
+        for profile, start_date in due:
+            log(f"Would renew plan for {profile.user.username} starting {start_date}")
+        summary['duration_seconds'] = round(time.monotonic() - started, 2)
+        return summary
+
+    budget = MinuteBudget(per_minute)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='plan-renewal') as executor:
+        futures = {
+            executor.submit(_renew, profile, start_date, budget): (profile, start_date)
+            for profile, start_date in due
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            profile, start_date = futures[future]
+            try:
+                job_status = future.result()
+            except Exception as e:
+                summary['errors'] += 1
+                log(f"[{done}/{len(due)}] Error renewing plan for {profile.user.username}: {e}")
+                continue
+            if job_status == PlanGenerationJob.STATUS_SUCCEEDED:
+                summary['succeeded'] += 1
+            elif job_status == 'skipped':
+                summary['skipped'] += 1
+            else:
+                summary['failed'] += 1
+            log(f"[{done}/{len(due)}] {profile.user.username} ({start_date}): {job_status}")
+
+    summary['duration_seconds'] = round(time.monotonic() - started, 2)
+    return summary
@@ -0,0 +1,377 @@
+# rest/plan_repair.py
+"""
+Validate-and-repair for generated plans.
+
+A model response that does not validate as a whole is usually mostly
+right: a truncated tail, a number written as a string, a day_of_week of 0,
+a missing day. Instead of failing the generation, repair_plan():
+
+1. parses the JSON, closing it after the last complete element if it was
+   cut off;
+2. accepts the full or the compact (rest/wire_schema.py) keys;
+3. coerces types ("3 sets" -> 3, "true" -> True, 12 -> "12"), clamps
+   day_of_week to 1-7, normalizes meal types and fills in defaults for
+   missing exercise fields, dropping only items that are still invalid;
+4. re-requests just the missing workout or nutrition days, when a
+   `regenerate_days` callable is given;
+5. fills any days still missing with rest days, or the meals of the
+   closest nutrition day.
+
+A response with no nutrition day, or no workout day with exercises, is
+rejected.
+"""
+import json
+import re
+
+from pydantic import ValidationError
+
+from .schemas import GeneratedPlanSchema, WorkoutDaySchema, ExerciseSchema, NutritionDaySchema, MealSchema
+from .wire_schema import MEAL_TYPES, EXERCISE_KEYS, WORKOUT_DAY_KEYS, MEAL_KEYS, NUTRITION_DAY_KEYS, PLAN_SCHEMAS
+
+ALL_DAYS = set(range(1, 8))
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Used for exercise fields the model left out
+EXERCISE_DEFAULTS = {
+    'sets': 3,
+    'met_value': 4.0,
+    'duration_mins': 10,
+    'reps': '10-12',
+    'rest_period_seconds': 60,
+}
+
+NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+class RepairReport:
+    """What repair_plan() changed, for logging and telemetry."""
+
+    def __init__(self):
+        self.truncated = False
+        self.fixes = []
+        self.dropped = []
+        self.regenerated_days = {'workout_days': [], 'nutrition_days': []}
+        self.filled_days = {'workout_days': [], 'nutrition_days': []}
+
+    @property
+    def repaired(self):
+        return bool(
+            self.truncated or self.fixes or self.dropped
+            or any(self.regenerated_days.values()) or any(self.filled_days.values())
+        )
+
+    def __str__(self):
+        parts = []
+        if self.truncated:
+            parts.append("closed truncated JSON")
+        if self.fixes:
+            parts.append(f"{len(self.fixes)} values fixed")
+        if self.dropped:
+            parts.append(f"dropped {', '.join(self.dropped)}")
+        for field in ('workout_days', 'nutrition_days'):
+            if self.regenerated_days[field]:
+                parts.append(f"regenerated {field} {self.regenerated_days[field]}")
+            if self.filled_days[field]:
+                parts.append(f"filled {field} {self.filled_days[field]}")
+        return "; ".join(parts) or "no repairs"
+
+
+# --- JSON ---
+
+def _close_json(text):
+    """
+    Returns the candidate texts for a truncated JSON document: cut after
+    each complete object or array, latest first, with the open brackets
+    closed.
+    """
+    stack = []
+    in_string = escaped = False
+    cuts = []
+    for pos, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]' and stack:
+            stack.pop()
+            if stack:
+                cuts.append((pos + 1, ''.join(reversed(stack))))
+    return [text[:pos] + closers for pos, closers in reversed(cuts)]
+
+
+def load_json(text, report):
+    """Parses the response text, closing it if it was truncated. Returns a dict, or None."""
+    start = text.find('{')
+    if start == -1:
+        return None
+    text = text[start:]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+        for candidate in _close_json(text)[:100]:
+            try:
+                data = json.loads(candidate)
+            except ValueError:
+                continue
+            report.truncated = True
+            break
+    return data if isinstance(data, dict) else None
+
+
+# --- Coercion ---
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return round(value)
+    if isinstance(value, str):
+        match = NUMBER_PATTERN.search(value)
+        if match:
+            return round(float(match.group()))
+    return None
+
+
+def _to_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        match = NUMBER_PATTERN.search(value)
+        if match:
+            return float(match.group())
+    return None
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', '1', 'y')
+    return bool(value)
+
+
+def _to_str(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def _day_of_week(value):
+    """1-7 from a number (clamped) or a weekday name, or None."""
+    if isinstance(value, str) and value.strip().lower()[:3] in [day[:3] for day in WEEKDAYS]:
+        return [day[:3] for day in WEEKDAYS].index(value.strip().lower()[:3]) + 1
+    number = _to_int(value)
+    return None if number is None else min(max(number, 1), 7)
+
+
+def normalize_meal_type(value):
+    """One of the Meal model's meal types for a model-written value; unknown ones become snacks."""
+    value = (_to_str(value) or '').strip().lower()
+    if value in MEAL_TYPES:
+        return MEAL_TYPES[value]
+    for meal_type in ('breakfast', 'lunch', 'dinner', 'snack'):
+        if meal_type in value:
+            return meal_type
+    return 'snack'
+
+
+def _rename(data, keys):
+    """Maps compact keys to full ones, keeping full keys as they are."""
+    renamed = dict(data)
+    for short, full in keys:
+        if short in data and full not in data:
+            renamed[full] = renamed.pop(short)
+    return renamed
+
+
+def _coerce(data, converters, report, label):
+    """Applies the converters to the fields present, recording what changed."""
+    for field, convert in converters.items():
+        if field in data and data[field] is not None:
+            value = convert(data[field])
+            if value != data[field]:
+                report.fixes.append(f"{label}.{field}: {data[field]!r} -> {value!r}")
+                data[field] = value
+    return data
+
+
+def _validate(schema, data, report, label):
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        report.dropped.append(label)
+        print(f"Dropping invalid {label}: {e.errors()[0]['msg']}")
+        return None
+
+
+def repair_exercise(data, report, label):
+    if not isinstance(data, dict):
+        report.dropped.append(label)
+        return None
+    data = _coerce(_rename(data, EXERCISE_KEYS), {
+        'name': _to_str, 'sets': _to_int, 'met_value': _to_float, 'duration_mins': _to_int,
+        'reps': _to_str, 'rest_period_seconds': _to_int, 'notes': _to_str,
+    }, report, label)
+    for field, default in EXERCISE_DEFAULTS.items():
+        if data.get(field) is None:
+            report.fixes.append(f"{label}.{field}: missing -> {default!r}")
+            data[field] = default
+    return _validate(ExerciseSchema, data, report, label)
+
+
+def repair_workout_day(data, report, label):
+    if not isinstance(data, dict):
+        report.dropped.append(label)
+        return None
+    data = _coerce(_rename(data, WORKOUT_DAY_KEYS), {
+        'day_of_week': _day_of_week, 'title': _to_str, 'is_rest_day': _to_bool, 'description': _to_str,
+    }, report, label)
+    exercises = data.pop('exercises', data.pop('x', None)) or []
+    data['exercises'] = [
+        exercise for exercise in (
+            repair_exercise(ex, report, f"{label}.exercises[{index}]")
+            for index, ex in enumerate(exercises if isinstance(exercises, list) else [])
+        ) if exercise is not None
+    ]
+    if not data.get('title'):
+        data['title'] = 'Rest Day' if data.get('is_rest_day') or not data['exercises'] else 'Workout'
+    if data.get('is_rest_day'):
+        data['exercises'] = []
+    return _validate(WorkoutDaySchema, data, report, label)
+
+
+def repair_meal(data, report, label):
+    if not isinstance(data, dict):
+        report.dropped.append(label)
+        return None
+    data = _rename(data, MEAL_KEYS)
+    data['meal_type'] = normalize_meal_type(data.pop('meal_type', data.pop('t', None)))
+    data = _coerce(data, {
+        'description': _to_str, 'calories': _to_int, 'protein_grams': _to_float, 'carbs_grams': _to_float,
+        'fats_grams': _to_float, 'portion_size': _to_str,
+    }, report, label)
+    for field in ('protein_grams', 'carbs_grams', 'fats_grams'):
+        if data.get(field) is None:
+            data[field] = 0.0
+    if data.get('calories') is None:
+        data['calories'] = round(4 * data['protein_grams'] + 4 * data['carbs_grams'] + 9 * data['fats_grams'])
+        report.fixes.append(f"{label}.calories: missing -> {data['calories']} from macros")
+    return _validate(MealSchema, data, report, label)
+
+
+def repair_nutrition_day(data, report, label):
+    if not isinstance(data, dict):
+        report.dropped.append(label)
+        return None
+    data = _rename(data, NUTRITION_DAY_KEYS)
+    meals = data.pop('meals', data.pop('m', None)) or []
+    data = _coerce(data, {
+        'day_of_week': _day_of_week, 'target_calories': _to_int, 'target_protein_grams': _to_int,
+        'target_carbs_grams': _to_int, 'target_fats_grams': _to_int, 'target_water_litres': _to_float,
+        'notes': _to_str,
+    }, report, label)
+    data['meals'] = [
+        meal for meal in (
+            repair_meal(meal, report, f"{label}.meals[{index}]")
+            for index, meal in enumerate(meals if isinstance(meals, list) else [])
+        ) if meal is not None
+    ]
+    if not data['meals']:
+        report.dropped.append(label)
+        return None
+    return _validate(NutritionDaySchema, data, report, label)
+
+
+def _repair_days(items, repair, report, field):
+    days = {}
+    for index, item in enumerate(items if isinstance(items, list) else []):
+        day = repair(item, report, f"{field}[{index}]")
+        if day is None:
+            continue
+        if day.day_of_week in days:
+            report.dropped.append(f"{field}[{index}] (duplicate day {day.day_of_week})")
+            continue
+        days[day.day_of_week] = day
+    return days
+
+
+# --- Missing days ---
+
+def _fill_workout_day(day_of_week):
+    return WorkoutDaySchema(
+        day_of_week=day_of_week, title='Rest Day', is_rest_day=True,
+        description='Active recovery: light walking or stretching.',
+    )
+
+
+def _fill_nutrition_day(day_of_week, days):
+    closest = min(days, key=lambda other: (abs(other - day_of_week), other))
+    return days[closest].model_copy(update={'day_of_week': day_of_week}, deep=True)
+
+
+def repair_plan(text, regenerate_days=None):
+    """
+    Validates a plan response, repairing it where possible.
+
+    regenerate_days(field, missing_days), if given, is called for a half of
+    the plan ('workout_days' or 'nutrition_days') with missing days and
+    returns a list of day schemas (or None); see
+    ai_service.request_missing_days().
+    Returns (GeneratedPlanSchema or None, RepairReport).
+    """
+    report = RepairReport()
+    data = load_json(text, report)
+    if data is None:
+        return None, report
+
+    workout_days = _repair_days(data.get('workout_days', data.get('w')), repair_workout_day, report, 'workout_days')
+    nutrition_days = _repair_days(data.get('nutrition_days', data.get('n')), repair_nutrition_day, report, 'nutrition_days')
+    if not workout_days and not nutrition_days and regenerate_days is None:
+        return None, report
+
+    for field, days in (('workout_days', workout_days), ('nutrition_days', nutrition_days)):
+        missing = sorted(ALL_DAYS - set(days))
+        if missing and regenerate_days is not None:
+            for day in regenerate_days(field, missing) or []:
+                if day.day_of_week in missing and day.day_of_week not in days:
+                    days[day.day_of_week] = day
+                    report.regenerated_days[field].append(day.day_of_week)
+
+    if not nutrition_days:
+        # Nothing to copy meals from
+        return None, report
+    if not any(day.exercises for day in workout_days.values()):
+        # Filling would give a week of rest days, which is not a workout plan
+        return None, report
+    for day_of_week in sorted(ALL_DAYS - set(workout_days)):
+        workout_days[day_of_week] = _fill_workout_day(day_of_week)
+        report.filled_days['workout_days'].append(day_of_week)
+    for day_of_week in sorted(ALL_DAYS - set(nutrition_days)):
+        nutrition_days[day_of_week] = _fill_nutrition_day(day_of_week, nutrition_days)
+        report.filled_days['nutrition_days'].append(day_of_week)
+
+    plan_data = GeneratedPlanSchema(
+        workout_days=[workout_days[day] for day in sorted(workout_days)],
+        nutrition_days=[nutrition_days[day] for day in sorted(nutrition_days)],
+    )
+    return plan_data, report
+
+
+def is_plan_schema(schema):
+    """Whether schema is one of the whole-plan schemas repair_plan() can repair."""
+    return schema in PLAN_SCHEMAS
+
+
+def build_missing_days_prompt(prompt, field, missing_days):
+    days = ', '.join(str(day) for day in missing_days)
+    return (
+        f"{prompt}\n    - Only generate the {'workout' if field == 'workout_days' else 'nutrition'} plan "
+        f"('{field}') for the days with day_of_week {days}; the other days already exist."
+    )
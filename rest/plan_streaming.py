@@ -0,0 +1,219 @@
+# rest/plan_streaming.py
+"""
+Streaming plan generation.
+
+The plan JSON is parsed as it arrives from the Gemini streaming API, and
+each workout day and nutrition day is emitted as soon as its object is
+complete, so the client can render the first day after a couple of
+seconds instead of waiting for the whole week. The full plan is validated
+and saved once the stream ends.
+
+Only Gemini streams. When the router (rest/plan_backends.py) would not
+pick Gemini first, or the stream fails before the first day, the plan
+comes from the next backends instead and all of its days are sent at once.
+"""
+import json
+import time
+from datetime import date
+
+from django.utils import timezone
+
+from . import ai_client
+from .ai_service import GEMINI_MODEL, build_plan_prompt, build_generation_config, release_db_connection, get_fallback_plan_data
+from .models import Profile, PlanGenerationJob, AICallRecord
+from .ai_telemetry import track_ai_call
+from .plan_jobs import acquire_plan_job, finish_job, job_lease
+from .plan_backends import get_router, GeminiBackend
+from .plan_cache import get_cached_plan, cache_plan
+from .plan_materializer import materialize_plan, PlanOverlapError
+from .nutrition_targets import apply_profile_targets
+from .schemas import GeneratedPlanSchema, WorkoutDaySchema, NutritionDaySchema
+from .wire_schema import plan_generation_schema
+
+DAY_SCHEMAS = {
+    'workout_days': ('workout_day', WorkoutDaySchema),
+    'nutrition_days': ('nutrition_day', NutritionDaySchema),
+}
+
+
+class PlanStreamParser:
+    """
+    An incremental scanner over the plan JSON text.
+
+    It tracks string and nesting state character by character, and when an
+    object that is a direct element of the top-level 'workout_days' or
+    'nutrition_days' array closes, it parses just that slice of the text.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._stack = []  # (container char, key it was opened under)
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        self._day_start = None
+
+    def _day_array_key(self):
+        """The top-level day array we are directly inside, if any."""
+        if len(self._stack) == 2 and self._stack[1][0] == '[' and self._stack[1][1] in DAY_SCHEMAS:
+            return self._stack[1][1]
+        return None
+
+    def feed(self, chunk):
+        """
+        Consumes more text and returns the (event, day) pairs that completed.
+        """
+        self.text += chunk
+        completed = []
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = json.loads(self.text[self._string_start:self._pos + 1])
+            elif char == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif char == ':':
+                self._pending_key = self._last_string
+            elif char in '{[':
+                if char == '{' and self._day_array_key():
+                    self._day_start = self._pos
+                key = self._pending_key if self._stack and self._stack[-1][0] == '{' else None
+                self._stack.append((char, key))
+                self._pending_key = None
+            elif char in '}]':
+                self._stack.pop()
+                array_key = self._day_array_key()
+                if char == '}' and array_key and self._day_start is not None:
+                    event, schema = DAY_SCHEMAS[array_key]
+                    day = schema.model_validate_json(self.text[self._day_start:self._pos + 1])
+                    completed.append((event, day))
+                    self._day_start = None
+            self._pos += 1
+        return completed
+
+
+def _apply_day_targets(nutrition_day, user_profile):
+    """A streamed nutrition day with the same targets the saved plan will get."""
+    plan_data = GeneratedPlanSchema(workout_days=[], nutrition_days=[nutrition_day])
+    return apply_profile_targets(user_profile, plan_data).nutrition_days[0]
+
+
+def stream_plan_for_user(user_profile: Profile, start_date: date):
+    """
+    Generates a plan for the user and yields (event, data) pairs:
+    'workout_day' and 'nutrition_day' as each day completes, then 'plan'
+    with the saved FitnessPlan, or 'error' with a detail message.
+
+    The stream holds the single-flight job for (profile, start_date); if
+    that plan is already being generated, it only yields 'waiting' with the
+    job id, which the client polls at me/plan-jobs/<id>, rather than
+    holding the response open until the job finishes.
+    """
+    job, created = acquire_plan_job(
+        user_profile,
+        start_date,
+        status=PlanGenerationJob.STATUS_RUNNING,
+        started_at=timezone.now(),
+        worker_id='stream',
+        attempts=1,
+    )
+    if not created:
+        yield 'waiting', {'job': job.pk}
+        return
+
+    plan, error = None, "The stream was interrupted."
+    try:
+        with job_lease(job):
+            for event, data in _generate_stream(user_profile, start_date):
+                if event == 'plan':
+                    plan, error = data, None
+                elif event == 'error':
+                    error = data['detail']
+                yield event, data
+    finally:
+        finish_job(job, plan, error)
+
+
+def _generate_stream(user_profile: Profile, start_date: date):
+    print(f"Streaming plan for user: {user_profile.user.username}")
+    prompt = build_plan_prompt(user_profile, start_date)
+
+    plan_data = get_cached_plan(user_profile, start_date)
+    days_sent = 0
+    if plan_data is None:
+        release_db_connection()
+        router = get_router()
+        backends = router.route()
+        if not backends or backends[0].name != GeminiBackend.name:
+            # Gemini is unavailable, cooling down or slower than another
+            # backend; the others can't stream, so their days follow at once
+            plan_data, backend = router.generate(prompt, user=user_profile.user, backends=backends)
+        else:
+            backend = backends[0]
+            parser = PlanStreamParser()
+            started = time.monotonic()
+            try:
+                with track_ai_call('gemini', GEMINI_MODEL, user=user_profile.user, purpose='plan-stream') as call:
+                    for chunk in ai_client.generate_content_stream(
+                        model=GEMINI_MODEL,
+                        contents=prompt,
+                        config=build_generation_config(plan_generation_schema(compact=False)),
+                        call=call,
+                    ):
+                        for event, day in parser.feed(chunk.text or ''):
+                            if event == 'nutrition_day':
+                                day = _apply_day_targets(day, user_profile)
+                            days_sent += 1
+                            yield event, day.model_dump(mode='json')
+                    try:
+                        plan_data = GeneratedPlanSchema.model_validate_json(parser.text)
+                    except ValueError as e:
+                        call.set_outcome(AICallRecord.OUTCOME_INVALID, e)
+                        raise
+                    call.set_outcome(AICallRecord.OUTCOME_VALID)
+            except Exception as e:
+                print(f"Error streaming from Gemini API: {e}")
+            router.record(backend, time.monotonic() - started, plan_data is not None)
+            # Days already sent can't be taken back, so only fall back before the first one
+            if plan_data is None and not days_sent:
+                plan_data, backend = get_fallback_plan_data(prompt, user=user_profile.user)
+        if plan_data is None:
+            yield 'error', {'detail': "Failed to generate fitness plan."}
+            return
+        print(f"Plan generated by the '{backend.name}' backend")
+        if backend.cacheable:
+            cache_plan(user_profile, start_date, plan_data)
+
+    plan_data = apply_profile_targets(user_profile, plan_data)
+    if not days_sent:
+        # Cached and non-streamed plans are complete already
+        for workout_day in plan_data.workout_days:
+            yield 'workout_day', workout_day.model_dump(mode='json')
+        for nutrition_day in plan_data.nutrition_days:
+            yield 'nutrition_day', nutrition_day.model_dump(mode='json')
+
+    try:
+        new_plan = materialize_plan(user_profile, start_date, plan_data, prompt=prompt)
+    except PlanOverlapError as e:
+        yield 'error', {'detail': str(e)}
+        return
+    except Exception as e:
+        print(f"Error saving plan to database: {e}")
+        yield 'error', {'detail': "Failed to save fitness plan."}
+        return
+    print(f"Plan successfully streamed and saved for user: {user_profile.user.username}")
+    yield 'plan', new_plan
+
+
+def format_sse(event, data):
+    """Formats one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
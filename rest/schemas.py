@@ -45,6 +45,26 @@ class GeneratedPlanSchema(BaseModel):
     workout_days: List[WorkoutDaySchema]
     nutrition_days: List[NutritionDaySchema]
 
+# Partial plans, for generating the workout and nutrition halves separately
+class GeneratedWorkoutDaysSchema(BaseModel):
+    workout_days: List[WorkoutDaySchema]
+
+class GeneratedNutritionDaysSchema(BaseModel):
+    nutrition_days: List[NutritionDaySchema]
+
+# Meals only; the daily targets are computed locally (see rest/nutrition_targets.py)
+class NutritionDayMealsSchema(BaseModel):
+    day_of_week: int = Field(..., ge=1, le=7, description="1 for Monday, 7 for Sunday.")
+    notes: Optional[str] = Field(None, description="General advice for the day.")
+    meals: List[MealSchema]
+
+class GeneratedPlanMealsSchema(BaseModel):
+    workout_days: List[WorkoutDaySchema]
+    nutrition_days: List[NutritionDayMealsSchema]
+
+class GeneratedNutritionMealsSchema(BaseModel):
+    nutrition_days: List[NutritionDayMealsSchema]
+
 # --- Schemas for API Input/Output (Validation & Serialization) ---
 
 # --- User and Profile Schemas ---
@@ -11,7 +11,7 @@ from .models import (
     Meal, NutritionDay,
     Profile, WorkoutDay,
     WorkoutTracking, MealTracking,
-    WaterTracking,
+    WaterTracking, PlanGenerationJob,
 )
 from datetime import date
 
@@ -210,9 +210,19 @@ class FitnessPlanSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = FitnessPlan
-        fields = '__all__'
+        # The AI prompt and response are large and only needed for debugging;
+        # they are served on demand by users/me/plans/<id>/ai-artifacts
+        exclude = ['ai_prompt_text', 'ai_response_raw', 'ai_prompt_artifact', 'ai_response_artifact']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+class PlanGenerationJobSerializer(serializers.ModelSerializer):
+    plan = FitnessPlanSerializer(read_only=True)
+
+    class Meta:
+        model = PlanGenerationJob
+        fields = ['id', 'status', 'start_date', 'plan', 'error', 'attempts', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
 class WorkoutTrackingSerializer(serializers.ModelSerializer):
     exercise_name = serializers.CharField(source='exercise.name', read_only=True)
     exercise_sets = serializers.IntegerField(source='exercise.sets', read_only=True)
@@ -1,3 +1,818 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.apps import apps
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from google.genai import errors as genai_errors, types as genai_types
+from rest_framework.test import APIClient
+
+from . import ai_client
+from .ai_artifacts import read_json, read_text, store_json, store_text
+from .ai_service import generate_and_save_plan_for_user
+from .ai_telemetry import track_ai_call, summarize_ai_calls
+from .fallback_plans import MEALS, PROTEIN_SIDES, build_fallback_plan
+from .models import Profile, FitnessPlan, Exercise, Meal, WorkoutTracking, MealTracking, WaterTracking, PlanGenerationJob, AICallRecord, AIArtifact
+from .nutrition_targets import DEFAULT_TARGETS, _scale_meal, compute_nutrition_targets
+from .plan_cache import cache_plan, get_plan_cache_stats, profile_fingerprint
+from .plan_backends import PlanBackend, PlanBackendRouter
+from .plan_archetypes import get_diet, can_use_archetype, personalize_plan
+from .plan_fanout import generate_plan_data_fanout
+from .plan_jobs import PlanJobWorkerPool, acquire_plan_job, claim_next_job, finish_job, requeue_stale_jobs, run_job
+from .plan_materializer import PlanOverlapError, materialize_plan
+from .plan_renewal import profiles_due_for_renewal
+from .plan_repair import repair_plan
+from .plan_streaming import PlanStreamParser
+from .plan_regeneration import RegenerationConflict, regenerate_workout_day, regenerate_nutrition_day, regenerate_meal
+from .schemas import WorkoutDaySchema, ExerciseSchema, MealSchema, NutritionDayMealsSchema
+from .wire_schema import CompactPlanSchema, CompactPlanMealsSchema, compact_plan, expand_plan, parse_plan, to_wire
+
+START_DATE = date(2025, 1, 6)
+
+
+def make_profile(username='ama', **fields):
+    user = User.objects.create_user(username=username, password='password')
+    defaults = {
+        'goal': 'weight_loss', 'activity_level': 'moderately_active', 'gender': 'female',
+        'age': 30, 'current_weight': 70, 'height': 165,
+    }
+    return Profile.objects.create(user=user, **{**defaults, **fields})
+
+
+def make_plan(profile, start_date=START_DATE):
+    return materialize_plan(profile, start_date, build_fallback_plan(profile))
+
+
+class PlanMaterializerTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+
+    def test_rows_are_written_with_a_constant_number_of_queries(self):
+        plan_data = build_fallback_plan(self.profile)
+        with CaptureQueriesContext(connection) as full_week:
+            plan = materialize_plan(self.profile, START_DATE, plan_data)
+        self.assertEqual(plan.workout_days.count(), 7)
+        self.assertEqual(
+            Exercise.objects.filter(workout_day__plan=plan).count(),
+            sum(len(day.exercises) for day in plan_data.workout_days),
+        )
+        self.assertEqual(plan.nutrition_days.count(), 7)
+        self.assertEqual(Meal.objects.filter(nutrition_day__plan=plan).count(),
+                         sum(len(day.meals) for day in plan_data.nutrition_days))
+        self.assertEqual(plan.end_date, START_DATE + timedelta(days=6))
+
+        small = plan_data.model_copy(deep=True)
+        small.workout_days, small.nutrition_days = small.workout_days[:1], small.nutrition_days[:1]
+        with CaptureQueriesContext(connection) as one_day:
+            materialize_plan(self.profile, START_DATE + timedelta(days=7), small)
+        self.assertEqual(len(full_week), len(one_day))
+
+    def test_overlap_is_checked_under_the_profile_lock(self):
+        make_plan(self.profile)
+        calls = []
+        lock = Profile.objects.select_for_update
+
+        def select_for_update(*args, **kwargs):
+            calls.append('lock')
+            return lock(*args, **kwargs)
+
+        def find_overlapping_plans(*args):
+            calls.append('check')
+            return FitnessPlan.objects.filter(profile=self.profile, start_date__lte=args[1], end_date__gte=args[1])
+
+        with mock.patch.object(Profile.objects, 'select_for_update', select_for_update), \
+                mock.patch('rest.plan_materializer.find_overlapping_plans', find_overlapping_plans):
+            with self.assertRaises(PlanOverlapError):
+                materialize_plan(self.profile, START_DATE + timedelta(days=3), build_fallback_plan(self.profile))
+        self.assertEqual(calls, ['lock', 'check'])
+        self.assertEqual(FitnessPlan.objects.count(), 1)
+
+
+@override_settings(PLAN_CACHE_ENABLED=False)
+class TwoPhaseGenerationTests(TransactionTestCase):
+    def test_model_is_called_without_a_transaction_or_connection(self):
+        profile = make_profile()
+        seen = {}
+
+        def generate(prompt, user=None):
+            seen['in_atomic_block'] = connection.in_atomic_block
+            seen['closed'] = close.called
+            return build_fallback_plan(profile), mock.Mock(cacheable=False)
+
+        router = mock.Mock()
+        router.generate.side_effect = generate
+        with mock.patch.object(connection, 'close', wraps=connection.close) as close, \
+                mock.patch('rest.ai_service.get_router', return_value=router):
+            plan = generate_and_save_plan_for_user(profile, START_DATE)
+        self.assertEqual(seen, {'in_atomic_block': False, 'closed': True})
+        self.assertEqual(plan.workout_days.count(), 7)
+
+
+class PlanCacheTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile(allergies='Peanut, soy')
+        caches['plan_responses'].clear()
+        self.addCleanup(caches['plan_responses'].clear)
+
+    def test_fingerprint_buckets_nearby_profiles(self):
+        fingerprint = profile_fingerprint(self.profile, START_DATE)
+        similar = {
+            'goal': 'weight_loss', 'activity_level': 'moderately_active', 'gender': 'female',
+            'age': 34, 'current_weight': 72.5, 'height': 168, 'allergies': 'soy,peanut',
+        }
+        self.assertEqual(profile_fingerprint(Profile(**similar), START_DATE + timedelta(days=7)), fingerprint)
+        for changes in [{'age': 35}, {'current_weight': 75}, {'goal': 'muscle_gain'}, {'allergies': 'soy'}]:
+            other = Profile(**{**similar, **changes})
+            self.assertNotEqual(profile_fingerprint(other, START_DATE), fingerprint, changes)
+        self.assertNotEqual(profile_fingerprint(self.profile, START_DATE + timedelta(days=1)), fingerprint)
+
+    def test_cache_hit_skips_the_backend(self):
+        plan_data = build_fallback_plan(self.profile)
+        cache_plan(self.profile, START_DATE, plan_data)
+        router = mock.Mock()
+        with mock.patch('rest.ai_service.get_router', return_value=router):
+            plan = generate_and_save_plan_for_user(self.profile, START_DATE)
+        router.generate.assert_not_called()
+        self.assertEqual(plan.workout_days.count(), len(plan_data.workout_days))
+        self.assertEqual(get_plan_cache_stats()['hits'], 1)
+
+
+class PlanRegenerationTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+        self.plan = make_plan(self.profile)
+        self.workout_day = self.plan.workout_days.filter(is_rest_day=False).first()
+        self.nutrition_day = self.plan.nutrition_days.first()
+        self.meal = self.nutrition_day.meals.first()
+
+    def track(self):
+        WorkoutTracking.objects.create(
+            exercise=self.workout_day.exercises.first(), user=self.profile.user, date_completed=START_DATE,
+        )
+        MealTracking.objects.create(meal=self.meal, user=self.profile.user, date_completed=START_DATE)
+
+    @mock.patch('rest.plan_regeneration.generate_plan_data')
+    def test_tracked_parts_are_not_regenerated(self, generate_plan_data):
+        self.track()
+        for regenerate, part in [
+            (regenerate_workout_day, self.workout_day),
+            (regenerate_nutrition_day, self.nutrition_day),
+            (regenerate_meal, self.meal),
+        ]:
+            with self.assertRaises(RegenerationConflict):
+                regenerate(part)
+        generate_plan_data.assert_not_called()
+        self.assertEqual(WorkoutTracking.objects.count(), 1)
+        self.assertEqual(MealTracking.objects.count(), 1)
+        self.meal.refresh_from_db()
+        self.assertEqual(self.meal.tracking_records.count(), 1)
+
+    @mock.patch('rest.plan_regeneration.generate_plan_data')
+    def test_tracked_day_regeneration_returns_conflict(self, generate_plan_data):
+        self.track()
+        client = APIClient()
+        client.force_authenticate(self.profile.user)
+        response = client.post(
+            f'/api/users/me/plans/{self.plan.pk}/workout-days/{self.workout_day.day_of_week}/regenerate/'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(WorkoutTracking.objects.count(), 1)
+
+    @mock.patch('rest.plan_regeneration.generate_plan_data')
+    def test_untracked_day_is_regenerated(self, generate_plan_data):
+        generate_plan_data.return_value = WorkoutDaySchema(
+            day_of_week=self.workout_day.day_of_week, title="Hill Walk", exercises=[
+                ExerciseSchema(name="Hill walk", sets=1, met_value=6.0, duration_mins=30, reps="30 minutes",
+                               rest_period_seconds=0),
+            ],
+        )
+        workout_day = regenerate_workout_day(self.workout_day)
+        self.assertEqual(workout_day.title, "Hill Walk")
+        self.assertEqual([exercise.name for exercise in workout_day.exercises.all()], ["Hill walk"])
+
+
+    @mock.patch('rest.plan_regeneration.generate_plan_data')
+    def test_off_list_meal_types_are_normalized(self, generate_plan_data):
+        generate_plan_data.return_value = NutritionDayMealsSchema(
+            day_of_week=self.nutrition_day.day_of_week, meals=[
+                MealSchema(meal_type="Evening Snack", description="Roasted plantain with groundnuts", calories=350,
+                           protein_grams=9, carbs_grams=55, fats_grams=12),
+            ],
+        )
+        nutrition_day = regenerate_nutrition_day(self.nutrition_day)
+        self.assertEqual(list(nutrition_day.meals.values_list('meal_type', flat=True)), ['snack'])
+
+    @mock.patch('rest.plan_regeneration.generate_plan_data', return_value=None)
+    def test_failed_gemini_call_falls_back_to_the_next_backend(self, generate_plan_data):
+        expected = build_fallback_plan(self.profile).workout_days[self.workout_day.day_of_week - 1]
+        workout_day = regenerate_workout_day(self.workout_day)
+        generate_plan_data.assert_called_once()
+        self.assertEqual(workout_day.title, expected.title)
+        self.assertEqual(workout_day.exercises.count(), len(expected.exercises))
+
+
+class PlanStreamParserTests(TestCase):
+    def setUp(self):
+        self.plan = build_fallback_plan()
+        # Quotes, escapes and brackets inside strings must not end a day
+        self.plan.nutrition_days[0].notes = 'Say "no" to {sugar} [and] \\ salt \u00e9'
+        self.text = self.plan.model_dump_json()
+
+    def parse(self, chunk_size):
+        parser = PlanStreamParser()
+        events = []
+        for start in range(0, len(self.text), chunk_size):
+            events.extend(parser.feed(self.text[start:start + chunk_size]))
+        return events
+
+    def test_days_are_parsed_at_any_chunk_boundary(self):
+        expected = (
+            [('workout_day', day) for day in self.plan.workout_days]
+            + [('nutrition_day', day) for day in self.plan.nutrition_days]
+        )
+        for chunk_size in (1, 2, 3, 7, 64, len(self.text)):
+            self.assertEqual(self.parse(chunk_size), expected, chunk_size)
+
+
+@override_settings(PLAN_CACHE_ENABLED=False)
+class PlanStreamingTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+        self.plan_data = build_fallback_plan(self.profile)
+        self.client = APIClient()
+        self.client.force_authenticate(self.profile.user)
+        router = PlanBackendRouter(['gemini', 'fallback'])
+        patcher = mock.patch('rest.plan_streaming.get_router', return_value=router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_stream(self, model, contents, config, call=None):
+        text = self.plan_data.model_dump_json()
+        for start in range(0, len(text), 500):
+            yield mock.Mock(text=text[start:start + 500])
+
+    def stream(self):
+        response = self.client.post('/api/users/me/plans/stream/', {'start_date': date.today().isoformat()})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        for message in b''.join(response.streaming_content).decode('utf-8').split('\n\n'):
+            if message:
+                event, data = message.split('\n')
+                events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def assert_plan_streamed(self, events):
+        self.assertEqual([event for event, _ in events], ['workout_day'] * 7 + ['nutrition_day'] * 7 + ['plan'])
+        self.assertEqual([data['day_of_week'] for _, data in events[:7]], list(range(1, 8)))
+        plan = events[-1][1]
+        job = PlanGenerationJob.objects.get()
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.plan_id, plan['id'])
+        self.assertEqual(len(plan['workout_days']), 7)
+
+    def test_days_are_streamed_as_gemini_writes_them(self):
+        with mock.patch('rest.plan_streaming.ai_client.generate_content_stream', self.fake_stream):
+            self.assert_plan_streamed(self.stream())
+
+    @override_settings(PLAN_CACHE_ENABLED=True)
+    def test_cached_plan_is_streamed_without_calling_gemini(self):
+        with mock.patch('rest.plan_streaming.get_cached_plan', return_value=self.plan_data), \
+                mock.patch('rest.plan_streaming.ai_client.generate_content_stream') as generate_content_stream:
+            self.assert_plan_streamed(self.stream())
+        generate_content_stream.assert_not_called()
+
+    def test_second_caller_is_told_to_poll_the_job(self):
+        job, _ = acquire_plan_job(self.profile, date.today(), status=PlanGenerationJob.STATUS_RUNNING)
+        self.assertEqual(self.stream(), [('waiting', {'job': job.pk})])
+
+
+class PlanFanoutTests(TestCase):
+    def setUp(self):
+        self.plan = build_fallback_plan()
+
+    def shard_without(self, *left_out):
+        def generate_shard(field, days, shard_prompt, user=None):
+            return [day for day in getattr(self.plan, field) if day.day_of_week in days - set(left_out)]
+        return generate_shard
+
+    def test_shards_are_merged(self):
+        with mock.patch('rest.plan_fanout._generate_shard', self.shard_without()):
+            plan_data = generate_plan_data_fanout("prompt", day_splits=3)
+        self.assertEqual(plan_data, self.plan)
+
+    @mock.patch('rest.plan_fanout.request_missing_days')
+    def test_missing_days_are_requested(self, request_missing_days):
+        request_missing_days.return_value = lambda field, missing: [
+            day for day in getattr(self.plan, field) if day.day_of_week in missing
+        ]
+        with mock.patch('rest.plan_fanout._generate_shard', self.shard_without(7)):
+            plan_data = generate_plan_data_fanout("prompt", day_splits=2)
+        self.assertEqual(plan_data, self.plan)
+
+    @mock.patch('rest.plan_fanout.request_missing_days')
+    def test_days_still_missing_return_none(self, request_missing_days):
+        request_missing_days.return_value = lambda field, missing: None
+        with mock.patch('rest.plan_fanout._generate_shard', self.shard_without(3)):
+            self.assertIsNone(generate_plan_data_fanout("prompt", day_splits=2))
+
+    def test_failed_shard_does_not_wait_for_the_others(self):
+        release = threading.Event()
+
+        def generate_shard(field, days, shard_prompt, user=None):
+            if field == 'workout_days':
+                raise ValueError("invalid shard")
+            release.wait(5)
+            return []
+
+        started = time.monotonic()
+        with mock.patch('rest.plan_fanout._generate_shard', generate_shard):
+            self.assertIsNone(generate_plan_data_fanout("prompt", max_workers=2))
+        self.assertLess(time.monotonic() - started, 2)
+        release.set()
+
+
+class PlanArchetypeTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+        self.plan = make_plan(self.profile)
+
+    def personalize(self):
+        router = mock.Mock()
+        router.generate.return_value = (build_fallback_plan(), mock.Mock(cacheable=True))
+        with mock.patch('rest.plan_archetypes.get_router', return_value=router), \
+                mock.patch('rest.plan_archetypes.cache_plan'):
+            return personalize_plan(self.plan)
+
+    def test_tracked_plan_is_kept(self):
+        nutrition_day = self.plan.nutrition_days.first()
+        WaterTracking.objects.create(
+            nutrition_day=nutrition_day, user=self.profile.user, date=START_DATE, litres_consumed=1.5,
+        )
+        meal_ids = set(self.plan.nutrition_days.values_list('meals__id', flat=True))
+        self.personalize()
+        self.assertEqual(WaterTracking.objects.get().nutrition_day, nutrition_day)
+        self.assertEqual(set(self.plan.nutrition_days.values_list('meals__id', flat=True)), meal_ids)
+
+    def test_untracked_plan_is_personalized(self):
+        meal_ids = set(self.plan.nutrition_days.values_list('meals__id', flat=True))
+        plan = self.personalize()
+        self.assertEqual(plan.pk, self.plan.pk)
+        self.assertFalse(meal_ids & set(plan.nutrition_days.values_list('meals__id', flat=True)))
+
+    def test_failed_personalization_keeps_the_archetype_plan(self):
+        acquire_plan_job(self.profile, START_DATE, plan=self.plan)
+        job = claim_next_job('worker')
+        with mock.patch('rest.plan_archetypes.personalize_plan', return_value=None):
+            job = run_job(job)
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.plan, self.plan)
+        self.assertIn("could not be personalized", job.error)
+
+    def test_diets(self):
+        for preferences, diet in [
+            (None, 'none'), ('None', 'none'), ('Vegan', 'vegan'), ('pescatarian', 'pescatarian'),
+            ('halal, vegetarian', 'vegetarian'), ('keto', None), ('halal, keto', None),
+        ]:
+            self.profile.dietary_preferences = preferences
+            self.assertEqual(get_diet(self.profile), diet, preferences)
+        self.assertFalse(can_use_archetype(self.profile))
+
+    def test_meal_is_scaled_from_its_base_portion(self):
+        meal = MealSchema(meal_type='lunch', description="Red red", calories=500, protein_grams=20,
+                          carbs_grams=70, fats_grams=15, portion_size="1 plate")
+        _scale_meal(meal, 1.2)
+        _scale_meal(meal, 1.5)
+        self.assertEqual(meal.portion_size, "1 plate (x1.8)")
+        self.assertEqual(meal.calories, 900)
+
+
+class PlanJobTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+
+    def test_active_job_is_shared(self):
+        job, created = acquire_plan_job(self.profile, START_DATE)
+        self.assertTrue(created)
+        self.assertEqual(acquire_plan_job(self.profile, START_DATE), (job, False))
+        job.status = PlanGenerationJob.STATUS_SUCCEEDED
+        job.save()
+        other, created = acquire_plan_job(self.profile, START_DATE)
+        self.assertTrue(created)
+        self.assertNotEqual(other, job)
+
+    def test_other_integrity_errors_are_raised(self):
+        with self.assertRaises(IntegrityError):
+            acquire_plan_job(self.profile, None)
+
+    def test_single_flight_violation_without_active_job_is_raised(self):
+        acquire_plan_job(self.profile, START_DATE)
+        with mock.patch('rest.plan_jobs.PlanGenerationJob.objects.filter') as filter_jobs:
+            filter_jobs.return_value.first.return_value = None
+            with self.assertRaises(IntegrityError):
+                acquire_plan_job(self.profile, START_DATE)
+            self.assertEqual(filter_jobs.call_count, 2)
+
+    def running_job(self, start_date=START_DATE, started=None, lease_expires=None, attempts=1):
+        job, _ = acquire_plan_job(
+            self.profile, start_date, status=PlanGenerationJob.STATUS_RUNNING, worker_id='worker',
+            started_at=started or timezone.now(), lease_expires_at=lease_expires, attempts=attempts,
+        )
+        return job
+
+    def test_expired_leases_are_requeued(self):
+        now = timezone.now()
+        alive = self.running_job(started=now - timedelta(hours=1), lease_expires=now + timedelta(minutes=1))
+        expired = self.running_job(START_DATE + timedelta(days=7), lease_expires=now - timedelta(seconds=1))
+        exhausted = self.running_job(START_DATE + timedelta(days=14), lease_expires=now - timedelta(seconds=1), attempts=2)
+        never_leased = self.running_job(START_DATE + timedelta(days=21), started=now - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), (2, 1))
+        statuses = dict(PlanGenerationJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {
+            alive.pk: PlanGenerationJob.STATUS_RUNNING,
+            expired.pk: PlanGenerationJob.STATUS_QUEUED,
+            exhausted.pk: PlanGenerationJob.STATUS_FAILED,
+            never_leased.pk: PlanGenerationJob.STATUS_QUEUED,
+        })
+
+    def test_running_job_holds_a_lease(self):
+        acquire_plan_job(self.profile, START_DATE)
+        job = claim_next_job('worker')
+        self.assertGreater(job.lease_expires_at, timezone.now())
+        leases = []
+
+        def generate(profile, start_date):
+            leases.append(PlanGenerationJob.objects.get(pk=job.pk).lease_expires_at)
+            return make_plan(profile, start_date)
+
+        with mock.patch('rest.plan_jobs._get_generator', return_value=generate):
+            job = run_job(job)
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertGreaterEqual(leases[0], job.started_at + timedelta(seconds=900))
+
+    def test_requeued_job_is_finished_only_by_its_new_worker(self):
+        acquire_plan_job(self.profile, START_DATE)
+        stale = claim_next_job('stale-worker')
+        PlanGenerationJob.objects.filter(pk=stale.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        requeue_stale_jobs()
+        current = claim_next_job('current-worker')
+        self.assertEqual(current.pk, stale.pk)
+
+        stale = finish_job(stale, None, "Failed to generate fitness plan.")
+        self.assertEqual(stale.status, PlanGenerationJob.STATUS_RUNNING)
+        self.assertEqual(stale.worker_id, 'current-worker')
+        plan = make_plan(self.profile)
+        current = finish_job(current, plan)
+        self.assertEqual(current.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(current.plan, plan)
+
+
+class PlanRenewalTests(TestCase):
+    def test_only_profiles_without_next_weeks_plan_or_job_are_due(self):
+        today = START_DATE + timedelta(days=5)
+        due = make_profile('due')
+        make_plan(due)
+        renewed = make_profile('renewed')
+        make_plan(renewed)
+        make_plan(renewed, START_DATE + timedelta(days=7))
+        in_progress = make_profile('in-progress')
+        make_plan(in_progress)
+        acquire_plan_job(in_progress, START_DATE + timedelta(days=7))
+        not_yet = make_profile('not-yet')
+        make_plan(not_yet, START_DATE + timedelta(days=3))
+
+        self.assertEqual(
+            list(profiles_due_for_renewal(within_days=2, today=today)),
+            [(due, START_DATE + timedelta(days=7))],
+        )
+
+
+class PlanJobStartupTests(TransactionTestCase):
+    def test_queued_jobs_are_picked_up_at_startup(self):
+        profile = make_profile()
+        job, _ = acquire_plan_job(profile, START_DATE)
+        pool = PlanJobWorkerPool(workers=1, poll_interval=0.05)
+        with mock.patch('rest.apps.is_serving', return_value=True), \
+                mock.patch('rest.plan_jobs.get_worker_pool', return_value=pool), \
+                mock.patch('rest.plan_jobs._get_generator', return_value=make_plan):
+            apps.get_app_config('rest').ready()
+            try:
+                deadline = time.monotonic() + 10
+                while job.status in PlanGenerationJob.ACTIVE_STATUSES and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    job.refresh_from_db()
+            finally:
+                pool.stop(timeout=5)
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertIsNotNone(job.plan)
+
+
+class SlowBackend(PlanBackend):
+    name = 'slow'
+    delay = 0.5
+
+    def generate(self, prompt, user=None):
+        with track_ai_call(self.name, 'test', user=user) as call:
+            time.sleep(self.delay)
+            call.set_outcome(AICallRecord.OUTCOME_VALID)
+        return build_fallback_plan()
+
+
+class FastBackend(SlowBackend):
+    name = 'fast'
+    delay = 0
+
+
+class PlanRouterTests(TestCase):
+    def setUp(self):
+        self.router = PlanBackendRouter(
+            backend_names=['rest.tests.SlowBackend', 'rest.tests.FastBackend', 'fallback'],
+            latency_budget=30, failure_threshold=2,
+        )
+        self.slow, self.fast, self.fallback = self.router.backends
+
+    def test_backends_over_the_latency_budget_move_last(self):
+        self.assertEqual(self.router.route(), [self.slow, self.fast, self.fallback])
+        for latency in (10, 45, 50):
+            self.router.record(self.slow, latency, True)
+        self.router.record(self.fast, 5, True)
+        self.assertEqual(self.router.route(), [self.fast, self.fallback, self.slow])
+
+    def test_unavailable_and_failing_backends_are_skipped(self):
+        with mock.patch.object(self.slow, 'is_available', return_value=False):
+            self.assertEqual(self.router.route(), [self.fast, self.fallback])
+        self.router.record(self.fast, 1, False)
+        self.assertEqual(self.router.route(), [self.slow, self.fast, self.fallback])
+        self.router.record(self.fast, 1, False)
+        self.assertEqual(self.router.route(), [self.slow, self.fallback])
+
+
+@override_settings(PLAN_HEDGE_BACKEND='')
+class PlanHedgingTests(TransactionTestCase):
+    def test_hedged_calls_are_marked_on_their_own_records(self):
+        router = PlanBackendRouter(backend_names=['rest.tests.SlowBackend', 'rest.tests.FastBackend'])
+        plan_data, backend = router.generate_hedged("prompt", hedge_after=0.05)
+        self.assertEqual(backend.name, 'fast')
+        time.sleep(SlowBackend.delay + 0.2)
+        records = dict(AICallRecord.objects.values_list('backend', 'hedge_path'))
+        self.assertEqual(records, {'fast': AICallRecord.HEDGE_SECONDARY, 'slow': AICallRecord.HEDGE_CANCELLED})
+        self.assertEqual(set(AICallRecord.objects.values_list('purpose', flat=True)), {'plan-hedge'})
+        summary = summarize_ai_calls(timezone.now() - timedelta(minutes=1))
+        self.assertEqual(sum(group['calls'] for group in summary), 2)
+
+
+class AIArtifactTests(TestCase):
+    def test_equal_content_is_stored_once(self):
+        prompt = "Create a 7-day plan. " * 200
+        artifact = store_text(prompt)
+        self.assertEqual(store_text(prompt).pk, artifact.pk)
+        self.assertEqual(store_json({'b': 1, 'a': [1, 2]}).pk, store_json({'a': [1, 2], 'b': 1}).pk)
+        self.assertEqual(AIArtifact.objects.count(), 2)
+
+        stored = AIArtifact.objects.get(pk=artifact.pk)
+        self.assertEqual(stored.size, len(prompt))
+        self.assertLess(len(bytes(stored.data)), stored.size)
+        self.assertEqual(read_text(stored), prompt)
+        self.assertEqual(read_json(AIArtifact.objects.get(pk=store_json({'a': 1}).pk)), {'a': 1})
+
+    def test_plan_prompt_is_read_from_its_artifact(self):
+        plan = make_plan(make_profile())
+        self.assertEqual(plan.get_ai_prompt(), '')
+        plan.ai_prompt_artifact = store_text("Create a 7-day plan.")
+        plan.save()
+        plan = FitnessPlan.objects.get(pk=plan.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(plan.get_ai_prompt(), "Create a 7-day plan.")
+        self.assertEqual(len(queries), 1)
+
+
+class AIClientTests(TestCase):
+    def setUp(self):
+        self.breaker = ai_client.CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+        self.client = mock.Mock()
+        self.config = genai_types.GenerateContentConfig()
+        for target, value in (('breaker', self.breaker), ('get_client', lambda: self.client)):
+            patcher = mock.patch.object(ai_client, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_breaker_opens_half_opens_and_closes(self):
+        breaker = self.breaker
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker._opened_at -= breaker.recovery_timeout
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        breaker._opened_at -= breaker.recovery_timeout
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+    @override_settings(GEMINI_MAX_ATTEMPTS=3)
+    def test_only_retryable_errors_are_retried(self):
+        unavailable = genai_errors.ServerError(503, {'error': {'message': 'unavailable'}})
+        self.client.models.generate_content.side_effect = [unavailable, 'response']
+        with mock.patch('tenacity.nap.time.sleep'):
+            self.assertEqual(ai_client.generate_content('model', 'prompt', self.config), 'response')
+        self.assertEqual(self.client.models.generate_content.call_count, 2)
+
+        self.client.models.generate_content.reset_mock()
+        bad_request = genai_errors.ClientError(400, {'error': {'message': 'bad request'}})
+        self.client.models.generate_content.side_effect = bad_request
+        with self.assertRaises(genai_errors.ClientError):
+            ai_client.generate_content('model', 'prompt', self.config)
+        self.assertEqual(self.client.models.generate_content.call_count, 1)
+        self.assertEqual(self.breaker._failures, 0)
+
+    @override_settings(GEMINI_MAX_ATTEMPTS=10)
+    def test_retries_stop_at_the_deadline(self):
+        def time_out(**kwargs):
+            threading.Event().wait(0.1)
+            raise httpx.ConnectTimeout('timed out')
+
+        self.client.models.generate_content.side_effect = time_out
+        started = time.monotonic()
+        with mock.patch('tenacity.nap.time.sleep'):
+            with self.assertRaises(httpx.ConnectTimeout):
+                ai_client.generate_content('model', 'prompt', self.config, deadline=0.25)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.client.models.generate_content.call_count, 3)
+        for call in self.client.models.generate_content.call_args_list:
+            self.assertEqual(call.kwargs['config'].http_options.timeout, 1000)
+
+    def test_abandoned_stream_records_no_outcome(self):
+        self.breaker._state = self.breaker.OPEN
+        self.breaker._opened_at -= self.breaker.recovery_timeout
+        self.client.models.generate_content_stream.return_value = iter(['chunk', 'chunk'])
+        stream = ai_client.generate_content_stream('model', 'prompt', self.config)
+        self.assertEqual(next(stream), 'chunk')
+        stream.close()
+        self.assertEqual(self.breaker.state, self.breaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow_request())
+
+        self.breaker.release_trial()
+        self.client.models.generate_content_stream.return_value = iter(['chunk', 'chunk'])
+        self.assertEqual(list(ai_client.generate_content_stream('model', 'prompt', self.config)), ['chunk', 'chunk'])
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+
+
+class AITelemetryTests(TestCase):
+    @override_settings(AI_MODEL_PRICES={'gemini-test': (0.30, 2.50)})
+    def test_estimated_cost_is_recorded_and_summed(self):
+        for backend, model in [('gemini', 'gemini-test'), ('gemini', 'gemini-unpriced'), ('local', 'model.gguf')]:
+            with track_ai_call(backend, model) as call:
+                call.set_usage(1_000_000, 200_000)
+                call.set_outcome(AICallRecord.OUTCOME_VALID)
+        costs = dict(AICallRecord.objects.values_list('model', 'estimated_cost_usd'))
+        self.assertEqual(costs['gemini-test'], Decimal('0.8'))
+        self.assertIsNone(costs['gemini-unpriced'])
+        self.assertEqual(costs['model.gguf'], 0)
+        summary = summarize_ai_calls(timezone.now() - timedelta(minutes=1))
+        self.assertAlmostEqual(sum(group['estimated_cost_usd'] for group in summary), 0.8)
+
+    def test_percentiles_are_read_without_loading_the_records(self):
+        AICallRecord.objects.bulk_create([
+            AICallRecord(
+                backend='gemini', model='gemini-test', latency_ms=latency, validation_outcome=AICallRecord.OUTCOME_VALID,
+                time_to_first_byte_ms=latency // 10 if latency <= 50 else None,
+            )
+            for latency in range(100, 0, -1)
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            [group] = summarize_ai_calls(timezone.now() - timedelta(minutes=1))
+        self.assertEqual(group['latency_ms'], {'p50': 50, 'p95': 95, 'p99': 99})
+        self.assertEqual(group['time_to_first_byte_ms'], {'p50': 2, 'p95': 4, 'p99': 5})
+        self.assertEqual(len(queries), 7)
+        self.assertTrue(all('LIMIT 1' in query['sql'] for query in queries.captured_queries[1:]))
+
+
+class FallbackPlanTests(TestCase):
+    def assert_meets_targets(self, profile, fields=('calories', 'protein_grams')):
+        targets = compute_nutrition_targets(profile)
+        days = build_fallback_plan(profile).nutrition_days
+        self.assertEqual(len(days), 7)
+        for day in days:
+            for field in fields:
+                total = sum(getattr(meal, field) for meal in day.meals)
+                self.assertAlmostEqual(total, targets[f'target_{field}'], delta=targets[f'target_{field}'] * 0.1)
+        return targets, days
+
+    def test_meals_meet_nutrition_targets(self):
+        targets, days = self.assert_meets_targets(make_profile())
+        # Carbs and fat follow the catalog meals, so they only match over the week
+        for field in ('carbs_grams', 'fats_grams'):
+            mean = sum(getattr(meal, field) for day in days for meal in day.meals) / len(days)
+            self.assertAlmostEqual(mean, targets[f'target_{field}'], delta=targets[f'target_{field}'] * 0.15)
+
+    def test_vegan_meals_meet_protein_target(self):
+        self.assert_meets_targets(make_profile(dietary_preferences='vegan'))
+
+    def test_protein_side_is_not_an_ingredient_of_its_meal(self):
+        catalog = {meal[1]: meal[8] for meal in MEALS + PROTEIN_SIDES}
+        sides = 0
+        for username in ('pescatarian', 'pescatarian-2', 'pescatarian-3'):
+            _, days = self.assert_meets_targets(make_profile(username, dietary_preferences='pescatarian'))
+            for day in days:
+                for meal in day.meals:
+                    description, _, side = meal.description.partition(' plus ')
+                    if side:
+                        sides += 1
+                        self.assertFalse(set(catalog[description]) & set(catalog[side]), meal.description)
+        self.assertGreater(sides, 0)
+
+    def test_allergies_are_respected(self):
+        profile = make_profile(allergies='peanut, soy', dietary_preferences='vegetarian')
+        for day in build_fallback_plan(profile).nutrition_days:
+            for meal in day.meals:
+                self.assertNotIn('groundnut', meal.description.lower())
+                self.assertNotIn('soy', meal.description.lower())
+
+
+class NutritionTargetsTests(TestCase):
+    def test_profile_without_body_data_gets_default_targets(self):
+        profile = make_profile(current_weight=None, height=None, age=None, gender=None)
+        plan_data = build_fallback_plan(profile)
+        for day in plan_data.nutrition_days:
+            # As written by the model in the meals-only schema
+            day.target_calories = day.target_protein_grams = day.target_water_litres = None
+        router = mock.Mock()
+        router.generate.return_value = (plan_data, mock.Mock(cacheable=False))
+        with mock.patch('rest.ai_service.get_router', return_value=router), \
+                mock.patch('rest.ai_service.get_cached_plan', return_value=None):
+            plan = generate_and_save_plan_for_user(profile, START_DATE)
+        for day in plan.nutrition_days.all():
+            self.assertEqual(day.target_calories, DEFAULT_TARGETS['target_calories'])
+            self.assertEqual(day.target_protein_grams, DEFAULT_TARGETS['target_protein_grams'])
+            self.assertEqual(day.target_water_litres, DEFAULT_TARGETS['target_water_litres'])
+
+
+class WireSchemaTests(TestCase):
+    def test_compact_plan_round_trip(self):
+        plan = build_fallback_plan(make_profile())
+        for schema in (CompactPlanSchema, CompactPlanMealsSchema):
+            expanded = expand_plan(compact_plan(plan, schema))
+            self.assertEqual(expanded.workout_days, plan.workout_days)
+            self.assertEqual(
+                [day.meals for day in expanded.nutrition_days], [day.meals for day in plan.nutrition_days]
+            )
+        self.assertEqual(expand_plan(compact_plan(plan)), plan)
+        self.assertEqual(parse_plan(to_wire(plan, CompactPlanSchema), CompactPlanSchema), plan)
+
+
+class PlanRepairTests(TestCase):
+    def setUp(self):
+        self.plan = build_fallback_plan()
+        self.text = self.plan.model_dump_json()
+
+    def test_truncated_plan_is_closed_and_filled(self):
+        cut = self.text.index('"day_of_week":5', self.text.index('nutrition_days')) + 40
+        plan_data, report = repair_plan(self.text[:cut])
+        self.assertTrue(report.truncated)
+        self.assertEqual(plan_data.workout_days, self.plan.workout_days)
+        self.assertEqual(plan_data.nutrition_days[:4], self.plan.nutrition_days[:4])
+        self.assertEqual([day.day_of_week for day in plan_data.nutrition_days], list(range(1, 8)))
+        self.assertEqual(report.filled_days['nutrition_days'], [5, 6, 7])
+
+    def test_missing_days_are_regenerated(self):
+        data = json.loads(self.text)
+        data['workout_days'] = [day for day in data['workout_days'] if day['day_of_week'] != 3]
+        data['nutrition_days'] = [day for day in data['nutrition_days'] if day['day_of_week'] != 6]
+        requested = []
+
+        def regenerate_days(field, missing_days):
+            requested.append((field, missing_days))
+            return [day for day in getattr(self.plan, field) if day.day_of_week in missing_days]
+
+        plan_data, report = repair_plan(json.dumps(data), regenerate_days)
+        self.assertEqual(requested, [('workout_days', [3]), ('nutrition_days', [6])])
+        self.assertEqual(plan_data, self.plan)
+        self.assertEqual(report.regenerated_days, {'workout_days': [3], 'nutrition_days': [6]})
+
+    def test_unusable_response_is_rejected(self):
+        self.assertIsNone(repair_plan('{"workout_days": [')[0])
+        self.assertIsNone(repair_plan("Sorry, I can't help with that.")[0])
+
+    def test_plan_without_workout_days_is_rejected(self):
+        data = json.loads(self.text)
+        for workout_days in ([], [{'day_of_week': 1}], [{'day_of_week': 1, 'is_rest_day': True}]):
+            data['workout_days'] = workout_days
+            plan_data, report = repair_plan(json.dumps(data), lambda field, missing_days: None)
+            self.assertIsNone(plan_data)
+            self.assertEqual(report.filled_days['workout_days'], [])
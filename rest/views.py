@@ -6,18 +6,28 @@ from rest_framework import permissions, viewsets, authentication
 from rest_framework.decorators import action, authentication_classes
 from rest_framework.response import Response
 
-from .ai_service import generate_and_save_plan_for_user
-# from ai_local.services import generate_and_save_local_plan_for_user as generate_and_save_plan_for_user
+from .plan_jobs import enqueue_plan_job
+from .plan_materializer import find_overlapping_plans, PlanOverlapError
+from .plan_archetypes import materialize_archetype_plan
+from .plan_cache import get_plan_cache_stats
+from .plan_backends import get_router
+from .ai_telemetry import summarize_ai_call_windows, WINDOWS as AI_CALL_WINDOWS
+from .plan_streaming import stream_plan_for_user, format_sse
+from . import plan_regeneration
+from .plan_regeneration import RegenerationError, RegenerationConflict
 from .serializers import (
     FitnessPlanSerializer, UserSerializer, ProfileSerializer, EmailAuthTokenSerializer,
-    WorkoutTrackingSerializer, MealTrackingSerializer, WaterTrackingSerializer
+    WorkoutTrackingSerializer, MealTrackingSerializer, WaterTrackingSerializer,
+    PlanGenerationJobSerializer, WorkoutDaySerializer, NutritionDaySerializer, MealSerializer,
 )
 from .models import (
  Profile, WorkoutTracking, MealTracking, 
  Exercise, Meal, FitnessPlan, WorkoutDay, NutritionDay,
- WaterTracking,
+ WaterTracking, PlanGenerationJob,
 )
+from django.conf import settings
 from django.db.models import Count, Q, Sum
+from django.http import StreamingHttpResponse
 from datetime import datetime, date, timedelta
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
@@ -30,7 +40,7 @@ from dj_rest_auth.registration.views import SocialLoginView
 from .google_calender_service import create_calendar_events_for_plan, delete_calendar_events_for_plan, delete_entire_fitpal_calendar
 from allauth.socialaccount.models import SocialAccount, SocialToken
 
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.views import APIView
 
 class LoginView(generics.GenericAPIView):
@@ -214,11 +224,44 @@ class UserViewSet(viewsets.ModelViewSet):
             serializer.save()
             return Response(serializer.data)
 
+    def _validate_plan_start_date(self, request, profile):
+        """
+        Parses and validates the start_date of a new plan request.
+        Returns (start_date, None), or (None, error response).
+        """
+        start_date_str = request.data.get('start_date')
+        print(f'Start date: {start_date_str}')
+
+        if not start_date_str:
+            return None, Response({"detail": "start_date is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Use dateutil.parser for robust ISO 8601 parsing
+            from dateutil.parser import isoparse
+            start_date = isoparse(start_date_str).date()
+        except (ValueError, ImportError):
+            # Fallback or error for invalid format
+            return None, Response({"detail": "Invalid date format. Use ISO 8601 format."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+        # check if start_date is 7 days less than today
+        if (date.today() - start_date).days > 6:
+            return None, Response({"detail": "Cannot create plan for a past date."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+        # Check for overlapping plans
+        # (re-checked when the generated plan is saved)
+        if find_overlapping_plans(profile, start_date).exists():
+            return None, Response({"detail": "A plan already exists for the selected date range."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return start_date, None
+
     @action(detail=False, methods=['get', 'post', 'delete'], url_path='me/plans')
     def me_plans(self, request):
         """
         GET: Retrieve fitness plans for the authenticated user.
-        POST: Generate a new fitness plan for the authenticated user.
+        POST: Queue generation of a new fitness plan for the authenticated user.
+              A first plan is created from the archetype library when possible.
         """
         try:
             profile = request.user.profile
@@ -226,54 +269,50 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Profile not found. Please create a profile first."}, status=status.HTTP_404_NOT_FOUND)
         
         if request.method == 'GET':
-            plans = profile.fitness_plans.all()
+            # The AI prompt/response of older plans are not serialized; skip loading them
+            plans = profile.fitness_plans.defer('ai_prompt_text', 'ai_response_raw')
             
             plans.order_by("created_at")
             serializer = FitnessPlanSerializer(plans, many=True)
             return Response(serializer.data)
         
         if request.method == 'POST':
-            start_date_str = request.data.get('start_date')
-            print(f'Start date: {start_date_str}')
+            start_date, error_response = self._validate_plan_start_date(request, profile)
+            if error_response:
+                return error_response
 
-            if not start_date_str:
-                return Response({"detail": "start_date is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            try:
-                # Use dateutil.parser for robust ISO 8601 parsing
-                from dateutil.parser import isoparse
-                start_date = isoparse(start_date_str).date()
-            except (ValueError, ImportError):
-                # Fallback or error for invalid format
-                return Response({"detail": "Invalid date format. Use ISO 8601 format."}, status=status.HTTP_400_BAD_REQUEST)
-            
-
-            # check if start_date is 7 days less than today
-            if (date.today() - start_date).days > 6:
-                return Response({"detail": "Cannot create plan for a past date."}, status=status.HTTP_400_BAD_REQUEST)
-
-
-            # Check for overlapping plans
-            overlapping_plans = FitnessPlan.objects.filter(
-                profile=profile,
-                start_date__lte=start_date,
-                end_date__gte=start_date
+            # A first plan comes straight from the archetype library when one
+            # matches the profile, and is personalized in the background.
+            use_archetype = (
+                getattr(settings, 'PLAN_ARCHETYPES_ENABLED', True)
+                and not profile.fitness_plans.exists()
+                and not profile.plan_jobs.filter(start_date=start_date, status__in=PlanGenerationJob.ACTIVE_STATUSES).exists()
             )
-            if overlapping_plans.exists():
-                return Response({"detail": "A plan already exists for the selected date range."}, status=status.HTTP_400_BAD_REQUEST)
-            
-
-            # IMPORTANT: This is a long-running task.
-            # In production, this should be offloaded to a background worker (e.g., Celery).
-            plan = generate_and_save_plan_for_user(profile, start_date)
-            if plan:
-                serializer = FitnessPlanSerializer(plan)
-                return Response({
-                    "message": "Fitness plan generated successfully.",
-                    "plan": serializer.data
-                }, status=status.HTTP_201_CREATED)
-            else:
-                return Response({"detail": "Failed to generate fitness plan."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if use_archetype:
+                try:
+                    plan = materialize_archetype_plan(profile, start_date)
+                except PlanOverlapError as e:
+                    return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                if plan:
+                    job = None
+                    if getattr(settings, 'PLAN_ARCHETYPE_PERSONALIZE', True):
+                        job, _ = enqueue_plan_job(profile, start_date, plan=plan)
+                    return Response({
+                        "message": "Fitness plan created." + (" It is being personalized." if job else ""),
+                        "plan": FitnessPlanSerializer(plan).data,
+                        "job": PlanGenerationJobSerializer(job).data if job else None,
+                    }, status=status.HTTP_201_CREATED)
+
+            # Generation takes tens of seconds, so it is queued for the
+            # background workers and the client polls me/plan-jobs/<id>.
+            # A repeated request attaches to the job already in flight.
+            job, created = enqueue_plan_job(profile, start_date)
+            serializer = PlanGenerationJobSerializer(job)
+            return Response({
+                "message": "Fitness plan generation started." if created else "Fitness plan generation already in progress.",
+                "job": serializer.data
+            }, status=status.HTTP_202_ACCEPTED)
             
         if request.method == 'DELETE':
             # This action is not typically used for listing endpoints, but if needed:
@@ -290,6 +329,129 @@ class UserViewSet(viewsets.ModelViewSet):
             except Exception as e:
                 return Response({'detail': "Internal Server Error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
+    @action(detail=False, methods=['post'], url_path='me/plans/stream')
+    def me_plans_stream(self, request):
+        """
+        POST: Generate a new fitness plan and stream it as Server-Sent Events.
+        Emits a 'workout_day' or 'nutrition_day' event as each day is generated,
+        then a 'plan' event with the saved plan, or an 'error' event.
+        If the same plan is already being generated, only emits 'waiting' with
+        the job id; poll me/plan-jobs/<id> for the result.
+        """
+        try:
+            profile = request.user.profile
+        except Profile.DoesNotExist:
+            return Response({"detail": "Profile not found. Please create a profile first."}, status=status.HTTP_404_NOT_FOUND)
+
+        start_date, error_response = self._validate_plan_start_date(request, profile)
+        if error_response:
+            return error_response
+
+        def event_stream():
+            for event, data in stream_plan_for_user(profile, start_date):
+                if event == 'plan':
+                    data = FitnessPlanSerializer(data).data
+                yield format_sse(event, data)
+
+        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # stop proxies from buffering the stream
+        return response
+
+    @action(detail=False, methods=['get'], url_path=r'me/plan-jobs/(?P<job_id>[0-9]+)')
+    def me_plan_job(self, request, job_id=None):
+        """
+        GET: Report the status of a plan generation job, and the plan once it has succeeded.
+        """
+        try:
+            job = PlanGenerationJob.objects.select_related('plan').get(pk=job_id, profile__user=request.user)
+        except PlanGenerationJob.DoesNotExist:
+            return Response({"detail": "Plan job not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = PlanGenerationJobSerializer(job)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path=r'me/plans/(?P<plan_id>[0-9]+)/ai-artifacts')
+    def me_plan_ai_artifacts(self, request, plan_id=None):
+        """
+        GET: The prompt sent to the AI and its raw response for one of the user's plans.
+        """
+        try:
+            plan = FitnessPlan.objects.select_related('ai_prompt_artifact', 'ai_response_artifact').get(
+                pk=plan_id, profile__user=request.user
+            )
+        except FitnessPlan.DoesNotExist:
+            return Response({"detail": "Plan not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "plan": plan.pk,
+            "prompt": plan.get_ai_prompt(),
+            "response": plan.get_ai_response(),
+        })
+
+    @action(detail=False, methods=['post'], url_path=r'me/plans/(?P<plan_id>[0-9]+)/workout-days/(?P<day_of_week>[1-7])/regenerate')
+    def regenerate_workout_day(self, request, plan_id=None, day_of_week=None):
+        """
+        POST: Regenerate one workout day of a plan, keeping the rest of the plan.
+        Optional body: {"feedback": "What to change"}
+        """
+        try:
+            workout_day = WorkoutDay.objects.select_related('plan__profile__user').get(
+                plan_id=plan_id, plan__profile__user=request.user, day_of_week=day_of_week
+            )
+        except WorkoutDay.DoesNotExist:
+            return Response({"detail": "Workout day not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            workout_day = plan_regeneration.regenerate_workout_day(workout_day, request.data.get('feedback', ''))
+        except RegenerationConflict as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        except RegenerationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(WorkoutDaySerializer(workout_day).data)
+
+    @action(detail=False, methods=['post'], url_path=r'me/plans/(?P<plan_id>[0-9]+)/nutrition-days/(?P<day_of_week>[1-7])/regenerate')
+    def regenerate_nutrition_day(self, request, plan_id=None, day_of_week=None):
+        """
+        POST: Regenerate the meals of one nutrition day of a plan.
+        Optional body: {"feedback": "What to change"}
+        """
+        try:
+            nutrition_day = NutritionDay.objects.select_related('plan__profile__user').get(
+                plan_id=plan_id, plan__profile__user=request.user, day_of_week=day_of_week
+            )
+        except NutritionDay.DoesNotExist:
+            return Response({"detail": "Nutrition day not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            nutrition_day = plan_regeneration.regenerate_nutrition_day(nutrition_day, request.data.get('feedback', ''))
+        except RegenerationConflict as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        except RegenerationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(NutritionDaySerializer(nutrition_day).data)
+
+    @action(detail=False, methods=['post'], url_path=r'me/meals/(?P<meal_id>[0-9]+)/regenerate')
+    def regenerate_meal(self, request, meal_id=None):
+        """
+        POST: Regenerate a single meal.
+        Optional body: {"feedback": "What to change"}
+        """
+        try:
+            meal = Meal.objects.select_related('nutrition_day__plan__profile__user').get(
+                pk=meal_id, nutrition_day__plan__profile__user=request.user
+            )
+        except Meal.DoesNotExist:
+            return Response({"detail": "Meal not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            meal = plan_regeneration.regenerate_meal(meal, request.data.get('feedback', ''))
+        except RegenerationConflict as e:
+            return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+        except RegenerationError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(MealSerializer(meal).data)
+
     @action(detail=False, methods=['get', 'post', 'delete'], url_path='me/workout-tracking')
     def workout_tracking(self, request):
         """
@@ -637,6 +799,45 @@ class StatusView(APIView):
         return Response({"status": "ok"}, status=status.HTTP_200_OK)
 
 
+class PlanCacheStatsView(APIView):
+    """
+    Staff-only view reporting hit-rate counters of the generated plan cache.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_plan_cache_stats(), status=status.HTTP_200_OK)
+
+
+class PlanBackendStatsView(APIView):
+    """
+    Staff-only view reporting the health and rolling latency of the plan
+    generator backends in this process.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_router().get_stats(), status=status.HTTP_200_OK)
+
+
+class AICallStatsView(APIView):
+    """
+    Staff-only view reporting latency percentiles and token usage of AI calls.
+    Pass ?window=1h,24h to limit the time windows (default: 1h, 24h, 7d, 30d).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        windows = [w.strip() for w in request.query_params.get('window', '').split(',') if w.strip()]
+        unknown = [w for w in windows if w not in AI_CALL_WINDOWS]
+        if unknown:
+            return Response(
+                {"detail": f"Unknown window(s): {', '.join(unknown)}. Use {', '.join(AI_CALL_WINDOWS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(summarize_ai_call_windows(windows), status=status.HTTP_200_OK)
+
+
 class GoogleLogin(SocialLoginView):
     adapter_class = GoogleOAuth2Adapter
     # callback_url = 'http://localhost:3000' # frontend url
@@ -0,0 +1,208 @@
+# rest/wire_schema.py
+"""
+The compact wire schema the model writes plans in.
+
+Output tokens dominate generation latency, and the GeneratedPlanSchema
+keys ('rest_period_seconds', 'target_protein_grams', ...) are repeated for
+every exercise and meal. The wire schema uses one or two letter keys and
+single letter meal type codes instead; expand_plan() turns it back into a
+GeneratedPlanSchema without losing anything, and compact_plan() is its
+inverse.
+
+PLAN_WIRE_SCHEMA selects 'compact' (the default) or 'full'. With
+NUTRITION_TARGETS_ENABLED the nutrition days carry meals only, either way.
+Compare the two with `python manage.py benchmark_wire_schema`.
+"""
+import json
+from typing import List, Literal, Optional
+
+from django.conf import settings
+from pydantic import BaseModel, Field
+
+from .nutrition_targets import nutrition_targets_enabled
+from .schemas import GeneratedPlanSchema, GeneratedPlanMealsSchema
+
+MEAL_TYPE_CODES = {
+    'breakfast': 'b',
+    'lunch': 'l',
+    'dinner': 'd',
+    'snack': 's',
+}
+MEAL_TYPES = {code: meal_type for meal_type, code in MEAL_TYPE_CODES.items()}
+
+
+class CompactExercise(BaseModel):
+    n: str = Field(..., description="name, e.g. 'Push-ups'")
+    s: int = Field(..., description="sets")
+    m: float = Field(..., description="MET value")
+    d: int = Field(..., description="duration in minutes")
+    r: str = Field(..., description="reps, e.g. '10-12'")
+    rs: int = Field(..., description="rest between sets in seconds")
+    no: Optional[str] = Field(None, description="notes")
+
+
+class CompactWorkoutDay(BaseModel):
+    d: int = Field(..., ge=1, le=7, description="day of week, 1 for Monday")
+    t: str = Field(..., description="title, e.g. 'Upper Body Strength' or 'Rest Day'")
+    r: bool = Field(False, description="rest day")
+    ds: Optional[str] = Field(None, description="instructions for the day")
+    x: List[CompactExercise] = Field([], description="exercises, empty on rest days")
+
+
+class CompactMeal(BaseModel):
+    t: Literal['b', 'l', 'd', 's'] = Field(..., description="meal type: b=breakfast, l=lunch, d=dinner, s=snack")
+    ds: str = Field(..., description="description, e.g. 'Waakye with boiled egg and fish'")
+    c: int = Field(..., description="calories")
+    p: float = Field(..., description="protein grams")
+    cb: float = Field(..., description="carbs grams")
+    f: float = Field(..., description="fats grams")
+    ps: Optional[str] = Field(None, description="portion size, e.g. '1 medium ladle'")
+
+
+class CompactNutritionDayMeals(BaseModel):
+    d: int = Field(..., ge=1, le=7, description="day of week, 1 for Monday")
+    no: Optional[str] = Field(None, description="advice for the day")
+    m: List[CompactMeal] = Field(..., description="meals")
+
+
+class CompactNutritionDay(CompactNutritionDayMeals):
+    tc: Optional[int] = Field(None, description="target calories")
+    tp: Optional[int] = Field(None, description="target protein grams")
+    tcb: Optional[int] = Field(None, description="target carbs grams")
+    tf: Optional[int] = Field(None, description="target fats grams")
+    tw: Optional[float] = Field(None, description="target water litres")
+
+
+class CompactPlanSchema(BaseModel):
+    w: List[CompactWorkoutDay] = Field(..., description="workout days")
+    n: List[CompactNutritionDay] = Field(..., description="nutrition days")
+
+
+class CompactPlanMealsSchema(BaseModel):
+    w: List[CompactWorkoutDay] = Field(..., description="workout days")
+    n: List[CompactNutritionDayMeals] = Field(..., description="nutrition days")
+
+
+COMPACT_SCHEMAS = (CompactPlanSchema, CompactPlanMealsSchema)
+PLAN_SCHEMAS = (GeneratedPlanSchema, GeneratedPlanMealsSchema) + COMPACT_SCHEMAS
+
+# The exercise, workout day, meal and nutrition day keys: (wire key, GeneratedPlanSchema key)
+EXERCISE_KEYS = [('n', 'name'), ('s', 'sets'), ('m', 'met_value'), ('d', 'duration_mins'), ('r', 'reps'),
+                 ('rs', 'rest_period_seconds'), ('no', 'notes')]
+WORKOUT_DAY_KEYS = [('d', 'day_of_week'), ('t', 'title'), ('r', 'is_rest_day'), ('ds', 'description')]
+MEAL_KEYS = [('ds', 'description'), ('c', 'calories'), ('p', 'protein_grams'), ('cb', 'carbs_grams'),
+             ('f', 'fats_grams'), ('ps', 'portion_size')]
+NUTRITION_DAY_KEYS = [('d', 'day_of_week'), ('no', 'notes'), ('tc', 'target_calories'),
+                      ('tp', 'target_protein_grams'), ('tcb', 'target_carbs_grams'), ('tf', 'target_fats_grams'),
+                      ('tw', 'target_water_litres')]
+
+
+def _rename(data, keys):
+    return {new: data[old] for old, new in keys if old in data}
+
+
+def _swap(keys):
+    return [(full, short) for short, full in keys]
+
+
+def expand_plan(compact):
+    """A compact plan (either compact schema) as a GeneratedPlanSchema."""
+    data = compact.model_dump()
+    return GeneratedPlanSchema.model_validate({
+        'workout_days': [
+            {**_rename(day, WORKOUT_DAY_KEYS), 'exercises': [_rename(ex, EXERCISE_KEYS) for ex in day['x']]}
+            for day in data['w']
+        ],
+        'nutrition_days': [
+            {
+                **_rename(day, NUTRITION_DAY_KEYS),
+                'meals': [{'meal_type': MEAL_TYPES[meal['t']], **_rename(meal, MEAL_KEYS)} for meal in day['m']],
+            }
+            for day in data['n']
+        ],
+    })
+
+
+def compact_plan(plan_data: GeneratedPlanSchema, schema=CompactPlanSchema):
+    """
+    The inverse of expand_plan(). Meal types other than the four codes are
+    stored as snacks, which the Meal model would not accept anyway.
+    """
+    data = plan_data.model_dump()
+    return schema.model_validate({
+        'w': [
+            {**_rename(day, _swap(WORKOUT_DAY_KEYS)),
+             'x': [_rename(ex, _swap(EXERCISE_KEYS)) for ex in day['exercises']]}
+            for day in data['workout_days']
+        ],
+        'n': [
+            {
+                **_rename(day, _swap(NUTRITION_DAY_KEYS)),
+                'm': [{'t': MEAL_TYPE_CODES.get(meal['meal_type'], 's'), **_rename(meal, _swap(MEAL_KEYS))}
+                      for meal in day['meals']],
+            }
+            for day in data['nutrition_days']
+        ],
+    })
+
+
+def compact_wire_enabled():
+    return getattr(settings, 'PLAN_WIRE_SCHEMA', 'compact') == 'compact'
+
+
+def plan_generation_schema(compact=None):
+    """
+    The schema the model is asked to write a whole plan in. Pass
+    compact=False where the GeneratedPlanSchema keys are needed, like the
+    streaming parser.
+    """
+    if compact if compact is not None else compact_wire_enabled():
+        return CompactPlanMealsSchema if nutrition_targets_enabled() else CompactPlanSchema
+    return GeneratedPlanMealsSchema if nutrition_targets_enabled() else GeneratedPlanSchema
+
+
+def to_full_plan(plan_data):
+    """A plan generated with plan_generation_schema() as a GeneratedPlanSchema."""
+    if plan_data is None or isinstance(plan_data, GeneratedPlanSchema):
+        return plan_data
+    if isinstance(plan_data, COMPACT_SCHEMAS):
+        return expand_plan(plan_data)
+    return GeneratedPlanSchema.model_validate(plan_data.model_dump())
+
+
+def parse_plan(text, schema=None):
+    """Validates model output in the given (or the current) wire schema. Raises ValueError."""
+    return to_full_plan((schema or plan_generation_schema()).model_validate_json(text))
+
+
+def to_wire(plan_data: GeneratedPlanSchema, schema=None):
+    """plan_data as JSON text in the given (or the current) wire schema, without unset values."""
+    schema = schema or plan_generation_schema()
+    if schema in COMPACT_SCHEMAS:
+        wire = compact_plan(plan_data, schema)
+    else:
+        wire = schema.model_validate(plan_data.model_dump())
+    return wire.model_dump_json(exclude_none=True)
+
+
+KEY_LEGEND = (
+    "Keys: w=workout days, n=nutrition days. Workout day: d=day of week (1 Monday to 7 Sunday), t=title, "
+    "r=rest day, ds=description, x=exercises. Exercise: n=name, s=sets, m=MET value, d=duration in minutes, "
+    "r=reps, rs=rest seconds, no=notes. Nutrition day: d=day of week, no=notes, m=meals{targets}. Meal: "
+    "t=type (b=breakfast, l=lunch, d=dinner, s=snack), ds=description, c=calories, p/cb/f=protein/carbs/fats "
+    "grams, ps=portion size."
+)
+TARGETS_LEGEND = ", tc/tp/tcb/tf=target calories/protein/carbs/fats, tw=target water litres"
+
+
+def format_instructions(example: GeneratedPlanSchema):
+    """
+    How to write the plan, for prompts of models without structured output:
+    the key legend (compact schema only) and `example` in the wire schema.
+    """
+    schema = plan_generation_schema()
+    instructions = "Please respond with a valid JSON object following this exact structure:\n"
+    if schema in COMPACT_SCHEMAS:
+        legend = KEY_LEGEND.format(targets='' if schema is CompactPlanMealsSchema else TARGETS_LEGEND)
+        instructions = f"{legend}\n{instructions}"
+    return instructions + json.dumps(json.loads(to_wire(example, schema)), indent=1)